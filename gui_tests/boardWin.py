@@ -2,9 +2,11 @@ from time import sleep
 from pynvim import attach
 from pynvim.api import Nvim
 import utils
-from utils import BadFenError
-from chess import Board, Move
-from typing import Optional, Literal, Union
+from frame_scheduler import FrameScheduler
+from move_history import MoveHistory
+from chess import Board, Move, SQUARES, square_file, square_rank
+from functools import lru_cache
+from typing import Optional, Literal, Union, NamedTuple
 
 default_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 
@@ -24,6 +26,9 @@ PIECES = {
     "s": "\u2000",
 }
 
+# display columns of the 10 cells in every board row, rank label, 8 squares, right pad
+CELL_COLS = [0, 2, 5, 8, 11, 14, 17, 20, 23, 26]
+
 PIECES_ASCII = {
     "K": "K",
     "Q": "Q",
@@ -41,11 +46,79 @@ PIECES_ASCII = {
 }
 
 
+HL_WHITE_SQ = "ChessBoardWhiteSquare"
+HL_BLACK_SQ = "ChessBoardBlackSquare"
+HL_SPECIAL_WHITE_SQ = "ChessBoardSpecialWhiteSquare"
+HL_SPECIAL_BLACK_SQ = "ChessBoardSpecialBlackSquare"
+HL_BOARD_BORDER = "ChessBoardBorder"
+HL_PREMOVE = "ChessBoardPremove"
+
+# piece symbol -> the 3 column cell text of a square holding it
+PIECE_CELLS = {symbol: PIECES["s"] + glyph + PIECES["s"] for symbol, glyph in PIECES.items()}
+
+
+class SquareCell(NamedTuple):
+    row: int
+    col: int
+    base_hl: str
+    special: bool
+
+
+class BoardTable(NamedTuple):
+    """squares[square index] -> where the square is drawn and how it is highlighted when nothing is on top of it
+    base_grid holds the empty board rows (8 ranks and the file letters) as ([text, hl_group], ...) cells"""
+    squares: tuple[SquareCell, ...]
+    base_grid: tuple[tuple[tuple[str, str], ...], ...]
+
+
+def _is_special_square(variant: str, square: int) -> bool:
+    if variant == "racingKings":
+        return square_rank(square) == 7
+    if variant == "kingOfTheHill":
+        return square_file(square) in (3, 4) and square_rank(square) in (3, 4)
+    return False
+
+
+@lru_cache(maxsize=None)
+def board_table(variant: str, flip: bool) -> BoardTable:
+    """built once per variant and orientation"""
+    squares = []
+    for square in SQUARES:
+        file, rank = square_file(square), square_rank(square)
+        row = rank if flip else 7 - rank
+        # +1 to account for the rank label cell
+        col = (7 - file if flip else file) + 1
+        light = (file + rank) % 2 == 1
+        special = _is_special_square(variant, square)
+        if special:
+            base_hl = HL_SPECIAL_WHITE_SQ if light else HL_SPECIAL_BLACK_SQ
+        else:
+            base_hl = HL_WHITE_SQ if light else HL_BLACK_SQ
+        squares.append(SquareCell(row, col, base_hl, special))
+
+    base_grid = [
+        [(f"{rank + 1 if flip else 8 - rank} ", HL_BOARD_BORDER)] + [None] * 8 + [(" " * 2, HL_BOARD_BORDER)]
+        for rank in range(8)
+    ]
+    for cell in squares:
+        base_grid[cell.row][cell.col] = (PIECE_CELLS["s"], cell.base_hl)
+
+    files = [f" {chr(97 + i)} " for i in range(8)]
+    if flip:
+        files.reverse()
+    base_grid.append(
+        [(" " * 2, HL_BOARD_BORDER)] + [(f, HL_BOARD_BORDER) for f in files] + [(" " * 2, HL_BOARD_BORDER)]
+    )
+    return BoardTable(tuple(squares), tuple(tuple(row) for row in base_grid))
+
+
 class BoardWin:
     def __init__(
         self,
         session: Nvim,
+        frames: FrameScheduler,
         board: Board = Board(),
+        history: Optional[MoveHistory] = None,
         window_config: Optional[dict] = None,
         myside: Literal["black", "white"] = "white",
         variant: str = "standard",
@@ -53,15 +126,25 @@ class BoardWin:
         app_ns: int = None,
     ):
         self.neovim_session = session
+        self.frames = frames
         self.board = board
+        """moves are pushed through the history so their SAN is recorded once"""
+        self.history = history if history is not None else MoveHistory(board)
+        self.last_move: Union[str, Move] = ""
+        """a past position shown instead of the game, None shows the game"""
+        self.shown_board: Optional[Board] = None
+        self.shown_last_move: Union[str, Move] = ""
+        """queued premoves, their squares are highlighted on the live board"""
+        self.premoves: list[Move] = []
 
         self.buffer = utils.find_buf(session, "board_buffer") or utils.create_buf(
             session, "board_buffer"
         )
 
-        self.buffer[:] = [
+        # top padding, 8 ranks and the file letters, the board cells are overlaid on these lines
+        utils.buf_set_lines(self.neovim_session, self.buffer, [
             " " * 28,
-        ]
+        ] * 10)
         self.window = utils.find_window_from_title(
             session, "BoardWindow"
         ) or utils.create_window(
@@ -72,10 +155,14 @@ class BoardWin:
             or utils.config_gen(session, config="board"),
             "BoardWindow",
         )
-        self.neovim_session.api.win_set_option(self.window, "winhighlight", 'Normal:BoardWindowBackground,FloatBorder:BoardWindowFloatBorder')        
+        utils.win_set_local_winhighlight(self.neovim_session, self.window, 'Normal:BoardWindowBackground,FloatBorder:BoardWindowFloatBorder')
 
 
         self.namespace = app_ns or utils.namespace(self.neovim_session, "BoardSquaresNs")
+        utils.load_lua_file(self.neovim_session, "./gui_tests/lua/boardWin.lua")
+
+        """last grid sent to neovim, redraw only sends the cells that differ from it"""
+        self.rendered_grid: list[list[Optional[list]]] = [[None] * 10 for _ in range(9)]
 
 
         self.variant = variant
@@ -84,21 +171,21 @@ class BoardWin:
             self.flip = False
             
         self.theme = theme
-        self.hl_group_white_sq = "ChessBoardWhiteSquare"
-        self.hl_group_black_sq = "ChessBoardBlackSquare"
+        self.hl_group_white_sq = HL_WHITE_SQ
+        self.hl_group_black_sq = HL_BLACK_SQ
         self.hl_group_move_from = "ChessBoardMovedFrom"
         self.hl_group_move_to = "ChessBoardMovedTo"
         self.hl_group_checked = "ChessBoardChecked"
-        self.hl_group_board_border = "ChessBoardBorder"
-        self.hl_group_special_white_sq = "ChessBoardSpecialWhiteSquare"
-        self.hl_group_special_black_sq = "ChessBoardSpecialBlackSquare"
+        self.hl_group_board_border = HL_BOARD_BORDER
+        self.hl_group_special_white_sq = HL_SPECIAL_WHITE_SQ
+        self.hl_group_special_black_sq = HL_SPECIAL_BLACK_SQ
         self.hl_group_special_move_from = "ChessBoardSpecialMovedFrom"
         self.hl_group_special_move_to = "ChessBoardSpecialMovedTo"
             
         self.redraw("")
 
-        self.autocmd_group = self.neovim_session.api.create_augroup(
-            "BoardWinAuGroup", {"clear": True}
+        self.autocmd_group = utils.create_augroup(
+            self.neovim_session, "BoardWinAuGroup", {"clear": True}
         )
 
         utils.buf_add_hl(
@@ -108,12 +195,22 @@ class BoardWin:
             [self.hl_group_board_border, 0, 0, -1],
         )
 
+    def set_game(self, board: Board, history: MoveHistory, variant: str, myside: Literal["black", "white"]):
+        """draws another game's board, only the cells that differ from the shown one are sent"""
+        self.board = board
+        self.history = history
+        self.variant = variant
+        self.flip = myside != "white" and variant != "racingKings"
+        self.shown_board = None
+        self.redraw(board.peek() if board.move_stack else "")
+
     def flip_board(self):
         self.flip = not self.flip
         self.redraw(self.board.peek() if len(self.board.move_stack) != 0 else "")
 
     def set_autocmd(self, handle: int):
-        self.neovim_session.api.create_autocmd(
+        utils.create_autocmd(
+            self.neovim_session,
             "BufEnter",
             {
                 "group": self.autocmd_group,
@@ -127,180 +224,108 @@ class BoardWin:
         pass        
 
     def redraw(self, lastMove: Union[str, Move]):
-        utils.buf_set_extmark(self.neovim_session, *self._create_board_extmark(lastMove))
-        utils.force_redraw(nvim=self.neovim_session)
-
-    def is_legal_move(self, move: Move):
-        if move in self.board.legal_moves:
-            return True
+        """the board is rendered with the next frame"""
+        self.last_move = lastMove
+        self.frames.mark_dirty(self)
+
+    def set_premoves(self, premoves):
+        """premoves are the (san, move) pairs queued in the GameSession"""
+        moves = [move for _, move in premoves]
+        if moves != self.premoves:
+            self.premoves = moves
+            self.frames.mark_dirty(self)
+
+    def show_position(self, board: Board, lastMove: Union[str, Move]):
+        """shows board instead of the game until show_live(), moves pushed meanwhile are not drawn"""
+        self.shown_board = board
+        self.shown_last_move = lastMove
+        self.frames.mark_dirty(self)
+
+    def show_live(self):
+        self.shown_board = None
+        self.frames.mark_dirty(self)
+
+    def render(self):
+        if self.shown_board is not None:
+            grid = self._create_board_grid(self.shown_last_move, self.shown_board)
         else:
-            return False
+            grid = self._create_board_grid(self.last_move)
+        changed_cells = self._diff_grid(grid)
+        if not changed_cells:
+            return
+        utils.exec_lua(
+            self.neovim_session, "BoardWinSetCells(...)", self.buffer, self.namespace, changed_cells
+        )
+
+    def _diff_grid(self, grid: list[list[list]]) -> list[list]:
+        """returns [extmark_id, line, col, text, hl_group] for every cell that changed and remembers the new grid"""
+        changed_cells = []
+        for row, cells in enumerate(grid):
+            rendered_row = self.rendered_grid[row]
+            for col, cell in enumerate(cells):
+                if rendered_row[col] != cell:
+                    rendered_row[col] = cell
+                    # +1 line for the padding line at the top of the buffer
+                    changed_cells.append([row * 10 + col + 1, row + 1, CELL_COLS[col], cell[0], cell[1]])
+        return changed_cells
 
     def _set_current(self):
         self.neovim_session.current.buffer = self.buffer
 
     def kill_window(self):
-        self.neovim_session.api.win_close(self.window, True)
-        self.neovim_session.api.buf_delete(self.buffer, {"force": True})
+        self.frames.discard(self)
+        utils.win_del_force(self.neovim_session, self.window)
+        utils.buf_del_force(self.neovim_session, self.buffer)
 
     def resize(self):
-        self.neovim_session.api.win_set_config(
+        width, height = utils.workspace_size(self.neovim_session)
+        utils.win_set_config(
+            self.neovim_session,
             self.window,
             {
                 "relative": "editor",
-                "row": (utils.workspace_height(self.neovim_session) - 10) // 2,
-                "col": (utils.workspace_width(self.neovim_session) - 28 + 32) // 2, 
+                "row": (height - 10) // 2,
+                "col": (width - 28 + 32) // 2, 
             }
         )
-    @staticmethod
-    def _flip_board_fen(fen: list[str]):
-        _f = [l[::-1] for l in fen]
-        _f.reverse()
-        return _f
-
-    def _create_board_extmark(self, lastMove: Union[str, Move]):
-        """if you dont want to use last move highlighting pass in an empty string
-        as lastMove"""
-
-        _fen = self.board.board_fen().split("/")
-
-        border_line = [[" " * 2, self.hl_group_board_border]]
-        for i in range(8):
-            border_line.append([f" {chr(97+i)} ", self.hl_group_board_border])
-        border_line.append([" " * 2, self.hl_group_board_border])
-
-        if len(_fen) != 8:
-            raise BadFenError
-
-        formatted_fen = []
-        for row in _fen:
-            formatted_row = ""
-            for sq in row:
-                if sq.isdigit():
-                    formatted_row += "s" * int(sq)
-                else:
-                    formatted_row += sq
-            formatted_fen.append(formatted_row)
-
-        virt_lines = []
-        for i in range(8):
-            virt_line = [
-                [
-                    str(8 - i) + " ",
-                    self.hl_group_board_border,
-                ]
-            ]
-            for j in range(8):
-                virt_line.append(
-                    [
-                        PIECES["s"] + PIECES[formatted_fen[i][j]] + PIECES["s"],
-                        self.hl_group_white_sq
-                        if (i + j) % 2 == 0
-                        else self.hl_group_black_sq,
-                    ]
-                )
-            virt_line.append([" " * 2, self.hl_group_board_border])
-
-            virt_lines.append(virt_line)
-
-        if self.variant != "standard":
-            # +1 to account for the border
-            if self.variant == "racingKings":
-                for i in range(8):
-                    virt_lines[0][i+1][1] = self.hl_group_special_white_sq if i % 2 == 0 else self.hl_group_special_black_sq
-            elif self.variant == "kingOfTheHill":
-                virt_lines[3][3+1][1] = self.hl_group_special_white_sq 
-                virt_lines[3][4+1][1] = self.hl_group_special_black_sq
-                virt_lines[4][3+1][1] = self.hl_group_special_black_sq
-                virt_lines[4][4+1][1] = self.hl_group_special_white_sq
-    
+
+    def _create_board_grid(self, lastMove: Union[str, Move], board: Optional[Board] = None):
+        """returns the 8 ranks and the file letters row as rows of [text, hl_group] cells
+        if you dont want to use last move highlighting pass in an empty string
+        as lastMove, board defaults to the game's board"""
+        board = board or self.board
+        table = board_table(self.variant, self.flip)
+        squares = table.squares
+        grid = [[list(cell) for cell in row] for row in table.base_grid]
+
+        for square, piece in board.piece_map().items():
+            cell = squares[square]
+            grid[cell.row][cell.col][0] = PIECE_CELLS[piece.symbol()]
 
         if lastMove and lastMove != "":
             if isinstance(lastMove, str):
                 lastMove = Move.from_uci(lastMove)
-            from_sq = lastMove.from_square
-            to_sq = lastMove.to_square
-
-            # from square er kaj
-            from_sq_row = 7 - from_sq // 8
-            from_sq_col = (from_sq % 8) + 1
-
-            to_sq_row = 7 - to_sq // 8
-            to_sq_col = (to_sq % 8) + 1
-
-            if self.variant == "kingOfTheHill":
-                if from_sq_row == 0:
-                    virt_lines[from_sq_row][from_sq_col][1] = self.hl_group_special_move_from
-                if to_sq_row == 0:
-                    virt_lines[to_sq_row][to_sq_col][1] = self.hl_group_special_move_to
-            elif self.variant == "racingKings":
-                if from_sq_row == 3 or from_sq_row == 4:
-                    if from_sq_col == 4 or from_sq_col == 5:
-                        virt_lines[from_sq_row][from_sq_col][1] = self.hl_group_special_move_from                    
-                elif to_sq_row == 3 or to_sq_row == 4:
-                    if to_sq_col == 4 or to_sq_col == 5:
-                        virt_lines[to_sq_row][to_sq_col][1] = self.hl_group_special_move_to
-            else:
-                virt_lines[from_sq_row][from_sq_col][1] = self.hl_group_move_from
-                virt_lines[to_sq_row][to_sq_col][1] = self.hl_group_move_to
-
-        if self.board.is_check():
-            king_in_check_sq = self._find_king_square(self.board.turn)
-            assert king_in_check_sq, "King In Check Not Found"
-
-            checked_row = king_in_check_sq[0]
-            checked_col = king_in_check_sq[1] + 1
-
-            virt_lines[checked_row][checked_col][1] = self.hl_group_checked
-
-                
-        
-        
-        if self.flip:
-            virt_lines = [virt_line[::-1] for virt_line in virt_lines[::-1]]
-            border_line.reverse()
-
-            for i in range(8):
-                _temp = virt_lines[i][0]
-                virt_lines[i][0] = virt_lines[i][-1]
-                virt_lines[i][-1] = _temp
-
-        virt_lines.append(border_line)
-
-        _board_extmark = [
-            self.buffer,
-            self.namespace,
-            0,
-            0,
-            utils.ExtmarksOptions(id=1, virt_lines=virt_lines, virt_lines_leftcol=True),
-        ]
-        return _board_extmark
+            for square, hl, special_hl in (
+                (lastMove.from_square, self.hl_group_move_from, self.hl_group_special_move_from),
+                (lastMove.to_square, self.hl_group_move_to, self.hl_group_special_move_to),
+            ):
+                cell = squares[square]
+                grid[cell.row][cell.col][1] = special_hl if cell.special else hl
 
-    def draw_takeback_once(self):
-        # TODO
-        pass
-
-    def draw_push_move(self, move: Move):
-        self.board.push(move)
-        self.redraw(lastMove=move)
-
-    def _find_king_square(self, side: bool) -> int:
-        """returns 0-based [row, col]"""
-        king = "K" if side else "k"
-        rows = self.board.board_fen().split("/")
-        row = 0
-
-        for r in rows:
-            col = 0
-            for c in r:
-                if c.isdigit():
-                    col += int(c)
-                elif c == king:
-                    return [row, col]
-                else:
-                    col += 1
-            row += 1
-        return None
+        if board is self.board:
+            for move in self.premoves:
+                for square in (move.from_square, move.to_square):
+                    cell = squares[square]
+                    grid[cell.row][cell.col][1] = HL_PREMOVE
+
+        if board.is_check():
+            king_in_check_sq = board.king(board.turn)
+            assert king_in_check_sq is not None, "King In Check Not Found"
+
+            cell = squares[king_in_check_sq]
+            grid[cell.row][cell.col][1] = self.hl_group_checked
+
+        return grid
 
 def test():
     nvim = attach("tcp", "127.0.0.1", 6789)
@@ -311,11 +336,9 @@ def test():
         theme_file_path="themes/ayu_dark/.board"
     )
 
-    b.draw_push_move(Move.from_uci("e2e4"))
-    b.draw_push_move(Move.from_uci("e7e5"))
-    b.draw_push_move(Move.from_uci("d1f3"))
-    b.draw_push_move(Move.from_uci("d7d5"))
-    b.draw_push_move(Move.from_uci("f3f7"))
+    for uci in ("e2e4", "e7e5", "d1f3", "d7d5", "f3f7"):
+        b.history.push(b.board, Move.from_uci(uci))
+    b.redraw(b.board.peek())
 
     while True:
         try:
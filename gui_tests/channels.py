@@ -0,0 +1,71 @@
+from collections import deque
+from threading import Event, Lock
+from typing import Any, Callable, Hashable, Optional
+
+""" producer/consumer channels between the lichess runtime and the ui loop
+    producers never block, the consumer is woken once per batch and takes everything queued with drain()
+    a channel of snapshots (a game's gameState carries all of its moves and times) is given a coalesce key, once
+    it is full the snapshots superseded by a later one of the same key are dropped and nothing else is
+    any other full channel drops its oldest event and counts it in dropped, the consumer should resync from there
+    """
+
+
+class EventChannel:
+    def __init__(
+        self,
+        maxlen: int,
+        wakeup: Callable[[], None],
+        coalesce: Optional[Callable[[Any], Optional[Hashable]]] = None,
+    ):
+        """wakeup() is called from the producer thread, it must schedule a drain() on the consumer
+        coalesce(event) is the key of a snapshot event, None for an event that must be delivered"""
+        self.events: deque = deque()
+        self.maxlen = maxlen
+        self.wakeup = wakeup
+        self.coalesce = coalesce
+        self.woken = Event()
+        self.lock = Lock()
+        """events dropped since the channel was created"""
+        self.dropped = 0
+        # length that triggers the next compaction, a channel that stays full after one is compacted less often
+        self.limit = maxlen
+
+    def put(self, event: Any):
+        """thread-safe, never blocks"""
+        with self.lock:
+            self.events.append(event)
+            if len(self.events) > self.limit:
+                self._make_room()
+        if not self.woken.is_set():
+            self.woken.set()
+            self.wakeup()
+
+    def drain(self) -> list:
+        """single consumer only, returns everything queued so far in order"""
+        self.woken.clear()
+        with self.lock:
+            batch, self.events = list(self.events), deque()
+            self.limit = self.maxlen
+        return batch
+
+    def _make_room(self):
+        if self.coalesce is None:
+            self.events.popleft()
+            self.dropped += 1
+            return
+        # the newest snapshot of each key stays where it is, the order of everything kept is unchanged
+        seen = set()
+        kept = []
+        for event in reversed(self.events):
+            key = self.coalesce(event)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(event)
+        kept.reverse()
+        self.events = deque(kept)
+        self.limit = max(self.maxlen, 2 * len(kept))
+
+    def __len__(self) -> int:
+        return len(self.events)
@@ -0,0 +1,256 @@
+import asyncio
+import shlex
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+import chess.engine
+from chess import Board, Move
+
+from move_index import position_key
+
+""" live analysis of the shown position by a local UCI engine (stockfish or anything speaking UCI) through chess.engine
+    the engines run as asyncio subprocesses on the runtime's loop (LichessRuntime.loop), the ui only hands positions
+    over and gets EngineInfo back through the deliver callback
+    engines are kept in an EnginePool, an engine is started once and reused by every analysis after it
+    an Analysis restarts the engine when the position changes, the engine keeps its hash between the positions of
+    a game (ucinewgame only when the game changes) and the pv of the last info is carried over: when the new position
+    is the old one plus the first pv move, the rest of the pv is shown until the engine has something for it
+    engines report many info lines per second at low depths, only the newest one is delivered, at most max_rate per second
+    """
+
+
+class EngineInfo(NamedTuple):
+    """score is from white's side, "+0.35", "#3" (white mates) or "#-3", the result once the game is over"""
+    score: str
+    depth: int
+    """principal variation in SAN"""
+    pv: list[str]
+    nodes: Optional[int] = None
+    """shown for the new position from the previous position's pv until the engine reports"""
+    carried: bool = False
+
+
+def score_string(score: chess.engine.PovScore) -> str:
+    white = score.white()
+    if white.is_mate():
+        return f"#{white.mate()}"
+    return f"{white.score() / 100:+.2f}"
+
+
+def pv_sans(board: Board, pv: list[Move], limit: int = 12) -> list[str]:
+    """the first limit moves of pv in SAN, cut at the first move that is not legal on board"""
+    board = board.copy(stack=False)
+    sans = []
+    for move in pv[:limit]:
+        if not board.is_legal(move):
+            break
+        sans.append(board.san(move))
+        board.push(move)
+    return sans
+
+
+def game_over_info(board: Board) -> EngineInfo:
+    return EngineInfo(board.result(), 0, [])
+
+
+class EnginePool:
+    def __init__(
+        self,
+        command: str,
+        loop: asyncio.AbstractEventLoop,
+        size: int = 2,
+        options: Optional[dict[str, Any]] = None,
+    ):
+        """command is a shell-like string ("stockfish", "python3 stub_uci_engine.py"), size idle engines are kept
+        running for the next analysis, the rest quit when released, nothing is started before the first acquire"""
+        self.command = shlex.split(command)
+        self.loop = loop
+        self.size = size
+        self.options = options or {}
+        self.idle: list[chess.engine.UciProtocol] = []
+        """every running engine, idle or analysing, close() quits all of them"""
+        self.engines: dict[chess.engine.UciProtocol, asyncio.SubprocessTransport] = {}
+
+    async def acquire(self) -> chess.engine.UciProtocol:
+        """an idle engine or a new one, must run on the loop"""
+        while self.idle:
+            engine = self.idle.pop()
+            if not engine.returncode.done():
+                return engine
+            self.engines.pop(engine, None)
+        transport, engine = await chess.engine.popen_uci(self.command)
+        self.engines[engine] = transport
+        if self.options:
+            await engine.configure(self.options)
+        return engine
+
+    async def release(self, engine: chess.engine.UciProtocol):
+        if engine.returncode.done():
+            self.engines.pop(engine, None)
+        elif len(self.idle) < self.size:
+            self.idle.append(engine)
+        else:
+            await self._quit(engine)
+
+    def close(self, timeout: float = 2):
+        """quits every engine, called from the ui before the loop stops"""
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(timeout), self.loop).result(timeout + 1)
+        except Exception:
+            pass
+
+    async def _close(self, timeout: float):
+        self.idle.clear()
+        engines = list(self.engines)
+        await asyncio.gather(*(asyncio.wait_for(self._quit(engine), timeout) for engine in engines), return_exceptions=True)
+        # an engine that did not quit in time is killed
+        for transport in self.engines.values():
+            transport.close()
+        self.engines.clear()
+
+    async def _quit(self, engine: chess.engine.UciProtocol):
+        try:
+            await engine.quit()
+        except chess.engine.EngineError:
+            pass
+        transport = self.engines.pop(engine, None)
+        if transport:
+            transport.close()
+
+
+class Analysis:
+    def __init__(
+        self,
+        pool: EnginePool,
+        deliver: Callable[..., None],
+        on_info: Callable[[EngineInfo], None],
+        on_error: Optional[Callable[[Exception], None]] = None,
+        limit: Optional[chess.engine.Limit] = None,
+        max_rate: float = 4,
+    ):
+        """deliver(fn, *args) must schedule fn(*args) on the ui loop, on_info(EngineInfo) is delivered there
+        limit None analyses until the position changes"""
+        self.pool = pool
+        self.loop = pool.loop
+        self.deliver = deliver
+        self.on_info = on_info
+        self.on_error = on_error
+        self.limit = limit
+        self.min_interval = 1 / max_rate
+
+        # the rest is only touched on the loop
+        """newest position handed over, None pauses the engine"""
+        self.board: Optional[Board] = None
+        self.game: object = None
+        self.key: Optional[tuple] = None
+        self.changed = asyncio.Event()
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+        self.current: Optional[chess.engine.AnalysisResult] = None
+        """info waiting for the next delivery slot, engine lines stay (board, info) until they are delivered so
+        the ones replaced in between are never converted to SAN"""
+        self.latest: Optional[Union[EngineInfo, tuple[Board, dict]]] = None
+        self.last_delivery = 0.0
+        self.delivery_pending = False
+        """position key after the first pv move -> the info it starts from"""
+        self.carry: Optional[tuple[tuple, EngineInfo]] = None
+
+    def set_position(self, board: Board, game: object = None):
+        """analyses board from now on, game identifies the game so the engine keeps its hash between its positions
+        the same position again does not restart the engine"""
+        board = board.copy()
+        self.loop.call_soon_threadsafe(self._set_position, board, position_key(board), game)
+
+    def pause(self):
+        """stops the engine, the next set_position resumes"""
+        self.loop.call_soon_threadsafe(self._set_position, None, None, self.game)
+
+    def close(self):
+        """stops the analysis and gives the engine back to the pool"""
+        self.loop.call_soon_threadsafe(self._close)
+
+    def _set_position(self, board: Optional[Board], key: Optional[tuple], game: object):
+        if self.closed or (key == self.key and game == self.game):
+            return
+        self.board, self.key, self.game = board, key, game
+        self.latest = None
+        # a new position is shown right away, the throttle only holds back the engine's lines
+        if board is not None and self.carry and self.carry[0] == key:
+            self.latest = self.carry[1]
+            self._deliver()
+        self.carry = None
+        if self.current:
+            self.current.stop()
+        self.changed.set()
+        if self.task is None:
+            self.task = self.loop.create_task(self._run())
+
+    def _close(self):
+        self.closed = True
+        self.board = None
+        if self.current:
+            self.current.stop()
+        self.changed.set()
+
+    async def _run(self):
+        engine = None
+        try:
+            engine = await self.pool.acquire()
+            while not self.closed:
+                await self.changed.wait()
+                self.changed.clear()
+                board = self.board
+                if board is None:
+                    continue
+                if board.is_game_over():
+                    self._post(game_over_info(board))
+                    continue
+                self.current = await engine.analysis(board, self.limit, game=self.game)
+                with self.current:
+                    async for info in self.current:
+                        if "pv" in info and "score" in info and self.board is board:
+                            self._post((board, info))
+                self.current = None
+        except Exception as e:
+            if self.on_error and not self.closed:
+                self.deliver(self.on_error, e)
+        finally:
+            self.current = None
+            self.task = None
+            if engine is not None:
+                await self.pool.release(engine)
+
+    def _info(self, board: Board, info: dict) -> EngineInfo:
+        pv = info["pv"]
+        engine_info = EngineInfo(
+            score_string(info["score"]), info.get("depth", 0), pv_sans(board, pv), info.get("nodes")
+        )
+        if len(pv) > 1 and board.is_legal(pv[0]):
+            board = board.copy(stack=False)
+            board.push(pv[0])
+            self.carry = (position_key(board), engine_info._replace(depth=max(engine_info.depth - 1, 0), pv=engine_info.pv[1:], carried=True))
+        return engine_info
+
+    def _post(self, info: Union[EngineInfo, tuple[Board, dict]]):
+        """keeps the newest info, it is delivered when the last delivery is min_interval old"""
+        self.latest = info
+        if self.delivery_pending:
+            return
+        wait = self.last_delivery + self.min_interval - self.loop.time()
+        if wait > 0:
+            self.delivery_pending = True
+            self.loop.call_later(wait, self._deliver)
+        else:
+            self._deliver()
+
+    def _deliver(self):
+        self.delivery_pending = False
+        if self.latest is None or self.closed:
+            return
+        info, self.latest = self.latest, None
+        if not isinstance(info, EngineInfo):
+            board, info = info
+            if board is not self.board:
+                return
+            info = self._info(board, info)
+        self.last_delivery = self.loop.time()
+        self.deliver(self.on_info, info)
@@ -14,29 +14,30 @@ class ErrorWin:
 
         self.session = session
 
-        self.buffer = utils.find_buf(session, "error_buffer") or utils.create_buf(
-            session, "error_buffer", False, True
-        )
-
-        self.window = utils.find_window_from_title(
-            session, "ErrorWindow"
-        ) or utils.create_window(
-            nvim=session,
-            buf=self.buffer,
-            enter=True,
-            config=utils.config_gen(session, config="error", width=40, height=7),
-            title="ErrorWindow",
-        )
-
-        self._set_end_line_number()
-        utils.noremap_lua_callback(
-            self.session,
-            "./gui_tests/lua/errorcallback.lua",
-            "<CR>",
-            "<cmd>lua ErrorWinCallBack()<CR>",
-            insertmodeaswell=True,
-        )
-        self.redraw()
+        with utils.batch(session):
+            self.buffer = utils.find_buf(session, "error_buffer") or utils.create_buf(
+                session, "error_buffer", False, True
+            )
+
+            self.window = utils.find_window_from_title(
+                session, "ErrorWindow"
+            ) or utils.create_window(
+                nvim=session,
+                buf=self.buffer,
+                enter=True,
+                config=utils.config_gen(session, config="error", width=40, height=7),
+                title="ErrorWindow",
+            )
+
+            self._set_end_line_number()
+            utils.noremap_lua_callback(
+                self.session,
+                "./gui_tests/lua/errorcallback.lua",
+                "<CR>",
+                "<cmd>lua ErrorWinCallBack()<CR>",
+                insertmodeaswell=True,
+            )
+            self.redraw()
 
     def _set_end_line_number(self):
         utils.buf_set_var(
@@ -46,12 +47,12 @@ class ErrorWin:
     def _set_nomodifiable(
         self,
     ):  # should be called after _set_current and as its buffer specific
-        self.session.command("setlocal nomodifiable")
+        utils.command(self.session, "setlocal nomodifiable")
 
     def _set_modifiable(
         self,
     ):  # should be called after _set_current as its buffer specific
-        self.session.command("setlocal modifiable")
+        utils.command(self.session, "setlocal modifiable")
 
     def redraw(self):
         self._set_modifiable()
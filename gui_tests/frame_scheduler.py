@@ -0,0 +1,57 @@
+from time import monotonic
+from typing import Callable, Optional
+
+from pynvim import Nvim
+import utils
+
+""" windows mark themselves dirty instead of pushing their extmarks and forcing a redraw! on every update
+    Main flushes the scheduler once per tick, every dirty window renders and neovim gets at most one
+    (non-forcing) redraw per frame
+    a window only needs a render() method that sends its pending changes to neovim
+    """
+
+
+class FrameScheduler:
+    def __init__(
+        self,
+        session: Nvim,
+        max_fps: Optional[float] = None,
+        call_later: Optional[Callable[[float, Callable[[], None]], None]] = None,
+    ):
+        """call_later(delay, fn) must run fn on the ui loop after delay seconds, it is only needed with max_fps"""
+        self.neovim_session = session
+        self.min_frame_interval = 1 / max_fps if max_fps else 0
+        self.call_later = call_later
+        self.dirty: dict = {}
+        self.last_frame = 0.0
+        self.flush_pending = False
+
+    def mark_dirty(self, window):
+        self.dirty[id(window)] = window
+
+    def discard(self, window):
+        """call before a window is killed so a pending frame does not render into a deleted buffer"""
+        self.dirty.pop(id(window), None)
+
+    def flush(self):
+        if not self.dirty or self.flush_pending:
+            return
+
+        wait = self.last_frame + self.min_frame_interval - monotonic()
+        if wait > 0 and self.call_later:
+            self.flush_pending = True
+            self.call_later(wait, self._deferred_flush)
+            return
+
+        windows = list(self.dirty.values())
+        self.dirty.clear()
+        # every extmark change of the frame and the redraw go out in one nvim_call_atomic
+        with utils.batch(self.neovim_session):
+            for window in windows:
+                window.render()
+            utils.redraw(self.neovim_session)
+        self.last_frame = monotonic()
+
+    def _deferred_flush(self):
+        self.flush_pending = False
+        self.flush()
@@ -1,74 +1,133 @@
 from boardWin import BoardWin
 from statsWin import StatsWin
 from inputWin import InputWin
+from moveListWin import MoveListWin
 from game_clock import GameClock
+from game_sessions import GameSession, GameSessions
 
-from chess.variant import find_variant
-from chess import Board, Move
+from chess import Move
 from pynvim import Nvim
 from berserk import Client
 
-from typing import Literal
+from typing import Literal, Optional
 import utils
+from utils import AmbiguousMoveError
+from lichess_runtime import LichessRuntime, StreamStatus
+from frame_scheduler import FrameScheduler
+from engine_analysis import Analysis, EngineInfo, EnginePool
 
 from pynvim.api import Window
 class GameWinManager:
     def __init__(
         self,
         session: Nvim,
-        gameId: str,
+        game: GameSession,
+        sessions: GameSessions,
         client: Client,
-        myside: Literal["black", "white"],        
+        runtime: LichessRuntime,
+        frames: FrameScheduler,
+        engines: Optional[EnginePool] = None,
     ) -> None:
+        """game is the session of the focused game, its model is updated by GameSessions before the
+        events reach handle_game_event, show_game() switches the windows to another session
+        moves are sent through sessions, which draws them as pending until the stream confirms them
+        engines is the pool of the local UCI engine, without one there is no analysis"""
         self.neovim_session = session
-        self.gameId = gameId
+        self.game = game
+        self.sessions = sessions
+        self.gameId = game.gameId
         self.client = client
-
-        self.game = None
-        games = self.client.games.get_ongoing()
-        for game in games:
-            if self.gameId == game['gameId']:
-                self.game = game
-        
-        if not self.game:
-            return
+        self.runtime = runtime
+        self.engines = engines
+        """analyses the position on the board while it is on, toggled with 'eval'"""
+        self.analysis: Optional[Analysis] = None
+        self.closed = False
                 
-        self.variant = self.game['variant']['key']
-        
-
-        if self.variant != "fromPosition": 
-            self.chessBoard = find_variant(self.variant)()
-        else:
-            self.chessBoard = Board()
-         
+        self.variant = game.variant
+        self.chessBoard = game.board
+        self.history = game.history
+        myside = game.myside
          
-        self.boardWin = BoardWin(
-            session=self.neovim_session,
-            board=self.chessBoard,
-            myside=myside,
-            variant=self.variant,
-        )
+        # the window setup calls that do not need a result from neovim are sent in one request
+        with utils.batch(self.neovim_session):
+            self.boardWin = BoardWin(
+                session=self.neovim_session,
+                frames=frames,
+                board=self.chessBoard,
+                history=self.history,
+                myside=myside,
+                variant=self.variant,
+            )
         
-        self.statsWin = StatsWin(
-            session=self.neovim_session,
-            myside=myside
-        )
+            self.statsWin = StatsWin(
+                session=self.neovim_session,
+                frames=frames,
+                history=self.history,
+                myside=myside
+            )
+
+            self.moveListWin = MoveListWin(
+                session=self.neovim_session,
+                frames=frames,
+                history=self.history,
+            )
         
-        self.inputWin = InputWin(
-            session=self.neovim_session,
-        )
+            self.inputWin = InputWin(
+                session=self.neovim_session,
+                frames=frames,
+            )
         
-        # self.dummy_buffer = utils.find_buf(self.neovim_session, "dummy_buf") or utils.create_buf(self.neovim_session, "dummy_buf", False)
-        # self.dummy_window = self.neovim_session.api.open_win(self.dummy_buffer, False, {"relative": "editor", "row": 0, "col": 0, "width": 10, "height": 5, "style": "minimal", "border": "single"})
-        self.myside = myside
-        self.gameClock = None
+            # self.dummy_buffer = utils.find_buf(self.neovim_session, "dummy_buf") or utils.create_buf(self.neovim_session, "dummy_buf", False)
+            # self.dummy_window = self.neovim_session.api.open_win(self.dummy_buffer, False, {"relative": "editor", "row": 0, "col": 0, "width": 10, "height": 5, "style": "minimal", "border": "single"})
+            self.myside = myside
+            """plies played in the position shown on the board, None while it shows the game"""
+            self.viewed_ply: Optional[int] = None
 
-        self.boardWin.set_autocmd(self.inputWin.window.handle)
+            self.boardWin.set_autocmd(self.inputWin.window.handle)
+            self.moveListWin.set_autocmd(self.inputWin.window.handle)
 
-        if self.statsWin:
-            self.statsWin.set_autocmd(self.inputWin.window.handle)
+            if self.statsWin:
+                self.statsWin.set_autocmd(self.inputWin.window.handle)
+
+            utils.set_current_win(self.neovim_session, self.inputWin.window)
+            self._show_state()
 
-        self.neovim_session.api.set_current_win(self.inputWin.window)
+    @property
+    def clock(self) -> Optional[GameClock]:
+        """created from the gameFull event and resynced with every gameState"""
+        return self.game.clock
+
+    def show_game(self, game: GameSession, message: str = " Type action and Enter"):
+        """re-binds the windows to another game, nothing is fetched, the session is already up to date"""
+        self.view_live()
+        self.game = game
+        self.gameId = game.gameId
+        self.variant = game.variant
+        self.chessBoard = game.board
+        self.history = game.history
+        self.myside = game.myside
+        with utils.batch(self.neovim_session):
+            self.boardWin.set_game(game.board, game.history, game.variant, game.myside)
+            self.boardWin.set_premoves(game.premoves)
+            self.statsWin.set_game(game.history, game.myside)
+            # the eval of the last game is stale, the analysis restarts with _show_state
+            self.statsWin.set_eval(None)
+            self.moveListWin.set_history(game.history)
+            self._show_state()
+            self.inputWin.set_extmarks(message)
+
+    def _show_state(self):
+        """draws what the session holds so far, the game's stream events update it from there"""
+        self.boardWin.redraw(self.game.last_move())
+        self.moveListWin.update()
+        self.inputWin.set_moves(self.game.input_moves())
+        if self.game.gameFull:
+            self.statsWin.handle_gameFull_event(self.game.gameFull, self.clock)
+            if self.game.state is not self.game.gameFull["state"]:
+                self.statsWin.handle_gameState_event(self.game.state)
+        if self.game.stream_status:
+            self.show_stream_status(self.game.stream_status)
+        self._analyse()
 
     def flip_board(self):
         self.boardWin.flip_board()
@@ -78,49 +137,140 @@ class GameWinManager:
         
 
     def client_make_move(self, move: str):
+        self.view_live()
         self.inputWin.set_extmarks(" move:"+move)
-        side = self.myside == "white"
-        if side != bool(self.boardWin.board.turn):
-            self.inputWin.set_extmarks(
-                " Not Your Turn          ", self.inputWin.hl_group_error
-            )
+        if not self.game.my_turn:
+            self.add_premove(move)
             return
         try:
-            move = self.boardWin.board.parse_san(move)
-        except:
+            move = self.game.parse_move(move)
+        except AmbiguousMoveError as e:
+            self.inputWin.set_extmarks(f" {e.message}", self.inputWin.hl_group_error)
+            return
+        except ValueError:
             self.inputWin.set_extmarks(
                 " Illeagal Move         ", self.inputWin.hl_group_error
             )
             return
         
+        self.sessions.submit_move(self.game, move)
+        self.moves_changed()
+        self.inputWin.set_extmarks(" move:" + move.uci() + " (pending)")
+
+    def add_premove(self, san: str):
+        """queued in the session, GameSessions sends it when the opponent's move arrives"""
         try:
-            self.client.board.make_move(self.gameId, move.uci())
-        except Exception as e:
+            self.game.add_premove(san)
+        except AmbiguousMoveError as e:
+            self.inputWin.set_extmarks(f" {e.message}", self.inputWin.hl_group_error)
+            return
+        except ValueError:
             self.inputWin.set_extmarks(
-                " Something Went Wrong         ", self.inputWin.hl_group_error
+                " Illeagal Premove         ", self.inputWin.hl_group_error
             )
+            return
+        self.boardWin.set_premoves(self.game.premoves)
+        self.inputWin.set_moves(self.game.input_moves())
+        self.inputWin.set_extmarks(f" premove {len(self.game.premoves)}: {san}, 'cancel' drops")
+
+    def cancel_premoves(self):
+        self.game.premoves.clear()
+        self.boardWin.set_premoves(self.game.premoves)
+        self.inputWin.set_moves(self.game.input_moves())
+        self.inputWin.set_extmarks(" premoves cancelled")
+
+    def show_premove(self, move: Optional[Move]):
+        """the first premove was sent, or dropped with the rest when it was illegal"""
+        self.moves_changed()
+        if move is None:
+            self.inputWin.set_extmarks(" Premove Illeagal, Cancelled         ", self.inputWin.hl_group_error)
+        else:
+            self.inputWin.set_extmarks(" premoved:" + move.uci())
+
+    def show_move_error(self, e: Exception):
+        """lichess refused the pending move, the session already took it back"""
+        self.moves_changed()
+        self.inputWin.set_extmarks(
+            f" Move Rejected: {str(e)[:40]}", self.inputWin.hl_group_error
+        )
+
+    def show_engine_error(self, e: Exception):
+        """the offline engine failed, the game was aborted"""
+        self.inputWin.set_extmarks(
+            f" Engine Failed: {str(e)[:40]}", self.inputWin.hl_group_error
+        )
+
+    def show_request_error(self, e: Exception):
+        if self.closed:
+            return
+        self.inputWin.set_extmarks(
+            " Something Went Wrong         ", self.inputWin.hl_group_error
+        )
 
     def client_resign(self):
-        self.client.board.resign_game(self.gameId)
+        self.sessions.resign(self.game, on_error=self.show_request_error)
         self.inputWin.set_extmarks(" resigned")
         
 
-    def decrement_game_clock(self, update_interval: int = 1000):
-        """update interval must be in milliseconds"""
-        if not self.statsWin or not self.statsWin.gameclock or not self.statsWin.gameclock.started:
+    def view_ply(self, ply: int):
+        """shows the position after ply plies on the board, rebuilt from the history keyframes"""
+        ply = max(0, min(ply, len(self.history)))
+        if ply == len(self.history):
+            self.view_live()
             return
-        remaining = self.statsWin.gameclock.player_and_time_ms()
-        side = remaining[0]
-        time = remaining[1]
-        if time > update_interval:
-            if side == "black":
-                self.statsWin.gameclock.black_time = time
-            else:
-                self.statsWin.gameclock.white_time = time
-                
-            self.statsWin.update_times()
+        self.viewed_ply = ply
+        self.boardWin.show_position(self.history.position(ply), self.history.moves[ply - 1] if ply else "")
+        self.moveListWin.show_ply(ply)
+        self.inputWin.set_extmarks(f" ply {ply}/{len(self.history)}, >> for live")
+        self._analyse()
+
+    def view_live(self):
+        if self.viewed_ply is None:
+            return
+        self.viewed_ply = None
+        self.boardWin.show_live()
+        self.moveListWin.show_ply(None)
+        self.inputWin.set_extmarks()
+        self._analyse()
+
+    def toggle_analysis(self):
+        if self.analysis:
+            self.analysis.close()
+            self.analysis = None
+            self.statsWin.set_eval(None)
+            self.inputWin.set_extmarks(" analysis off")
+            return
+        if self.engines is None:
+            self.inputWin.set_extmarks(" No UCI_ENGINE in .config", self.inputWin.hl_group_error)
+            return
+        self.analysis = Analysis(self.engines, self.runtime.deliver, self.show_eval, self.show_analysis_error)
+        self._analyse()
+        self.inputWin.set_extmarks(" analysing, 'eval' stops")
 
-    def handle_game_event(self, event):
+    def _analyse(self):
+        """hands the position on the board to the analysis, it restarts the engine only if the position changed"""
+        if self.analysis is None:
+            return
+        board = self.chessBoard if self.viewed_ply is None else self.history.position(self.viewed_ply)
+        self.analysis.set_position(board, self.gameId)
+
+    def show_eval(self, info: EngineInfo):
+        if self.closed or self.analysis is None:
+            return
+        self.statsWin.set_eval(info)
+
+    def show_analysis_error(self, e: Exception):
+        if self.closed:
+            return
+        self.analysis = None
+        self.statsWin.set_eval(None)
+        self.inputWin.set_extmarks(f" Engine Error: {str(e)[:30]}", self.inputWin.hl_group_error)
+
+    def _viewed_ply(self) -> int:
+        return len(self.history) if self.viewed_ply is None else self.viewed_ply
+
+    def handle_game_event(self, event, received_at: Optional[int] = None):
+        """stream events were already applied to self.game (GameSessions.route_events), only the windows are updated"""
         if "page" in event:
             options = event['opts']
             action = options['action']
@@ -132,28 +282,28 @@ class GameWinManager:
                 self.client_resign()
             elif action == "abort":
                 self.client_resign()
+            elif action == "view_ply":
+                if "ply" in options:
+                    self.view_ply(options["ply"])
+                else:
+                    self.view_ply(self._viewed_ply() + options["step"])
+            elif action == "view_live":
+                self.view_live()
+            elif action == "cancel_premoves":
+                self.cancel_premoves()
+            elif action == "scroll_moves":
+                self.moveListWin.scroll(options["rows"])
+            elif action == "toggle_analysis":
+                self.toggle_analysis()
             else:
                 raise Exception("input action not implemented"+ action)
         elif event['type'] == "gameFull":
-            
-            if event['variant']['key'] == "fromPosition":
-                self.boardWin.board.set_fen(event['initialFen']) 
-            
-            state = event["state"]
-            moves = state["moves"].split(" ")
-            if moves[0] != "":
-                for move in moves:
-                    self.boardWin.board.push(Move.from_uci(move))
-                            
-                self.boardWin.redraw(lastMove=self.boardWin.board.move_stack[-1])
-            else:
-                self.boardWin.redraw(lastMove="")
-                
+            self.moves_changed()
             if self.statsWin:
-                self.statsWin.handle_gameFull_event(event, self.boardWin.board)
+                self.statsWin.handle_gameFull_event(event, self.clock)
             
         elif event['type'] == "gameState":
-            self.handle_gameState_event(event)
+            self.handle_gameState_event(event, received_at)
             
             pass
         elif event['type'] == "chatLine":
@@ -161,61 +311,56 @@ class GameWinManager:
         elif event['type'] == "opponentGone":
             pass
     def kill_window(self):
+        self.closed = True
         self.chessBoard = None
-        self.boardWin.kill_window()
-        if self.statsWin:
-            self.statsWin.kill_window()
-        self.inputWin.kill_window()
+        if self.analysis:
+            self.analysis.close()
+            self.analysis = None
+        with utils.batch(self.neovim_session):
+            self.boardWin.kill_window()
+            self.moveListWin.kill_window()
+            if self.statsWin:
+                self.statsWin.kill_window()
+            self.inputWin.kill_window()
 
     def resize(self):
-        if self.statsWin:
-            self.statsWin.resize()
+        with utils.batch(self.neovim_session):
+            if self.statsWin:
+                self.statsWin.resize()
+            if self.boardWin:
+                self.boardWin.resize()
+            if self.moveListWin:
+                self.moveListWin.resize()
+            if self.inputWin:
+                self.inputWin.resize()
+    def handle_gameState_event(self, event, received_at: Optional[int] = None):
+        # Board Window Updating, the last move of a game may come with any status
         if self.boardWin:
-            self.boardWin.resize()
-        if self.inputWin:
-            self.inputWin.resize()
-    def configure_gameclock(self, event):
-        assert event["type"] == "gameFull", "wrong event supplied, needs gameFull event"
-
-        state = event["state"]
+            self.moves_changed()
 
-        wtime = state["wtime"]
-        btime = state["btime"]
-        winc = state["winc"]
-        binc = state["binc"]
-
-        self.gameClock = GameClock(
-            wtime, winc, btime, binc, side=self.current_playing_side
-        )
-        if len(state["moves"].split(" ")) > 1:
-            self.gameClock.start()
-
-    def handle_gameState_event(self, event):
-        moves = event["moves"]
-        status = event["status"]
-
-        # Board Window Updating
-        if self.boardWin:
-            if status == "started" or status == "mate" or status == "variantEnd":
-                self.make_move(moves, event)
+        # the game may have ended without a move, no moves to complete then
+        self.inputWin.set_moves(self.game.input_moves())
 
         # Status Window Updating
         if self.statsWin:
             if self.statsWin:
-                self.statsWin.handle_gameState_event(event, self.boardWin.board)
-
-    def make_move(self, moves: str, event: dict):
-        if len(moves) > len(self.boardWin.board.move_stack):
-            # make move
-            latest_move = moves.rsplit(" ", 1)[-1]
-            if latest_move == "":
-                raise "something went terribly fucking wrong"
+                self.statsWin.handle_gameState_event(event)
 
-            self.boardWin.draw_push_move(Move.from_uci(latest_move))
+    def moves_changed(self):
+        """the session pushed or took back plies, a viewed ply past the end returns to the game"""
+        self.boardWin.redraw(self.game.last_move())
+        self.boardWin.set_premoves(self.game.premoves)
+        self.inputWin.set_moves(self.game.input_moves())
+        self.moveListWin.pending_ply = self.game.pending[0] if self.game.pending else None
+        if self.viewed_ply is not None and self.viewed_ply >= len(self.history):
+            self.view_live()
+        self.moveListWin.update()
+        self._analyse()
 
-        elif len(moves) < len(self.boardWin.board.move_stack):
-            # takeback
-            self.boardWin.draw_takeback_once()
-
-        else:
-            raise "THAT'S IMPOSSIBLE"
\ No newline at end of file
+    def show_stream_status(self, status: StreamStatus):
+        if status.state == "reconnecting":
+            self.inputWin.set_extmarks(
+                f" reconnecting in {status.retry_in:.0f}s ({status.reconnects})", self.inputWin.hl_group_error
+            )
+        elif status.reconnects:
+            self.inputWin.set_extmarks(f" reconnected ({status.reconnects}) {status.connect_ms}ms")
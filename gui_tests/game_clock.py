@@ -1,10 +1,28 @@
-from typing import Literal, Tuple, Union
-from time import time
+from typing import Literal, Optional, Union
+from time import monotonic_ns
 from datetime import datetime
 from berserk.utils import to_millis
 
+""" one clock per game, resynced to the times lichess sends with every gameFull/gameState
+    elapsed time is measured with time.monotonic_ns() so ntp adjustments or suspend can not make it jump
+    a state is already latency old when it arrives, the latency is estimated from our own moves
+    (half the time between sending a move and receiving the gameState with it) and taken off the running clock
+    """
+
+NS_PER_MS = 1_000_000
+
+
+def _to_ms(value: Union[datetime, int, float]) -> int:
+    return round(value) if isinstance(value, (int, float)) else to_millis(value)
+
+
+def _plies(moves: str) -> int:
+    return len(moves.split(" ")) if moves else 0
+
 
 class GameClock:
+    LATENCY_SMOOTHING = 0.2
+
     def __init__(
         self,
         white_time: Union[datetime, int],
@@ -12,47 +30,88 @@ class GameClock:
         black_time: Union[datetime, int],
         black_inc: Union[datetime, int],
         side: Literal["black", "white"],
+        first_side: Literal["black", "white"] = "white",
     ):
-        """Must call .start() in order to get times"""
-        self.white_time = (
-            to_millis(white_time) if not isinstance(white_time, int) else white_time
-        )
-        self.white_inc = (
-            to_millis(white_inc) if not isinstance(white_inc, int) else round(white_inc)
-        )
-
-        self.black_time = (
-            to_millis(black_time) if not isinstance(black_time, int) else black_time
-        )
-        self.black_inc = (
-            to_millis(black_inc) if not isinstance(black_inc, int) else round(black_inc)
-        )
+        """the clock stays stopped until start() or a sync() with a running game
+        first_side moved first, black for a game from a position with black to move"""
+        self.white_time = _to_ms(white_time)
+        self.white_inc = _to_ms(white_inc)
+        self.black_time = _to_ms(black_time)
+        self.black_inc = _to_ms(black_inc)
 
         self.side = side
+        self.first_side = first_side
         self.started = False
+        """monotonic_ns at which white_time/black_time were true"""
+        self.synced_at = monotonic_ns()
+
+        self.latency_ns = 0
+        self.move_sent: Optional[tuple[int, int]] = None
+
+    @classmethod
+    def from_state(
+        cls, state: dict, received_at: Optional[int] = None, first_side: Literal["black", "white"] = "white"
+    ) -> "GameClock":
+        """state is a gameState event or gameFull['state']"""
+        clock = cls(state["wtime"], state["winc"], state["btime"], state["binc"], first_side, first_side)
+        clock.sync(state, received_at)
+        return clock
+
+    def sync(self, state: dict, received_at: Optional[int] = None):
+        """takes over the server times of a gameState, received_at is the monotonic_ns the event came off the stream"""
+        received_at = received_at or monotonic_ns()
+        plies = _plies(state["moves"])
+
+        if self.move_sent and plies > self.move_sent[0]:
+            sample = (received_at - self.move_sent[1]) // 2
+            self.latency_ns += round((sample - self.latency_ns) * self.LATENCY_SMOOTHING)
+            self.move_sent = None
+
+        self.white_time = _to_ms(state["wtime"])
+        self.black_time = _to_ms(state["btime"])
+        if plies % 2 == 0:
+            self.side = self.first_side
+        else:
+            self.side = "black" if self.first_side == "white" else "white"
+        self.synced_at = received_at
+        # lichess only starts the clocks once both sides have moved
+        self.started = state["status"] == "started" and plies > 1
+
+    def note_move_sent(self, plies: int):
+        """call when a move is sent while plies moves are on the board, the reply gameState gives a latency sample"""
+        self.move_sent = (plies, monotonic_ns())
 
     def start(self):
-        self.started_time = round(time() * 1000)
+        self.synced_at = monotonic_ns()
         self.started = True
 
     def stop(self):
+        self.white_time = self.remaining_ms("white")
+        self.black_time = self.remaining_ms("black")
         self.started = False
 
-    
     def change_sides(self):
+        self.stop()
         self.side = "black" if self.side == "white" else "white"
+        self.start()
+
+    def remaining_ms(self, side: Literal["black", "white"], now: Optional[int] = None) -> int:
+        remaining = self.white_time if side == "white" else self.black_time
+        if self.started and side == self.side:
+            elapsed = (now or monotonic_ns()) - self.synced_at + self.latency_ns
+            remaining -= elapsed // NS_PER_MS
+        return max(remaining, 0)
 
     def player_and_time_ms(self):
         """returns which player is playing and their remaining time in milliseconds (int) [player, time]"""
-        assert self.started, "Clock Not Started"
+        return [self.side, self.remaining_ms(self.side)]
 
-        current_time = round(time() * 1000)
-        time_passed = current_time - self.started_time
-        self.started_time = current_time
-        if self.side == "black":
-            self.black_time -= time_passed
-            return ["black", self.black_time]
-
-        else:
-            self.white_time -= time_passed
-            return ["white", self.white_time]
+    def next_change_at(self, now: Optional[int] = None) -> Optional[int]:
+        """monotonic_ns at which the running clock's displayed second changes, None while nothing changes"""
+        if not self.started:
+            return None
+        now = now or monotonic_ns()
+        remaining = self.remaining_ms(self.side, now)
+        if remaining == 0:
+            return None
+        return now + (remaining % 1000 + 1) * NS_PER_MS
@@ -0,0 +1,417 @@
+from collections import OrderedDict, deque
+from time import monotonic_ns
+from typing import TYPE_CHECKING, Callable, Literal, Optional
+
+from chess import WHITE, Board, Move
+from chess.variant import find_variant
+from berserk import Client
+
+from channels import EventChannel
+from game_clock import GameClock
+from lichess_runtime import LichessRuntime, StreamStatus
+from move_history import MoveHistory
+from move_index import MoveIndex, PositionIndex
+
+if TYPE_CHECKING:
+    from offline_game import OfflineGame
+
+""" every ongoing game of the account has a GameSession, its board, move history and clock are kept up to date
+    from the game's stream whether or not it is shown, GameWinManager only renders the focused one
+    GameSessions owns the game streams, their events are multiplexed onto one channel tagged with the game id
+    and drained on the ui loop, switching games re-binds the windows to a session that is already in memory
+    moves typed during the opponent's turn are queued as premoves, the first one is checked against the position
+    as soon as the opponent's move comes off the stream and sent from there without waiting for the ui
+    a move we send is pushed right away as pending, the stream's moves confirm it or take it back
+    an offline game (offline_game.OfflineGame) has no stream, its events go onto the same channel
+    a stream blocks a runtime worker, only max_streams games are streamed at once, the ones focused least recently
+    lose their stream first and are resynced by the gameFull of a new stream when they are focused again
+    """
+
+# the stream of a game in any other status has ended for good
+LIVE_STATUSES = (None, "created", "started")
+
+
+def _game_state_key(item: tuple) -> Optional[str]:
+    """a gameState has every move and both times of its game, only the latest one of a game is needed"""
+    gameId, _, event = item
+    return gameId if event.get("type") == "gameState" else None
+
+
+class GameSession:
+    def __init__(self, game: dict):
+        """game is the entry from client.games.get_ongoing() or the game of a gameStart event"""
+        self.game = game
+        self.gameId: str = game["gameId"]
+        self.myside: Literal["black", "white"] = game["color"]
+        self.variant: str = game["variant"]["key"]
+        self.stream_key = f"game:{self.gameId}"
+
+        if self.variant != "fromPosition":
+            self.board = find_variant(self.variant)()
+        else:
+            self.board = Board()
+        self.history = MoveHistory(self.board)
+        """typed moves of the live and the premove positions are looked up here"""
+        self.move_index = MoveIndex()
+        """created from the first gameFull and resynced with every gameState"""
+        self.clock: Optional[GameClock] = None
+        self.gameFull: Optional[dict] = None
+        """the latest gameState, or the state of the latest gameFull"""
+        self.state: Optional[dict] = None
+        self.stream_status: Optional[StreamStatus] = None
+        """moves were played while another game was focused"""
+        self.unseen = False
+        """(typed san, move) of the queued premoves, oldest first"""
+        self.premoves: deque[tuple[str, Move]] = deque()
+        """plies on the board when our last move was sent, no premove is sent before it comes back"""
+        self.sent_ply: Optional[int] = None
+        """(ply, move) of our move that is on the board but not confirmed by lichess yet"""
+        self.pending: Optional[tuple[int, Move]] = None
+        """plays the game instead of lichess for a game against the built-in engine"""
+        self.offline: Optional["OfflineGame"] = None
+
+    @property
+    def status(self) -> Optional[str]:
+        return self.state["status"] if self.state else None
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in LIVE_STATUSES
+
+    @property
+    def my_turn(self) -> bool:
+        return (self.myside == "white") == self.board.turn
+
+    @property
+    def opponent(self) -> str:
+        opponent = self.game.get("opponent") or {}
+        return opponent.get("username") or opponent.get("id") or "?"
+
+    @property
+    def awaiting_move(self) -> bool:
+        """our turn and no move of ours on its way to lichess"""
+        return self.my_turn and not self.finished and self.sent_ply != len(self.history)
+
+    def push_pending(self, move: Move):
+        """pushes our move before lichess confirms it, call when it is sent"""
+        self.sent_ply = len(self.history)
+        if self.clock:
+            self.clock.note_move_sent(len(self.history))
+        self.pending = (len(self.history), move)
+        self.history.push(self.board, move)
+
+    def rollback_pending(self) -> bool:
+        """takes back the pending move after lichess refused it, True when the board changed"""
+        pending, self.pending = self.pending, None
+        self.sent_ply = None
+        self.premoves.clear()
+        if pending is None or len(self.history) != pending[0] + 1 or self.history.moves[-1] != pending[1]:
+            return False
+        self.history.pop(self.board)
+        return True
+
+    def parse_move(self, text: str) -> Move:
+        """the legal move text names in the live position, raises ValueError"""
+        return self.move_index.lookup(self.board, text)
+
+    def add_premove(self, san: str) -> Move:
+        """queues san to be played after the opponent's move, raises ValueError when it could not be played even
+        if the opponent passed, the premoves before it are taken as played"""
+        move = self.move_index.lookup(self._premove_board(), san)
+        self.premoves.append((san, move))
+        return move
+
+    def input_moves(self) -> Optional[PositionIndex]:
+        """the moves typing would play now, the premove position during the opponent's turn, None once finished"""
+        if self.gameFull is None or self.finished:
+            return None
+        board = self.board if self.my_turn else self._premove_board()
+        return self.move_index.position(board)
+
+    def _premove_board(self) -> Board:
+        """the position a new premove is played in, the queued premoves taken as played"""
+        board = self.board.copy(stack=False)
+        for _, move in self.premoves:
+            self._pass_to_me(board)
+            board.push(move)
+        self._pass_to_me(board)
+        return board
+
+    def next_premove(self) -> Optional[Move]:
+        """the first premove once it is our move, raises ValueError and drops the queue when it is illegal now"""
+        if not self.premoves or not self.awaiting_move:
+            return None
+        san, move = self.premoves.popleft()
+        if not self.board.is_legal(move):
+            try:
+                # the typed san may still name a legal move, e.g. a capture on a square that was empty when queued
+                move = self.move_index.lookup(self.board, san)
+            except ValueError:
+                self.premoves.clear()
+                raise
+        return move
+
+    def _pass_to_me(self, board: Board):
+        if (self.myside == "white") != board.turn:
+            board.push(Move.null())
+
+    def apply(self, event: dict, received_at: Optional[int] = None) -> bool:
+        """updates the model from a stream event, True when plies were pushed or taken back"""
+        if event["type"] == "gameFull":
+            # a reconnected stream starts with a fresh gameFull, it resyncs the game instead of replaying it
+            first = self.clock is None
+            if first and event["variant"]["key"] == "fromPosition":
+                self.board.set_fen(event["initialFen"])
+                self.history.reset(self.board)
+            self.gameFull = event
+            self.state = event["state"]
+            changed = self.sync_moves(self.state["moves"])
+            if first:
+                first_side = "white" if self.board.root().turn == WHITE else "black"
+                self.clock = GameClock.from_state(self.state, received_at, first_side)
+            else:
+                self.clock.sync(self.state, received_at)
+            return changed
+
+        if event["type"] == "gameState":
+            self.state = event
+            if self.clock:
+                self.clock.sync(event, received_at)
+            # every status carries the moves, the game's last move (ours too) may come with a draw or stalemate
+            return self.sync_moves(event["moves"], live=event["status"] in LIVE_STATUSES)
+        return False
+
+    def sync_moves(self, moves: str, live: bool = True) -> bool:
+        """brings the board to the plies of moves, lichess can take back one or two plies at once
+        plies that are already on the board are never pushed again
+        once the game is over (live False) a pending move that is not in moves was not played"""
+        plies = moves.split(" ") if moves else []
+        if self.pending:
+            ply, move = self.pending
+            if len(plies) == ply and live:
+                # not processed yet, e.g. a gameState for a draw offer, the pending move stays on top
+                plies = plies + [move.uci()]
+            else:
+                # lichess played the ply, our move is confirmed or taken back below as any diverged ply
+                self.pending = None
+        pushed = self._common_plies(plies)
+        if pushed == len(self.history) == len(plies):
+            return False
+        if pushed < len(self.history):
+            # premoves were queued against the position that was taken back
+            self.premoves.clear()
+        for _ in range(len(self.history) - pushed):
+            self.history.pop(self.board)
+        for uci in plies[pushed:]:
+            if self.my_turn:
+                # our move was played from elsewhere (e.g. the website), the premoves were queued for another position
+                self.premoves.clear()
+            self.history.push(self.board, Move.from_uci(uci))
+        return True
+
+    def last_move(self):
+        return self.board.peek() if self.board.move_stack else ""
+
+    def _common_plies(self, plies: list[str]) -> int:
+        """how many of plies match the start of the history, usually only the last known move is compared"""
+        known = self.history.moves
+        if len(plies) >= len(known) and (not known or plies[len(known) - 1] == known[-1].uci()):
+            return len(known)
+        common = 0
+        while common < min(len(known), len(plies)) and known[common].uci() == plies[common]:
+            common += 1
+        return common
+
+
+class GameSessions:
+    def __init__(
+        self,
+        runtime: LichessRuntime,
+        schedule: Callable[..., None],
+        max_streams: int = 3,
+        buffer: int = 1024,
+    ):
+        """schedule(fn) must run fn on the ui loop (Main.schedule), max_streams should leave the incoming
+        events stream a worker of the runtime"""
+        self.runtime = runtime
+        self.max_streams = max_streams
+        self.sessions: dict[str, GameSession] = {}
+        self.focused: Optional[str] = None
+        """ids of the streamed games, the least recently focused first"""
+        self.streamed: OrderedDict[str, None] = OrderedDict()
+        """the account's client for requests and for streams"""
+        self.client: Optional[Client] = None
+        self.stream_client: Optional[Client] = None
+        """(gameId, monotonic_ns it was read at, event) of every game stream"""
+        self.events = EventChannel(buffer, lambda: schedule(self.route_events), coalesce=_game_state_key)
+        """on_event(session, event, received_at) after an event of the focused game was applied"""
+        self.on_event: Optional[Callable[[GameSession, dict, Optional[int]], None]] = None
+        """on_status(session, StreamStatus) for the streams of every game"""
+        self.on_status: Optional[Callable[[GameSession, StreamStatus], None]] = None
+        """on_turn(session) when an unfocused game is waiting for our move"""
+        self.on_turn: Optional[Callable[[GameSession], None]] = None
+        """on_premove(session, move) when a premove was sent, move is None when it was illegal and the queue dropped"""
+        self.on_premove: Optional[Callable[[GameSession, Optional[Move]], None]] = None
+        """on_move_error(session, exception) when lichess refused a move"""
+        self.on_move_error: Optional[Callable[[GameSession, Exception], None]] = None
+        """on_engine_error(session, exception) when the engine of an offline game failed and the game was aborted"""
+        self.on_engine_error: Optional[Callable[[GameSession, Exception], None]] = None
+
+    def set_client(self, client: Optional[Client], stream_client: Optional[Client] = None):
+        """the clients of the account, None logs out and drops every lichess session"""
+        if stream_client is self.stream_client and client is self.client:
+            return
+        for gameId in [gameId for gameId, session in self.sessions.items() if not session.offline]:
+            self.close(gameId)
+        self.client = client
+        self.stream_client = stream_client if client is not None else None
+
+    def sync(self, ongoing_games: list):
+        """opens a session for every ongoing game, sessions of games that are not ongoing anymore stay until closed"""
+        for game in ongoing_games:
+            self.open(game)
+
+    def open(self, game: dict) -> GameSession:
+        session = self.sessions.get(game["gameId"])
+        if session is None:
+            session = self.sessions[game["gameId"]] = GameSession(game)
+            self._stream(session)
+        return session
+
+    def add_offline(self, game: "OfflineGame") -> GameSession:
+        """a session for a game against the built-in engine, it starts right away"""
+        session = self.sessions[game.gameId] = GameSession(game.game)
+        session.offline = game
+        gameId = game.gameId
+        game.on_error = lambda error: self.on_engine_error and self.on_engine_error(session, error)
+        game.start(lambda event: self.events.put((gameId, monotonic_ns(), event)))
+        return session
+
+    def focus(self, gameId: Optional[str]) -> Optional[GameSession]:
+        """the focused game always has a stream, None focuses nothing (back to the menu)"""
+        self.focused = gameId
+        session = self.sessions.get(gameId)
+        if session is None:
+            return None
+        session.unseen = False
+        if gameId in self.streamed:
+            self.streamed.move_to_end(gameId)
+        elif not session.finished and not session.offline:
+            self._stream(session)
+        return session
+
+    def close(self, gameId: str):
+        session = self.sessions.pop(gameId, None)
+        if session is None:
+            return
+        self._stop_stream(session)
+        if session.offline:
+            session.offline.close()
+        if self.focused == gameId:
+            self.focused = None
+
+    def cycle(self, step: int) -> Optional[GameSession]:
+        """the session step games after the focused one"""
+        ids = list(self.sessions)
+        if not ids:
+            return None
+        index = ids.index(self.focused) if self.focused in ids else -step
+        return self.sessions[ids[(index + step) % len(ids)]]
+
+    def handle_incoming_event(self, event: dict):
+        """gameStart of the incoming events stream opens the new game's session"""
+        if event.get("type") == "gameStart" and self.stream_client is not None:
+            self.open(event["game"])
+        elif event.get("type") == "gameFinish":
+            session = self.sessions.get(event["game"]["gameId"])
+            # the finished game stays readable while it is shown
+            if session is not None and session.gameId != self.focused:
+                self.close(session.gameId)
+
+    def route_events(self):
+        for gameId, received_at, event in self.events.drain():
+            session = self.sessions.get(gameId)
+            if session is None:
+                continue
+            waiting = session.my_turn
+            moved = session.apply(event, received_at)
+            if moved and session.premoves:
+                self.play_premove(session)
+            if gameId == self.focused:
+                if self.on_event:
+                    self.on_event(session, event, received_at)
+            elif moved:
+                session.unseen = True
+                if session.my_turn and not waiting and self.on_turn:
+                    self.on_turn(session)
+            # lichess closes the stream of a finished game, it should not be reopened
+            if session.finished:
+                self._stop_stream(session)
+
+    def play_premove(self, session: GameSession):
+        try:
+            move = session.next_premove()
+        except ValueError:
+            if self.on_premove:
+                self.on_premove(session, None)
+            return
+        if move is None:
+            return
+        self.submit_move(session, move)
+        if self.on_premove:
+            self.on_premove(session, move)
+
+    def submit_move(self, session: GameSession, move: Move):
+        """move must be legal, it is drawn as pending until the game's stream confirms it"""
+        session.push_pending(move)
+        if session.offline:
+            session.offline.play(move)
+            return
+        self.runtime.submit(
+            self.client.board.make_move, session.gameId, move.uci(),
+            on_error=lambda e: self._move_failed(session, e),
+        )
+
+    def resign(self, session: GameSession, on_error: Optional[Callable[[Exception], None]] = None):
+        if session.offline:
+            session.offline.resign()
+            return
+        self.runtime.submit(self.client.board.resign_game, session.gameId, on_error=on_error)
+
+    def _move_failed(self, session: GameSession, e: Exception):
+        session.rollback_pending()
+        if self.on_move_error:
+            self.on_move_error(session, e)
+
+    def report_status(self, status: StreamStatus):
+        session = self.sessions.get(status.key.partition(":")[2])
+        if session is None or session.stream_key != status.key:
+            return
+        session.stream_status = status
+        if self.on_status:
+            self.on_status(session, status)
+
+    def _stream(self, session: GameSession):
+        if self.stream_client is None or session.offline:
+            return
+        while len(self.streamed) >= self.max_streams:
+            evicted = next((gameId for gameId in self.streamed if gameId != self.focused), None)
+            if evicted is None:
+                break
+            self._stop_stream(self.sessions[evicted])
+        gameId = session.gameId
+        client = self.stream_client
+        self.streamed[gameId] = None
+        self.runtime.start_stream(
+            session.stream_key,
+            lambda: client.board.stream_game_state(game_id=gameId),
+            lambda event: self.events.put((gameId, monotonic_ns(), event)),
+            self.report_status,
+        )
+
+    def _stop_stream(self, session: GameSession):
+        if self.streamed.pop(session.gameId, False) is not False:
+            self.runtime.stop(session.stream_key)
+
+    def __len__(self) -> int:
+        return len(self.sessions)
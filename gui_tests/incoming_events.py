@@ -0,0 +1,92 @@
+from collections import deque
+from typing import Optional
+
+""" the events of the incoming events stream (gameStart, gameFinish, challenge...) since login, owned by Main
+    a ring buffer of the last maxlen events, every event gets the next sequence number so a reader can remember
+    where it was and ask for what came after, e.g. the gameStart of a seek that was created at seq N
+    events are indexed by type and by game / challenge id, lookups never scan the buffer
+    and an evicted event is dropped from the indexes as well, memory stays flat over long sessions
+    """
+
+
+def event_id(event: dict) -> Optional[str]:
+    """gameId of game events, id of challenge events"""
+    if "game" in event:
+        game = event["game"]
+        return game.get("gameId") or game.get("id")
+    if "challenge" in event:
+        return event["challenge"].get("id")
+    return None
+
+
+class IncomingEvents:
+    def __init__(self, maxlen: int = 256):
+        self.maxlen = maxlen
+        """ring[seq % maxlen] is the event of seq while seq is one of the last maxlen"""
+        self.ring: list[Optional[dict]] = [None] * maxlen
+        """sequence number of the last event, 0 before the first one"""
+        self.last_seq = 0
+        """type -> seqs of the buffered events of that type, oldest first"""
+        self.by_type: dict[str, deque] = {}
+        """game or challenge id -> seq of its latest buffered event"""
+        self.by_id: dict[str, int] = {}
+
+    def append(self, event: dict) -> int:
+        """stores event and returns its sequence number"""
+        seq = self.last_seq + 1
+        if seq > self.maxlen:
+            self._evict(seq - self.maxlen)
+        self.ring[seq % self.maxlen] = event
+        self.last_seq = seq
+        self.by_type.setdefault(event.get("type"), deque()).append(seq)
+        _id = event_id(event)
+        if _id is not None:
+            self.by_id[_id] = seq
+        return seq
+
+    def extend(self, events: list) -> int:
+        for event in events:
+            self.append(event)
+        return self.last_seq
+
+    def get(self, seq: int) -> Optional[dict]:
+        """None when seq was evicted or is not there yet"""
+        if seq <= 0 or seq > self.last_seq or seq <= self.last_seq - self.maxlen:
+            return None
+        return self.ring[seq % self.maxlen]
+
+    def latest(self, type: str, after: int = 0) -> Optional[tuple[int, dict]]:
+        """(seq, event) of the newest event of type if it is newer than seq after"""
+        seqs = self.by_type.get(type)
+        if not seqs or seqs[-1] <= after:
+            return None
+        return seqs[-1], self.ring[seqs[-1] % self.maxlen]
+
+    def since(self, type: str, after: int = 0) -> list[tuple[int, dict]]:
+        """(seq, event) of the buffered events of type newer than seq after, oldest first"""
+        newer = []
+        for seq in reversed(self.by_type.get(type, ())):
+            if seq <= after:
+                break
+            newer.append((seq, self.ring[seq % self.maxlen]))
+        newer.reverse()
+        return newer
+
+    def for_id(self, _id: str) -> Optional[dict]:
+        """latest buffered event of a game or challenge"""
+        seq = self.by_id.get(_id)
+        return self.ring[seq % self.maxlen] if seq is not None else None
+
+    def _evict(self, seq: int):
+        event = self.ring[seq % self.maxlen]
+        seqs = self.by_type[event.get("type")]
+        # seqs only grow, the evicted one is the oldest of its type
+        seqs.popleft()
+        if not seqs:
+            del self.by_type[event.get("type")]
+        _id = event_id(event)
+        if _id is not None and self.by_id.get(_id) == seq:
+            del self.by_id[_id]
+
+    def __len__(self) -> int:
+        return min(self.last_seq, self.maxlen)
@@ -1,11 +1,15 @@
 from time import sleep
 from pynvim import Nvim, attach
 import utils
+from frame_scheduler import FrameScheduler
+from move_index import PositionIndex
 from typing import Optional
 
 """ Input window where you can only have one line of input
     enter key is mapped to a lua callback function from the lua folder
-    the callback function appends and input event to a global variable (lua table of tables) called 'g:app_events'
+    the callback function appends an input event to the lua AppEventQueue (lua/eventQueue.lua) which notifies python
+    the legal moves are pushed to the b:chess_moves buffer variable once per position, lua completes and checks
+    what is typed against them without a round trip per keystroke
     """
 
 
@@ -13,9 +17,16 @@ class InputWin:
     def __init__(
         self,
         session: Nvim,
+        frames: FrameScheduler,
         window_config: Optional[dict] = None,
     ):
         self.neovim_session = session
+        self.frames = frames
+        self.extmark_text: list = []
+        self.clear_input = False
+        """moves typing would play, None turns completion and the typo check off"""
+        self.moves: Optional[PositionIndex] = None
+        self.pushed_moves: Optional[PositionIndex] = None
 
             
         self.buffer = utils.find_buf(session, "input_buffer") or utils.create_buf(
@@ -31,24 +42,49 @@ class InputWin:
             or utils.config_gen(session, config="input"),
             "InputWindow",
         )
-        self.namespace = self.neovim_session.api.create_namespace("info_namespace")
+        self.namespace = utils.namespace(self.neovim_session, "info_namespace")
         utils.win_set_local_winhighlight(self.neovim_session, self.window, "Normal:InputBackground")
 
             
-        self.buffer[:] = [""]
+        utils.buf_set_lines(self.neovim_session, self.buffer, [""])
         self.sign_text_hl_group = "Directory"
         self.hl_group_error = "InputWinError"
         self.hl_group_placeholder = "InputWinPlaceHolder"
         self.sign_text = "> "
         self.set_extmarks()
         self._set_buffer_keymaps()
-        self.neovim_session.command("startinsert")
+        utils.command(self.neovim_session, "startinsert")
 
     def set_extmarks(
         self,
         text: str = " Type action and Enter",
         hl: str = "InputWinPlaceHolder",
     ):
+        """the message is rendered with the next frame"""
+        self.extmark_text = [text, hl]
+        self.frames.mark_dirty(self)
+
+    def set_moves(self, moves: Optional[PositionIndex]):
+        """pushed with the next frame when the position changed"""
+        self.moves = moves
+        if moves is not self.pushed_moves:
+            self.frames.mark_dirty(self)
+
+    def render(self):
+        if self.moves is not self.pushed_moves:
+            self.pushed_moves = self.moves
+            utils.buf_set_var(
+                self.neovim_session,
+                "chess_moves",
+                self.moves.completions() if self.moves else False,
+                self.buffer,
+            )
+
+        if self.clear_input:
+            self.clear_input = False
+            utils.buf_set_lines(nvim=self.neovim_session, buf=self.buffer, text=[""])
+
+        text, hl = self.extmark_text
         # self.session.command("highlight InputWinHelpText guifg=Blue guibg=Red")
         extmark_opts = utils.ExtmarksOptions(
             end_col=0,
@@ -72,21 +108,36 @@ class InputWin:
     def _set_buffer_keymaps(self):
         utils.load_lua_file(self.neovim_session, "./gui_tests/lua/inputWinCallback.lua")
         utils.buf_set_keymap(self.neovim_session, "<CR>", "<cmd>lua inputWinCallback()<CR>", insertmodeaswell=True)
+        utils.buf_set_keymap(self.neovim_session, "<PageUp>", "<cmd>lua inputWinScrollMoves(-5)<CR>", insertmodeaswell=True)
+        utils.buf_set_keymap(self.neovim_session, "<PageDown>", "<cmd>lua inputWinScrollMoves(5)<CR>", insertmodeaswell=True)
+        utils.buf_set_keymap(self.neovim_session, "<Tab>", "<cmd>lua inputWinAcceptCompletion()<CR>", insertmodeaswell=True)
+        utils.create_autocmd(
+            self.neovim_session,
+            "TextChangedI",
+            {
+                "group": utils.create_augroup(self.neovim_session, "InputWinAuGroup", {"clear": True}),
+                "buffer": self.buffer.number,
+                "command": "lua inputWinComplete()",
+            },
+        )
 
     def empty(self):
-        utils.buf_set_lines(nvim=self.neovim_session, buf=self.buffer, text=[""])
-        utils.force_redraw(nvim=self.neovim_session)
+        self.clear_input = True
+        self.frames.mark_dirty(self)
 
     def kill_window(self):
+        self.frames.discard(self)
         utils.win_del_force(self.neovim_session, self.window)
         utils.buf_del_force(self.neovim_session, self.buffer)
     def resize(self):
-        self.neovim_session.api.win_set_config(
+        width, height = utils.workspace_size(self.neovim_session)
+        utils.win_set_config(
+            self.neovim_session,
             self.window,
             {
                 "relative": "editor",
-                "row": (utils.workspace_height(self.neovim_session) - 1 - 20) // 2,
-                "col": (utils.workspace_width(self.neovim_session) - 25) // 2, 
+                "row": (height - 1 - 20) // 2,
+                "col": (width - 25) // 2, 
             }
         )
 
@@ -0,0 +1,160 @@
+from collections import deque
+from functools import partial
+from socket import SHUT_RDWR
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from berserk import Client, TokenSession
+from lichess_runtime import current_stream
+
+""" every berserk Client of the app comes from LichessClients
+    there is one keep-alive requests session per api token, so logging in, the menu and the game windows
+    share pooled connections instead of paying a tcp + tls handshake per new session
+    long-lived streams get a second session with its own pool so an open stream never holds a connection
+    the requests are waiting for, its read timeout turns a stalled stream (lichess sends a keepalive line every
+    few seconds) into an error the runtime reconnects on
+    the adapters time every request and count the new connections they had to open (LichessClients.timings)
+    a response of the stream session opened by a LichessRuntime stream is attached to its StreamHandle, stopping
+    the stream shuts the socket down under the read waiting for the next line
+    """
+
+
+def _close_response(response: requests.Response):
+    # closing alone does not wake a recv blocked in another thread, shutting the socket down does
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+def _attach_to_stream(response: requests.Response, *args, **kwargs):
+    handle = current_stream()
+    if handle is not None:
+        handle.attach(partial(_close_response, response))
+        if response.ok:
+            handle.connected()
+
+
+class RequestTimings:
+    def __init__(self, maxlen: int = 256):
+        """(method, path, seconds until the response headers, opened a new connection) of the last maxlen requests"""
+        self.samples: deque = deque(maxlen=maxlen)
+        self.requests = 0
+        self.new_connections = 0
+        self.lock = Lock()
+
+    def record(self, method: str, url: str, seconds: float, new_connection: bool):
+        with self.lock:
+            self.samples.append((method, urlsplit(url).path, seconds, new_connection))
+            self.requests += 1
+            self.new_connections += new_connection
+
+    def summary(self) -> dict:
+        """average ms of the recent requests that opened a connection and of the ones that reused one"""
+        with self.lock:
+            samples = list(self.samples)
+        new = [s[2] for s in samples if s[3]]
+        reused = [s[2] for s in samples if not s[3]]
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "new_connection_ms": round(sum(new) / len(new) * 1000) if new else None,
+            "reused_connection_ms": round(sum(reused) / len(reused) * 1000) if reused else None,
+        }
+
+
+class _TimedAdapter(HTTPAdapter):
+    def __init__(self, timings: RequestTimings, default_timeout: Optional[tuple[float, float]] = None, **kwargs):
+        """default_timeout (connect, read) is used for the requests that were sent without a timeout"""
+        self.timings = timings
+        self.default_timeout = default_timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        connections = self._connections_opened()
+        start = perf_counter()
+        response = super().send(request, *args, **kwargs)
+        self.timings.record(
+            request.method, request.url, perf_counter() - start, self._connections_opened() > connections
+        )
+        return response
+
+    def _connections_opened(self) -> int:
+        pools = self.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+
+class LichessClients:
+    def __init__(
+        self,
+        pool_maxsize: int = 8,
+        max_streams: int = 4,
+        request_timeout: tuple[float, float] = (10, 30),
+        stream_timeout: tuple[float, float] = (10, 20),
+    ):
+        """max_streams should match the stream workers of the LichessRuntime
+        the timeouts are (connect, read) seconds, a stream's read timeout is how long it may go without a keepalive"""
+        self.pool_maxsize = pool_maxsize
+        self.max_streams = max_streams
+        self.request_timeout = request_timeout
+        self.stream_timeout = stream_timeout
+        self.timings = RequestTimings()
+        """token -> (client for requests, client for streams)"""
+        self.clients: dict[str, tuple[Client, Client]] = {}
+        self.sessions: dict[str, tuple[requests.Session, requests.Session]] = {}
+        self.lock = Lock()
+
+    def client(self, token: str) -> Client:
+        return self._clients(token)[0]
+
+    def stream_client(self, token: str) -> Client:
+        """for stream_incoming_events, stream_game_state and the like"""
+        return self._clients(token)[1]
+
+    def close(self, token: Optional[str] = None):
+        """closes the sessions of token, or of every token"""
+        with self.lock:
+            tokens = [token] if token is not None else list(self.clients)
+            for _token in tokens:
+                self.clients.pop(_token, None)
+                for session in self.sessions.pop(_token, ()):
+                    session.close()
+
+    def close_others(self, token: str):
+        """after logging in with token, the sessions of the other tokens are not needed anymore"""
+        for _token in [t for t in self.clients if t != token]:
+            self.close(_token)
+
+    def _clients(self, token: str) -> tuple[Client, Client]:
+        with self.lock:
+            if token not in self.clients:
+                sessions = (
+                    self._session(token, self.pool_maxsize, self.request_timeout),
+                    self._session(token, self.max_streams, self.stream_timeout),
+                )
+                sessions[1].hooks["response"].append(_attach_to_stream)
+                self.sessions[token] = sessions
+                self.clients[token] = (Client(sessions[0]), Client(sessions[1]))
+            return self.clients[token]
+
+    def _session(self, token: str, pool_maxsize: int, timeout: tuple[float, float]) -> requests.Session:
+        session = TokenSession(token)
+        # TokenSession replaces the default headers, keep requests' ones (keep-alive, gzip) alongside the token
+        headers = requests.utils.default_headers()
+        headers.update(session.headers)
+        session.headers = headers
+        adapter = _TimedAdapter(
+            self.timings, default_timeout=timeout, pool_connections=2, pool_maxsize=pool_maxsize, pool_block=False
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
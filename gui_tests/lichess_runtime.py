@@ -0,0 +1,273 @@
+import asyncio
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from random import uniform
+from threading import Lock, Thread, local
+from time import monotonic
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+""" asyncio runtime for everything that talks to lichess
+    the loop runs on its own thread and owns the lichess streams and the blocking berserk calls as tasks
+    the neovim session stays on the pynvim loop, request results are handed over with the
+    deliver callback which must be thread-safe (Main uses nvim.async_call for it)
+    stream events are passed to on_event on the runtime loop, which should only put them on a channel
+    streams are supervised, when one ends or fails (a stall shows up as a read timeout of the stream session)
+    it is reopened after a jittered exponential backoff until it is stopped, it is reported connected once the
+    response headers arrived (StreamHandle.connected, called by lichess_clients) or the first line was read
+    every stream task has a StreamHandle, whatever the stream opens while it is read (lichess_clients attaches the
+    http response) is closed when the task is stopped, so a read blocked on a quiet stream returns right away
+    instead of holding its thread and connection until the next line arrives
+    """
+
+_end_of_stream = object()
+_stream_scope = local()
+
+
+def current_stream() -> Optional["StreamHandle"]:
+    """the handle of the stream read on the calling thread, None outside of the runtime's stream reads"""
+    return getattr(_stream_scope, "handle", None)
+
+
+class StreamHandle:
+    def __init__(self, key: str):
+        self.key = key
+        self.closed = False
+        """close callbacks of what the current attempt opened"""
+        self.closers: list[Callable[[], None]] = []
+        """the read running in a stream thread, close() waits on these"""
+        self.pending: Optional[Future] = None
+        """set by the runtime for each attempt, called from the stream thread once the response headers arrived"""
+        self.on_connect: Optional[Callable[[], None]] = None
+        self.lock = Lock()
+
+    def attach(self, closer: Callable[[], None]):
+        """closer runs when the stream is closed or reopened, right away if it already is closed"""
+        with self.lock:
+            if not self.closed:
+                self.closers.append(closer)
+                return
+        closer()
+
+    def connected(self):
+        """the stream's http response arrived, berserk's generators only send the request on the first read"""
+        on_connect = self.on_connect
+        if on_connect and not self.closed:
+            on_connect()
+
+    def release(self):
+        """closes what the previous attempt opened, before the stream is reopened"""
+        with self.lock:
+            closers, self.closers = self.closers, []
+        for closer in closers:
+            try:
+                closer()
+            except Exception:
+                pass
+
+    def close(self):
+        """thread-safe, a read blocked on the stream fails instead of waiting for the next line"""
+        self.closed = True
+        self.release()
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        _stream_scope.handle = self
+        try:
+            return fn(*args)
+        finally:
+            _stream_scope.handle = None
+
+
+class StreamStatus(NamedTuple):
+    key: str
+    """connected or reconnecting"""
+    state: str
+    """times the stream had to be reopened since it was started"""
+    reconnects: int
+    """ms it took to open the stream, None while reconnecting"""
+    connect_ms: Optional[int] = None
+    """seconds until the next attempt while reconnecting"""
+    retry_in: Optional[float] = None
+    error: Optional[Exception] = None
+
+
+class LichessRuntime:
+    def __init__(
+        self,
+        deliver: Callable[..., None],
+        max_streams: int = 4,
+        stream_buffer: int = 64,
+        backoff: float = 1,
+        max_backoff: float = 30,
+    ):
+        """deliver(fn, *args) must schedule fn(*args) on the ui loop"""
+        self.deliver = deliver
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.loop = asyncio.new_event_loop()
+        # streams block a thread for as long as they are open, keep them away from the request workers
+        self.max_streams = max_streams
+        self.stream_executor = ThreadPoolExecutor(max_workers=max_streams, thread_name_prefix="lichess-stream")
+        self.stream_buffer = stream_buffer
+        self.tasks: dict[str, asyncio.Task] = {}
+        """one handle per running stream task, under the same key"""
+        self.streams: dict[str, StreamHandle] = {}
+
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        **kwargs: Any,
+    ):
+        """runs the blocking fn(*args, **kwargs) in the executor, on_done(result) or on_error(exception) are delivered to the ui"""
+        asyncio.run_coroutine_threadsafe(self._call(partial(fn, *args, **kwargs), on_done, on_error), self.loop)
+
+    def start_stream(
+        self,
+        key: str,
+        open_stream: Callable[[], Iterator[Any]],
+        on_event: Callable[[Any], None],
+        on_status: Optional[Callable[[StreamStatus], None]] = None,
+    ):
+        """replaces the task registered under key with one reading open_stream(), reopening it whenever it ends or fails
+        the stream registered under key before is closed first, there is never more than one per key
+        on_event(event) runs on the runtime thread and must not block (see channels.EventChannel.put)
+        on_status(StreamStatus) is delivered to the ui when the stream connects or is about to be reopened"""
+        self.loop.call_soon_threadsafe(self._start_stream, key, open_stream, on_event, on_status)
+
+    def start_timer(self, key: str, interval: float, on_tick: Callable[[], None]):
+        """delivers on_tick every interval seconds until stopped"""
+        self.loop.call_soon_threadsafe(self._replace_task, key, lambda: self._run_timer(interval, on_tick))
+
+    def call_later(self, delay: float, fn: Callable[[], None]):
+        """delivers fn to the ui after delay seconds"""
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.deliver, fn)
+
+    def stop(self, key: str):
+        """cancels the task under key, a stream is closed without waiting for its next line"""
+        self.loop.call_soon_threadsafe(self._cancel_task, key)
+
+    def close(self, timeout: float = 2):
+        """stops every task and closes the streams, waits at most timeout seconds for the stream threads to return"""
+        deadline = monotonic() + timeout
+        try:
+            pending = asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop).result(timeout)
+            wait(pending, timeout=max(deadline - monotonic(), 0))
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.stream_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _start_stream(self, key, open_stream, on_event, on_status):
+        self._cancel_task(key)
+        handle = StreamHandle(key)
+        self.streams[key] = handle
+        self.tasks[key] = self.loop.create_task(self._run_stream(handle, open_stream, on_event, on_status))
+
+    def _replace_task(self, key: str, make_coroutine: Callable[[], Any]):
+        self._cancel_task(key)
+        self.tasks[key] = self.loop.create_task(make_coroutine())
+
+    def _cancel_task(self, key: str):
+        task = self.tasks.pop(key, None)
+        if task:
+            task.cancel()
+        handle = self.streams.pop(key, None)
+        if handle:
+            handle.close()
+
+    async def _cancel_all(self) -> list[Future]:
+        pending = [handle.pending for handle in self.streams.values() if handle.pending]
+        for key in list(self.tasks):
+            self._cancel_task(key)
+        return pending
+
+    async def _in_stream_thread(self, handle: StreamHandle, fn, *args):
+        """runs fn(*args) on a stream worker with handle as the current stream"""
+        handle.pending = self.stream_executor.submit(handle.run, fn, *args)
+        return await asyncio.wrap_future(handle.pending, loop=self.loop)
+
+    async def _call(self, fn, on_done, on_error):
+        try:
+            result = await self.loop.run_in_executor(None, fn)
+        except Exception as e:
+            if on_error:
+                self.deliver(on_error, e)
+            return
+        if on_done:
+            self.deliver(on_done, result)
+
+    async def _run_stream(self, handle: StreamHandle, open_stream, on_event, on_status):
+        key = handle.key
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.stream_buffer)
+        consumer = self.loop.create_task(self._consume(queue, on_event))
+        reconnects = 0
+        failures = 0
+        attempt = 0
+        connected_attempt = -1
+
+        def connected(of_attempt: int, opened_at: float):
+            # from the response hook or the first line, whichever comes first, once per attempt
+            nonlocal connected_attempt
+            if of_attempt != attempt or connected_attempt == attempt or handle.closed:
+                return
+            connected_attempt = attempt
+            self._report(on_status, StreamStatus(
+                key, "connected", reconnects, round((self.loop.time() - opened_at) * 1000)
+            ))
+
+        try:
+            while True:
+                error = None
+                try:
+                    attempt += 1
+                    opened_at = self.loop.time()
+                    handle.release()
+                    handle.on_connect = partial(self.loop.call_soon_threadsafe, connected, attempt, opened_at)
+                    # a lazy stream (berserk) connects on its first read, not here
+                    stream = await self._in_stream_thread(handle, open_stream)
+                    while True:
+                        event = await self._in_stream_thread(handle, next, stream, _end_of_stream)
+                        if event is _end_of_stream:
+                            break
+                        connected(attempt, opened_at)
+                        # the stream works again, the next drop starts from the shortest backoff
+                        failures = 0
+                        await queue.put(event)
+                except Exception as e:
+                    error = e
+                if handle.closed:
+                    return
+
+                failures += 1
+                reconnects += 1
+                delay = self._backoff_delay(failures)
+                self._report(on_status, StreamStatus(key, "reconnecting", reconnects, retry_in=delay, error=error))
+                await asyncio.sleep(delay)
+        finally:
+            handle.close()
+            consumer.cancel()
+
+    def _backoff_delay(self, failures: int) -> float:
+        """exponential with equal jitter, so streams that dropped together do not reconnect together"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+        return delay / 2 + uniform(0, delay / 2)
+
+    def _report(self, on_status, status: StreamStatus):
+        if on_status:
+            self.deliver(on_status, status)
+
+    async def _consume(self, queue: asyncio.Queue, on_event):
+        while True:
+            event = await queue.get()
+            on_event(event)
+            queue.task_done()
+
+    async def _run_timer(self, interval, on_tick):
+        while True:
+            await asyncio.sleep(interval)
+            self.deliver(on_tick)
@@ -7,7 +7,7 @@ function MenuWinCallback()
       line=line -1 --converting to 0 based index for python lists
     }
   }
-  vim.g.app_events = insertValueAndReturnTable(vim.g.app_events, event)
+  AppEventQueue.append(event)
 end
 
 function RefreshMenu()
@@ -16,10 +16,5 @@ function RefreshMenu()
     event="refresh",
     opts = {}
   }
-  vim.g.app_events = insertValueAndReturnTable(vim.g.app_events, event)
+  AppEventQueue.append(event)
 end
-
-function insertValueAndReturnTable(tbl, value)
-  table.insert(tbl, value)
-  return tbl
-end
\ No newline at end of file
@@ -0,0 +1,13 @@
+-- Applies the board cells BoardWin found changed since the last render.
+-- each cell is {extmark_id, line, col, text, hl_group} and is drawn as an
+-- overlay over the blank board buffer, so one call redraws only those cells.
+
+function BoardWinSetCells(buffer, ns, cells)
+    for _, cell in ipairs(cells) do
+        vim.api.nvim_buf_set_extmark(buffer, ns, cell[2], cell[3], {
+            id = cell[1],
+            virt_text = { { cell[4], cell[5] } },
+            virt_text_pos = "overlay",
+        })
+    end
+end
@@ -0,0 +1,37 @@
+-- Queue the gui callbacks append their app events to.
+-- python is woken by a single "app_events_ready" notification and takes
+-- everything queued since with one AppEventQueue.drain() call.
+-- Neovim runs lua on its main loop so append and drain never interleave.
+-- The table outlives a python process, a new one resets it when it attaches.
+
+AppEventQueue = AppEventQueue or {
+    items = {},
+    count = 0,
+    notified = false,
+}
+
+function AppEventQueue.append(event)
+    local queue = AppEventQueue
+    queue.count = queue.count + 1
+    queue.items[queue.count] = event
+
+    if not queue.notified then
+        -- a dead channel throws, the next append tries again
+        queue.notified = pcall(vim.rpcnotify, vim.g.app_events_channel, "app_events_ready")
+    end
+end
+
+function AppEventQueue.drain()
+    local queue = AppEventQueue
+    local events = queue.items
+
+    queue.items = {}
+    queue.count = 0
+    queue.notified = false
+    return events
+end
+
+-- drops what was queued for a previous python process
+function AppEventQueue.reset()
+    AppEventQueue.drain()
+end
@@ -1,3 +1,91 @@
+-- b:chess_moves maps every accepted spelling of a legal move to its SAN (move_index.PositionIndex.completions),
+-- or to false for a lowercase spelling of several moves, python names them when it is entered
+-- python pushes it once per position, completion and the typo check below run on every keystroke without rpc
+local completion_ns = vim.api.nvim_create_namespace("InputWinCompletionNs")
+local COMMANDS = { "exit", "menu", "resign", "abort", "flip", "cancel", "eval", "next", "prev", "ply", "game", "<<", ">>" }
+local MAX_COMPLETIONS = 6
+
+local function input_moves(buf)
+    local moves = vim.b[buf].chess_moves
+    if type(moves) ~= "table" then
+        return nil
+    end
+    return moves
+end
+
+local function is_command(input)
+    for _, command in ipairs(COMMANDS) do
+        if string.sub(command, 1, #input) == input then
+            return true
+        end
+    end
+    return string.match(input, "^ply%d+$") ~= nil or string.match(input, "^game%w+$") ~= nil
+end
+
+-- SANs of the moves with a spelling starting with input, shortest first
+local function completions(moves, input)
+    local seen, matches = {}, {}
+    for form, san in pairs(moves) do
+        if san and not seen[san] and string.sub(form, 1, #input) == input then
+            seen[san] = true
+            table.insert(matches, san)
+        end
+    end
+    table.sort(matches, function(a, b)
+        if #a ~= #b then
+            return #a < #b
+        end
+        return a < b
+    end)
+    return matches
+end
+
+local function show_hint(buf, text, hl)
+    vim.api.nvim_buf_clear_namespace(buf, completion_ns, 0, -1)
+    if text then
+        vim.api.nvim_buf_set_extmark(buf, completion_ns, 0, 0, {
+            virt_text = { { text, hl } },
+            virt_text_pos = "eol",
+        })
+    end
+end
+
+function inputWinComplete()
+    local buf = vim.api.nvim_get_current_buf()
+    local moves = input_moves(buf)
+    local input = string.gsub(vim.api.nvim_buf_get_lines(buf, 0, 1, false)[1] or "", " ", "")
+    if not moves or input == "" then
+        show_hint(buf, nil)
+        return
+    end
+
+    local matches = completions(moves, input)
+    if #matches > 0 then
+        show_hint(buf, " " .. table.concat(vim.list_slice(matches, 1, MAX_COMPLETIONS), " "), "InputWinCompletion")
+    elseif moves[input] == false then
+        show_hint(buf, " more than one move, enter lists them", "InputWinCompletion")
+    elseif is_command(input) then
+        show_hint(buf, nil)
+    else
+        show_hint(buf, " no such move", "InputWinError")
+    end
+end
+
+function inputWinAcceptCompletion()
+    local buf = vim.api.nvim_get_current_buf()
+    local moves = input_moves(buf)
+    local input = string.gsub(vim.api.nvim_buf_get_lines(buf, 0, 1, false)[1] or "", " ", "")
+    if not moves or input == "" then
+        return
+    end
+    local san = moves[input] or completions(moves, input)[1]
+    if san then
+        vim.api.nvim_buf_set_lines(buf, 0, -1, false, { san })
+        vim.api.nvim_win_set_cursor(0, { 1, #san })
+        show_hint(buf, nil)
+    end
+end
+
 function inputWinCallback()
     local input = vim.api.nvim_buf_get_lines(0, 0, 1, false)[1]
     input = string.gsub(input, " ", "")
@@ -12,21 +100,48 @@ function inputWinCallback()
         append_event("Game", "internal", {action="abort"})
     elseif input == "flip" then
         append_event("Game", "internal", {action="flip"})
+    elseif input == "<" then
+        append_event("Game", "internal", {action="view_ply", step=-1})
+    elseif input == ">" then
+        append_event("Game", "internal", {action="view_ply", step=1})
+    elseif input == "<<" then
+        append_event("Game", "internal", {action="view_ply", ply=0})
+    elseif input == ">>" then
+        append_event("Game", "internal", {action="view_live"})
+    elseif input == "cancel" then
+        append_event("Game", "internal", {action="cancel_premoves"})
+    elseif input == "eval" then
+        append_event("Game", "internal", {action="toggle_analysis"})
+    elseif input == "next" then
+        append_event("Game", "pass_control", {action="switch_game", step=1})
+    elseif input == "prev" then
+        append_event("Game", "pass_control", {action="switch_game", step=-1})
+    elseif string.match(input, "^game%w+$") then
+        append_event("Game", "pass_control", {action="switch_game", gameId=string.sub(input, 5)})
+    elseif string.match(input, "^ply%d+$") then
+        append_event("Game", "internal", {action="view_ply", ply=tonumber(string.sub(input, 4))})
     elseif input ~= "" then 
+        local moves = input_moves(0)
+        if moves and moves[input] == nil then
+            -- a typo is rejected here and left in the input to be fixed
+            show_hint(vim.api.nvim_get_current_buf(), " no such move", "InputWinError")
+            return
+        end
         append_event("Game", "internal", { action="make_move", move=input})
     end
 
     vim.api.nvim_buf_set_lines(0, 0, -1, false, {})
+    show_hint(vim.api.nvim_get_current_buf(), nil)
+end
+
+function inputWinScrollMoves(rows)
+    append_event("Game", "internal", {action="scroll_moves", rows=rows})
 end
 
 function append_event(page, event, opts)
-    vim.g.app_events = insertValueAndReturnTable(vim.g.app_events, {
+    AppEventQueue.append({
         page=page,
         event=event,
         opts= opts
-    })    
-end
-function insertValueAndReturnTable(tbl, value)
-    table.insert(tbl, value)
-    return tbl
+    })
 end
\ No newline at end of file
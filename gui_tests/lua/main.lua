@@ -4,10 +4,5 @@ function ResizeWindows()
       event="resize",
       opts = {}
     }
-    vim.g.app_events = insertValueAndReturnTable(vim.g.app_events, event)
+    AppEventQueue.append(event)
 end
-  
-function insertValueAndReturnTable(tbl, value)
-    table.insert(tbl, value)
-    return tbl
-end
\ No newline at end of file
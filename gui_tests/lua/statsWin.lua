@@ -0,0 +1,120 @@
+-- Renders the StatsWin extmark and counts the clocks down on neovim's side.
+-- python sends the stats lines and the clock state once per game event,
+-- a vim.uv timer then rewrites the clock of the side to move between events
+-- without any rpc, so the countdown stays smooth while python is busy.
+-- the timer only wakes when the displayed second changes.
+
+StatsWinClocks = StatsWinClocks or {}
+
+local function now_ms()
+    return vim.uv.hrtime() / 1e6
+end
+
+-- same format as stats_utils.timems_to_timestring
+local function time_string(ms)
+    local total = math.floor(math.max(ms, 0) / 1000)
+    local h = math.floor(total / 3600)
+    local m = math.floor(total / 60) % 60
+    local s = total % 60
+    if h ~= 0 then
+        return string.format("%d:%02d:%02d", h, m, s)
+    end
+    return string.format("%02d:%02d", m, s)
+end
+
+local function remaining(clock, side)
+    local ms = clock[side]
+    if clock.running == side then
+        ms = ms - (now_ms() - clock.reference)
+    end
+    return ms
+end
+
+-- ms until the running clock shows another second, same as GameClock.next_change_at
+local function next_change(clock)
+    local ms = math.floor(remaining(clock, clock.running))
+    if ms <= 0 then
+        return nil
+    end
+    return ms % 1000 + 1
+end
+
+local function set_extmark(clock)
+    vim.api.nvim_buf_set_extmark(clock.buffer, clock.ns, 0, 0, {
+        id = 1,
+        virt_lines = clock.lines,
+    })
+end
+
+-- writes both clocks into their lines, returns true if a displayed time changed
+local function update_clock_lines(clock)
+    local changed = false
+    for _, side in ipairs({ "white", "black" }) do
+        local chunk = clock.lines[clock.rows[side]][1]
+        local text = time_string(remaining(clock, side))
+        if chunk[1] ~= text then
+            chunk[1] = text
+            changed = true
+        end
+    end
+    return changed
+end
+
+function StatsWinStop(buffer)
+    local clock = StatsWinClocks[buffer]
+    if clock and clock.timer then
+        clock.timer:stop()
+        clock.timer:close()
+    end
+    StatsWinClocks[buffer] = nil
+end
+
+local function tick(buffer)
+    local clock = StatsWinClocks[buffer]
+    if not clock then
+        return
+    end
+    if not vim.api.nvim_buf_is_valid(buffer) then
+        StatsWinStop(buffer)
+        return
+    end
+    if update_clock_lines(clock) then
+        set_extmark(clock)
+    end
+    local delay = next_change(clock)
+    if delay then
+        clock.timer:start(delay, 0, clock.wake)
+    end
+end
+
+-- lines are the virt_lines of the stats extmark, clock is
+-- { rows = { white = i, black = i }, white = ms, black = ms, running = side, next_change = ms }
+-- rows index the clock lines, running and next_change are omitted while no clock is running
+function StatsWinRender(buffer, ns, lines, clock)
+    local previous = StatsWinClocks[buffer]
+
+    clock.buffer = buffer
+    clock.ns = ns
+    clock.lines = lines
+    clock.reference = now_ms()
+    clock.timer = previous and previous.timer
+    clock.wake = previous and previous.wake
+    StatsWinClocks[buffer] = clock
+
+    update_clock_lines(clock)
+    set_extmark(clock)
+
+    if clock.timer then
+        clock.timer:stop()
+    end
+    if not clock.running then
+        return
+    end
+    if not clock.timer then
+        clock.timer = vim.uv.new_timer()
+        clock.wake = vim.schedule_wrap(function()
+            tick(buffer)
+        end)
+    end
+    clock.timer:start(clock.next_change, 0, clock.wake)
+end
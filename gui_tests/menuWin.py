@@ -7,13 +7,15 @@ import utils
 import re
 import os
 
-from threading import Lock
 from berserk import Client
 from errorwin import ErrorWin
-from typing import Literal
+from typing import Literal, Optional
 from os import getenv
-from berserk import TokenSession
 from gameWin import GameWinManager,GameClock
+from lichess_runtime import LichessRuntime
+from ongoing_games import OngoingGamesCache
+from lichess_clients import LichessClients
+from incoming_events import IncomingEvents
 
 
 pages = {
@@ -43,6 +45,7 @@ pages = {
         " Color           : Random",  # <CR> to change color functionalit in the future?
         " Varient         : standard",
         " Start Game ->",
+        " Play Offline ->",
         " <- Back",
     ],
     "seek": [
@@ -65,6 +68,10 @@ pages = {
         " -> set api key",
         " -> set theme",
         " <- Back",
+        "",
+        " requests ~",
+        "",
+        "",
     ],
     "set_api_key": [
         " Set API TOKEN ~",
@@ -120,6 +127,7 @@ page_actions = {
         None,
         None,
         "create_challenge_ai",
+        "create_offline_ai",
         "switchpage_to_home",
     ],
     "settings": [
@@ -129,6 +137,10 @@ page_actions = {
         "switchpage_to_set_api_key",
         "switchpage_to_change_themes",
         "switchpage_to_home",
+        None,
+        None,
+        None,
+        None,
     ],
     "set_api_key": [None, None, None, "set_api_key", "switchpage_to_settings"],
     "themes": [
@@ -141,61 +153,67 @@ page_actions = {
 # todo : figure out a better way to implement the logic for button actions in different pages, maybe split the logic part between lua and python????
 
 """
-the menu has buffer specific keymaps that update a global variable in neovim with the row position of the cursor when Enter/<CR>/Return is pressed
+the menu has buffer specific keymaps that append an app event to the lua AppEventQueue with the row position of the cursor when Enter/<CR>/Return is pressed
 call the MenuWin.updateMenu method with a single cursor row position to update the gui according to the page_action defined for that pressing Return on that line.
 the first two lines should be actionless and only contain info about the current page.
 
 
 the menu has pages which are essentially a collection of buffer text and window configs (such as create challenge page)
 the menu window should not be hidden/deleted unless a game is started
-you can extract the events from the events variable by reading it from neovim using the get_global_var from the utils module, the variable name is g:app_events 
+the events are appended to the lua AppEventQueue, which wakes python with an "app_events_ready" notification, python side events can be queued the same way with
 
-`utils.get_global_var(neovim_session, "app_events")`
-the variable is automatically set to and empty list when a MenuWin instance is created.
+`utils.add_app_events(neovim_session, event)`
 
 """
 
 
 class MenuWinManager:
-    def __init__(self, session: Nvim, berserk_client: Client = None, config_file_path = ".config") -> None:
+    def __init__(self, session: Nvim, runtime: LichessRuntime, ongoing_games: OngoingGamesCache, incoming_events: IncomingEvents, clients: LichessClients, berserk_client: Client = None, config_file_path = ".config") -> None:
         self.neovim_session = session
+        self.runtime = runtime
+        self.ongoing_games = ongoing_games
+        self.incoming_events = incoming_events
+        self.clients = clients
+        self.closed = False
             
-        self.buffer = utils.find_buf(session, "menu_buffer") or utils.create_buf(
-            session, "menu_buffer"
-        )
+        # everything that does not need a result from neovim is sent in one request
+        with utils.batch(session):
+            self.buffer = utils.find_buf(session, "menu_buffer") or utils.create_buf(
+                session, "menu_buffer"
+            )
 
-        self.window_config = utils.config_gen(
-            session,
-            config="menu",
-            minimal=True,
-        )
-        self.window = utils.find_window_from_title(
-            session, "menu"
-        ) or utils.create_window(
-            session, self.buffer, True, config=self.window_config, title="menu"
-        )
-        utils.win_set_local_winhighlight(self.neovim_session, self.window, "Normal:MenuBackground,CursorLine:MenuCursorLine")
+            self.window_config = utils.config_gen(
+                session,
+                config="menu",
+                minimal=True,
+            )
+            self.window = utils.find_window_from_title(
+                session, "menu"
+            ) or utils.create_window(
+                session, self.buffer, True, config=self.window_config, title="menu"
+            )
+            utils.win_set_local_winhighlight(self.neovim_session, self.window, "Normal:MenuBackground,CursorLine:MenuCursorLine")
 
-        self.page = "home"
-        self.buffer[:] = pages[self.page]
-        utils.set_cursor(session, self.window, (3, 0))
+            self.page = "home"
+            utils.buf_set_lines(self.neovim_session, self.buffer, pages[self.page])
+            utils.set_cursor(session, self.window, (3, 0))
 
 
 
-        self.config_file_path = config_file_path
-        if berserk_client is not None:
-            self.berserk_client = berserk_client
-        else:
-            self.berserk_client = None
+            self.config_file_path = config_file_path
+            if berserk_client is not None:
+                self.berserk_client = berserk_client
+            else:
+                self.berserk_client = None
              
-        self._set_locals()
-        self._set_buffer_local_keymap()
-        self.neovim_session.command("stopinsert")
+            self._set_locals()
+            self._set_buffer_local_keymap()
+            utils.command(self.neovim_session, "stopinsert")
         
         
         
     def _set_locals(self):
-        self.neovim_session.command("setlocal cursorline")
+        utils.command(self.neovim_session, "setlocal cursorline")
 
     def handle_enter_event(self, event: int):
         if self.page == "home":
@@ -239,15 +257,14 @@ class MenuWinManager:
             """action is most likely [gameId, color]"""
             print("Joingng Game "+ str(action))
 
-            app_events = utils.get_global_var(self.neovim_session, "app_events")
-            app_events.append(
+            utils.add_app_events(
+                self.neovim_session,
                 {
                     "page": "Menu",
                     "event": "join_game",
                     "opts": {"gameId": action[0], "color": action[1]},
                 }
             )
-            utils.set_global_var(self.neovim_session, "app_events", app_events)
 
     def do_action_home(self, action: str):
         if action == "switchpage_to_ongoing":
@@ -261,10 +278,9 @@ class MenuWinManager:
             self.switch_page("settings")
             self._fill_settings_page()
         elif action == "exit":
-            utils.set_global_var(
+            utils.add_app_events(
                 self.neovim_session,
-                "app_events",
-                [{"page": "Global", "event": "exit", "opts": {}}],
+                {"page": "Global", "event": "exit", "opts": {}},
             )
 
     def _fill_settings_page(self):
@@ -272,8 +288,7 @@ class MenuWinManager:
         if not self.berserk_client:
             token = utils.get_api_key(self.config_file_path)
             try:
-                session = TokenSession(token)
-                self.berserk_client = Client(session)
+                self.berserk_client = self.clients.client(token)
                 self.account = self.berserk_client.account.get()
 
                 screen[2] = f" Acc:{self.account['username']}"
@@ -289,6 +304,17 @@ class MenuWinManager:
             self.account = self.berserk_client.account.get()
             screen[2] = f" Acc:{self.account['username']}"
             self.buffer[:] = screen
+        self._fill_request_timings()
+
+    def _fill_request_timings(self):
+        """ how the pooled connections do, from LichessClients.timings """
+        summary = self.clients.timings.summary()
+        new_ms = summary["new_connection_ms"]
+        reused_ms = summary["reused_connection_ms"]
+        screen = self.buffer[:]
+        screen[8] = f" {summary['requests']} sent, {summary['new_connections']} new connections"
+        screen[9] = f" new {'-' if new_ms is None else new_ms}ms, reused {'-' if reused_ms is None else reused_ms}ms"
+        self.buffer[:] = screen
 
     def do_action_set_api_key(self, action: str):
         if action == "switchpage_to_settings":
@@ -302,8 +328,7 @@ class MenuWinManager:
             self.buffer[:] = screen
             _temp_client = self.berserk_client
             try:
-                session = TokenSession(token)
-                self.berserk_client = Client(session=session)
+                self.berserk_client = self.clients.client(token)
                 self.account = self.berserk_client.account.get()
                 screen[2] = " Successfuly logged in"
                 self.buffer[:] = screen
@@ -338,6 +363,7 @@ class MenuWinManager:
     def do_action_themes(self, action: str):
         if action == "switchpage_to_settings":
             self.switch_page("settings")
+            self._fill_request_timings()
             page_actions['themes'] = page_actions['themes'][:4]
         elif action is not None:
             print('Setting Theme '+ action['theme'])            
@@ -386,10 +412,17 @@ class MenuWinManager:
 
             return
 
-        ongoing_games = []
-        try:
-            ongoing_games = self.berserk_client.games.get_ongoing(count=50)
-        except:
+        self.ongoing_games.get(
+            on_done=self._show_ongoing_games,
+            on_error=lambda e: self._show_ongoing_games(None),
+        )
+
+    def _show_ongoing_games(self, ongoing_games: Optional[list]):
+        if self.closed or self.page != "ongoing":
+            return
+        screen = self.buffer[:]
+
+        if ongoing_games is None:
             screen[2] = " Could Not Connect"
             self.buffer[:] = screen
             return
@@ -408,7 +441,7 @@ class MenuWinManager:
                 screen.insert(-1, (" vs " + game["opponent"]["username"]))
                 page_actions["ongoing"].insert(-1, [game["gameId"], game["color"]])
 
-            self.buffer[:] = screen
+        self.buffer[:] = screen
 
     def do_action_seek(self, action: str):
         if action == "switchpage_to_home":
@@ -421,53 +454,68 @@ class MenuWinManager:
                 )
                 return
 
+            self.ongoing_games.get(
+                on_done=self._create_seek,
+                on_error=lambda e: ErrorWin(self.neovim_session, f"Could not fetch ongoing games \n{e}"),
+            )
 
-            current_games = self.berserk_client.games.get_ongoing()
-            if len(current_games) > 0:
-                ErrorWin(self.neovim_session, "You already have an ongoing game.")
-                return
-            
-            buffer_text = self.buffer[:]
-            clock_limit_seconds = self._find_numbers_from_string(buffer_text[2])
-            if len(clock_limit_seconds) == 0:
-                ErrorWin(self.neovim_session, "Invalid Time Control, cannot go below 600 seconds")
-            clock_limit_seconds = clock_limit_seconds[0]
-            
-            clock_inc = self._find_numbers_from_string(buffer_text[3])
-            if len(clock_inc) == 0:
-                ErrorWin(self.neovim_session, "Invalid Increment. must be between 0 and 180 seconds")
-            clock_inc = clock_inc[0]
+    def _create_seek(self, current_games: list):
+        if self.closed or self.page != "seek":
+            return
+        if len(current_games) > 0:
+            ErrorWin(self.neovim_session, "You already have an ongoing game.")
+            return
+        
+        buffer_text = self.buffer[:]
+        clock_limit_seconds = self._find_numbers_from_string(buffer_text[2])
+        if len(clock_limit_seconds) == 0:
+            ErrorWin(self.neovim_session, "Invalid Time Control, cannot go below 600 seconds")
+        clock_limit_seconds = clock_limit_seconds[0]
+        
+        clock_inc = self._find_numbers_from_string(buffer_text[3])
+        if len(clock_inc) == 0:
+            ErrorWin(self.neovim_session, "Invalid Increment. must be between 0 and 180 seconds")
+        clock_inc = clock_inc[0]
 
 
-            variant = self._get_variant_from_string(buffer_text[4])
-            if variant is None:
-                ErrorWin(self.neovim_session, "Variation must be one of the following: \nstandard, \natomic, \nantichess, \nthreecheck, \nracingkings, \nkingofthehill, \nhorde, \ncrazyhouse, \nchess960")
-                return
-            rated = self._get_rated_or_not(buffer_text[5])
-            
-            # custom_fen = self._get_custom_fen(buffer_text[6])
-            
-            time = clock_limit_seconds//60
-            inc = clock_inc // 60
-            
-            self.buffer[:] = ["", " Searching for opponent..."]
-            
-            self.berserk_client.board.seek(
-                time=time,
-                increment=inc,
-                variant=variant,
-                rated=rated,
-            )
-            
-            self.buffer[:] = ["", " Game Created!"]
-            utils.set_global_var(self.neovim_session, "app_events", [])
-            utils.add_app_events(
-                self.neovim_session,
-                {
-                    "page": "Menu",
-                    "event": "create_seek",
-                    "opts":{}
-                })    
+        variant = self._get_variant_from_string(buffer_text[4])
+        if variant is None:
+            ErrorWin(self.neovim_session, "Variation must be one of the following: \nstandard, \natomic, \nantichess, \nthreecheck, \nracingkings, \nkingofthehill, \nhorde, \ncrazyhouse, \nchess960")
+            return
+        rated = self._get_rated_or_not(buffer_text[5])
+        
+        # custom_fen = self._get_custom_fen(buffer_text[6])
+        
+        time = clock_limit_seconds//60
+        inc = clock_inc // 60
+        
+        self.buffer[:] = ["", " Searching for opponent..."]
+        
+        # the game's gameStart can arrive before the seek returns, look for it from here on
+        since = self.incoming_events.last_seq
+        self.runtime.submit(
+            self.berserk_client.board.seek,
+            time=time,
+            increment=inc,
+            variant=variant,
+            rated=rated,
+            on_done=lambda _result: self._seek_accepted(since),
+            on_error=lambda e: ErrorWin(self.neovim_session, f"Seek failed \n{e}"),
+        )
+
+    def _seek_accepted(self, since: int):
+        if self.closed:
+            return
+        # the cache was filled by the "already playing?" check, without the new game
+        self.ongoing_games.invalidate()
+        self.buffer[:] = ["", " Game Created!"]
+        utils.add_app_events(
+            self.neovim_session,
+            {
+                "page": "Menu",
+                "event": "create_seek",
+                "opts":{"since": since}
+            })    
         
     def _get_rated_or_not(self, string: str):
         string = string.lower().split(":")[1]
@@ -494,55 +542,105 @@ class MenuWinManager:
                     "You have not set an API token yet and are thus not connected to lichess",
                 )
                 return
-            current_games = self.berserk_client.games.get_ongoing()
+            self.ongoing_games.get(
+                on_done=self._create_challenge_ai,
+                on_error=lambda e: ErrorWin(self.neovim_session, f"Could not fetch ongoing games \n{e}"),
+            )
 
-            if len(current_games) > 0:
-                ErrorWin(self.neovim_session, "You already have an ongoing game.")
-                return
+        elif action == "create_offline_ai":
+            self._create_offline_ai()
 
-            buffer_text = self.buffer[:]
-            level = self._find_numbers_from_string(buffer_text[2])[0]
-            if level > 8 or level < 1:
-                ErrorWin(self.neovim_session, "Ai Level must be between 1 and 8")
-                return
-            clock_limit_seconds = self._find_numbers_from_string(buffer_text[3])[0]
-            if clock_limit_seconds < 600:
-                ErrorWin(self.neovim_session, "Cannot play game under 10 minute time control due to api restrictions")
-                return
-                
-            clock_inc = self._find_numbers_from_string(buffer_text[4])[0]
-            if clock_inc < 0 or clock_inc > 180:
-                ErrorWin(self.neovim_session, "Increment must be between 0 and 180 seconds")
-                return
+        elif action == "switchpage_to_home":
+            self.switch_page("home")
 
-            if buffer_text[5].lower().find("black") != -1:
-                color = "black"
-            elif buffer_text[5].lower().find("white") != -1:
-                color = "white"
-            else:
-                color = choice(["black", "white"])
-                
-            variation = self._get_variant_from_string(buffer_text[6])
-            if variation is None:
-                ErrorWin(self.neovim_session, "Variation must be one of the following: \nstandard, \natomic, \nantichess, \nthreecheck, \nracingkings, \nkingofthehill, \nhorde, \ncrazyhouse, \nchess960")
-                return
+    def _create_offline_ai(self):
+        """ same form as the lichess ai challenge, played against the built-in engine, no token or time limit needed """
+        buffer_text = self.buffer[:]
+        level = self._find_numbers_from_string(buffer_text[2])[0]
+        if level > 8 or level < 1:
+            ErrorWin(self.neovim_session, "Ai Level must be between 1 and 8")
+            return
+        clock_limit_seconds = self._find_numbers_from_string(buffer_text[3])[0]
+        if clock_limit_seconds < 1:
+            ErrorWin(self.neovim_session, "Time control must be at least 1 second")
+            return
+        clock_inc = self._find_numbers_from_string(buffer_text[4])[0]
+        if clock_inc < 0 or clock_inc > 180:
+            ErrorWin(self.neovim_session, "Increment must be between 0 and 180 seconds")
+            return
 
-            response = self.berserk_client.challenges.create_ai(
-                level=level,
-                clock_increment=clock_inc,
-                clock_limit=clock_limit_seconds,
-                color=color,
-                variant=variation
-            )
+        if buffer_text[5].lower().find("black") != -1:
+            color = "black"
+        elif buffer_text[5].lower().find("white") != -1:
+            color = "white"
+        else:
+            color = "random"
+
+        if self._get_variant_from_string(buffer_text[6]) != "standard":
+            ErrorWin(self.neovim_session, "The offline engine only plays the standard variant")
+            return
+
+        utils.add_app_events(self.neovim_session, {
+                "page": "Menu",
+                "event": "start_game_offline",
+                "opts": {"level": level, "clock_limit": clock_limit_seconds, "clock_inc": clock_inc, "color": color},
+            })
+
+    def _create_challenge_ai(self, current_games: list):
+        if self.closed or self.page != "challenge_ai":
+            return
+        if len(current_games) > 0:
+            ErrorWin(self.neovim_session, "You already have an ongoing game.")
+            return
+
+        buffer_text = self.buffer[:]
+        level = self._find_numbers_from_string(buffer_text[2])[0]
+        if level > 8 or level < 1:
+            ErrorWin(self.neovim_session, "Ai Level must be between 1 and 8")
+            return
+        clock_limit_seconds = self._find_numbers_from_string(buffer_text[3])[0]
+        if clock_limit_seconds < 600:
+            ErrorWin(self.neovim_session, "Cannot play game under 10 minute time control due to api restrictions")
+            return
             
-            utils.add_app_events(self.neovim_session, {
-                    "page": "Menu",
-                    "event": "start_game_ai",
-                    "opts": { "response" : response , "side": color},
-                })
+        clock_inc = self._find_numbers_from_string(buffer_text[4])[0]
+        if clock_inc < 0 or clock_inc > 180:
+            ErrorWin(self.neovim_session, "Increment must be between 0 and 180 seconds")
+            return
 
-        elif action == "switchpage_to_home":
-            self.switch_page("home")
+        if buffer_text[5].lower().find("black") != -1:
+            color = "black"
+        elif buffer_text[5].lower().find("white") != -1:
+            color = "white"
+        else:
+            color = choice(["black", "white"])
+            
+        variation = self._get_variant_from_string(buffer_text[6])
+        if variation is None:
+            ErrorWin(self.neovim_session, "Variation must be one of the following: \nstandard, \natomic, \nantichess, \nthreecheck, \nracingkings, \nkingofthehill, \nhorde, \ncrazyhouse, \nchess960")
+            return
+
+        self.runtime.submit(
+            self.berserk_client.challenges.create_ai,
+            level=level,
+            clock_increment=clock_inc,
+            clock_limit=clock_limit_seconds,
+            color=color,
+            variant=variation,
+            on_done=lambda response: self._challenge_ai_created(response, color),
+            on_error=lambda e: ErrorWin(self.neovim_session, f"Could not challenge ai \n{e}"),
+        )
+
+    def _challenge_ai_created(self, response: dict, color: str):
+        if self.closed:
+            return
+        # the cache was filled by the "already playing?" check, the game may beat its gameStart here
+        self.ongoing_games.invalidate()
+        utils.add_app_events(self.neovim_session, {
+                "page": "Menu",
+                "event": "start_game_ai",
+                "opts": { "response" : response , "side": color},
+            })
 
     def _set_buffer_local_keymap(self):
         utils.load_lua_file(self.neovim_session, "./gui_tests/lua/MenuWinCallback.lua")
@@ -561,19 +659,25 @@ class MenuWinManager:
 
     def kill_window(self):
         """ emptys buffer, closes the window and force deletes the buffer """
-        self.buffer[:] = []
-        self.neovim_session.api.win_close(self.window, True)
-        self.neovim_session.api.buf_delete(self.buffer, {"force": True})
+        self.closed = True
+        with utils.batch(self.neovim_session):
+            utils.buf_set_lines(self.neovim_session, self.buffer, [])
+            utils.win_del_force(self.neovim_session, self.window)
+            utils.buf_del_force(self.neovim_session, self.buffer)
 
     def refresh(self):
         self.switch_page(self.page)
+        if self.page == "settings":
+            self._fill_request_timings()
     
     def resize(self):
-        self.neovim_session.api.win_set_config(
+        width, height = utils.workspace_size(self.neovim_session)
+        utils.win_set_config(
+            self.neovim_session,
             self.window,
             {
                 "relative": "editor",
-                "row": (utils.workspace_height(self.neovim_session) - 20) // 2,
-                "col": (utils.workspace_width(self.neovim_session) - 34) // 2, 
+                "row": (height - 20) // 2,
+                "col": (width - 34) // 2, 
             }
         )
\ No newline at end of file
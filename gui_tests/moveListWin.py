@@ -0,0 +1,165 @@
+from pynvim import Nvim
+import utils
+from frame_scheduler import FrameScheduler
+from move_history import MoveHistory
+from typing import Optional
+
+""" Move list window next to the board, one row per move number
+    only the rows that fit in the window are rendered, each window line is an overlay extmark
+    so scrolling through a long game only re-sends the lines whose text changed
+    the moves come from the game's MoveHistory, the ply shown on the board is highlighted
+    """
+
+HL_NUMBER = "MoveListWinNumber"
+HL_CURRENT = "MoveListWinCurrent"
+HL_PENDING = "MoveListWinPending"
+
+
+class MoveListWin:
+    def __init__(
+        self,
+        session: Nvim,
+        frames: FrameScheduler,
+        history: MoveHistory,
+        window_config: Optional[dict] = None,
+    ):
+        self.neovim_session = session
+        self.frames = frames
+        self.history = history
+
+        config = window_config or utils.config_gen(session, config="movelist")
+        self.height = config["height"]
+        self.width = config["width"]
+
+        self.buffer = utils.find_buf(session, "movelist_buffer") or utils.create_buf(
+            session, "movelist_buffer"
+        )
+        utils.buf_set_lines(self.neovim_session, self.buffer, [" " * self.width] * self.height)
+        self.window = utils.find_window_from_title(
+            session, "MoveListWindow"
+        ) or utils.create_window(
+            self.neovim_session,
+            self.buffer,
+            False,
+            config,
+            "MoveListWindow",
+        )
+        utils.win_set_local_winhighlight(self.neovim_session, self.window, "Normal:MoveListWinBackground,FloatBorder:MoveListWinBackground")
+        self.namespace = utils.namespace(self.neovim_session, "MoveListNs")
+
+        self.autocmd_group = utils.create_augroup(
+            self.neovim_session, "MoveListWinAuGroup", {"clear": True}
+        )
+
+        """first move number row in the window"""
+        self.top = 0
+        """keeps the latest move in view while the user has not scrolled away"""
+        self.follow = True
+        """plies played in the shown position, None while the board shows the game"""
+        self.shown_ply: Optional[int] = None
+        """index of our move that lichess has not confirmed yet"""
+        self.pending_ply: Optional[int] = None
+        """last chunks sent for every window line, render only sends the lines that differ"""
+        self.rendered_lines: list[Optional[list]] = [None] * self.height
+
+    def set_history(self, history: MoveHistory):
+        """lists another game's moves, scrolled to its latest move"""
+        self.history = history
+        self.follow = True
+        self.shown_ply = None
+        self.update()
+
+    def update(self):
+        """call after moves were pushed to or popped from the history"""
+        if self.follow:
+            self.top = self._max_top()
+        self.top = min(self.top, self._max_top())
+        self.frames.mark_dirty(self)
+
+    def scroll(self, rows: int):
+        self.top = max(0, min(self.top + rows, self._max_top()))
+        self.follow = self.top == self._max_top()
+        self.frames.mark_dirty(self)
+
+    def show_ply(self, ply: Optional[int]):
+        """highlights the move that led to ply and scrolls it into view, None highlights the latest move"""
+        self.shown_ply = ply
+        if ply is None:
+            self.follow = True
+            self.update()
+            return
+
+        row = self._row_of_ply(max(ply - 1, 0))
+        if row < self.top:
+            self.top = row
+        elif row >= self.top + self.height:
+            self.top = row - self.height + 1
+        self.follow = self.top == self._max_top()
+        self.frames.mark_dirty(self)
+
+    def render(self):
+        current = (self.shown_ply if self.shown_ply is not None else len(self.history)) - 1
+        for line in range(self.height):
+            chunks = self._line_chunks(self.top + line, current)
+            if self.rendered_lines[line] == chunks:
+                continue
+            self.rendered_lines[line] = chunks
+            utils.buf_set_extmark(
+                self.neovim_session,
+                self.buffer,
+                self.namespace,
+                line,
+                0,
+                utils.ExtmarksOptions(id=line + 1, virt_text=chunks, virt_text_pos="overlay"),
+            )
+
+    def _line_chunks(self, row: int, current: int) -> list:
+        if row >= self.history.row_count():
+            return [[" " * self.width, ""]]
+
+        number, white, black = self.history.row(row)
+        white_ply = row * 2 - self.history.offset
+        return [
+            [f"{number:>4} ", HL_NUMBER],
+            [f"{white:<8}", self._ply_hl(white_ply, current)],
+            [f"{black:<8}", self._ply_hl(white_ply + 1, current)],
+        ]
+
+    def _ply_hl(self, ply: int, current: int) -> str:
+        if ply == self.pending_ply:
+            return HL_PENDING
+        return HL_CURRENT if ply == current else ""
+
+    def _row_of_ply(self, ply: int) -> int:
+        return (ply + self.history.offset) // 2
+
+    def _max_top(self) -> int:
+        return max(self.history.row_count() - self.height, 0)
+
+    def set_autocmd(self, handle: int):
+        utils.create_autocmd(
+            self.neovim_session,
+            "BufEnter",
+            {
+                "group": self.autocmd_group,
+                "buffer": self.buffer.number,
+                "command": f"call nvim_set_current_win({handle})",
+            },
+        )
+
+    def kill_window(self):
+        self.frames.discard(self)
+        utils.win_del_force(self.neovim_session, self.window)
+        utils.buf_del_force(self.neovim_session, self.buffer)
+
+    def resize(self):
+        width, height = utils.workspace_size(self.neovim_session)
+        utils.win_set_config(
+            self.neovim_session,
+            self.window,
+            {
+                "relative": "editor",
+                "row": (height - self.height) // 2,
+                "col": (width - 28 + 32) // 2 + 31,
+            }
+        )
@@ -0,0 +1,85 @@
+from chess import Board, Move, BLACK
+from stats_utils import MaterialTracker
+
+""" the SAN of every ply of a game, owned by GameWinManager
+    a move is converted to SAN once when it is pushed (board.san_and_push), the windows read from here
+    instead of replaying the board, takebacks pop from the same history
+    every KEYFRAME_INTERVAL plies a copy of the position is kept so any ply can be rebuilt without replaying the game
+    the material of both sides is tracked alongside (stats_utils.MaterialTracker)
+    """
+
+KEYFRAME_INTERVAL = 16
+
+
+class MoveHistory:
+    def __init__(self, board: Board):
+        self.sans: list[str] = []
+        self.moves: list[Move] = []
+        """keyframes[i] is the position after i * KEYFRAME_INTERVAL plies"""
+        self.keyframes: list[Board] = []
+        self.reset(board)
+
+    def reset(self, board: Board):
+        """board is the starting position, e.g. after set_fen() for a fromPosition game"""
+        self.sans.clear()
+        self.moves.clear()
+        self.keyframes = [board.copy(stack=False)]
+        self.material = MaterialTracker(board)
+        self.first_move_number = board.fullmove_number
+        """1 when the first ply is black's, so ply indexes line up with move numbers"""
+        self.offset = 1 if board.turn == BLACK else 0
+
+    def push(self, board: Board, move: Move) -> str:
+        """pushes move on board and returns its SAN"""
+        san = self.material.push(board, move, board.san_and_push)
+        self.sans.append(san)
+        self.moves.append(move)
+        if len(self.moves) % KEYFRAME_INTERVAL == 0:
+            self.keyframes.append(board.copy(stack=False))
+        return san
+
+    def pop(self, board: Board) -> Move:
+        self.sans.pop()
+        self.moves.pop()
+        self.material.pop()
+        del self.keyframes[len(self.moves) // KEYFRAME_INTERVAL + 1:]
+        return board.pop()
+
+    def position(self, ply: int) -> Board:
+        """the position after ply plies (0 is the starting position), replays less than KEYFRAME_INTERVAL moves"""
+        keyframe = ply // KEYFRAME_INTERVAL
+        board = self.keyframes[keyframe].copy(stack=False)
+        for move in self.moves[keyframe * KEYFRAME_INTERVAL:ply]:
+            board.push(move)
+        return board
+
+    def move_number(self, ply: int) -> int:
+        return self.first_move_number + (ply + self.offset) // 2
+
+    def is_white(self, ply: int) -> bool:
+        return (ply + self.offset) % 2 == 0
+
+    def row_count(self) -> int:
+        """rows of the move list, one per move number"""
+        if not self.sans:
+            return 0
+        return (len(self.sans) + self.offset + 1) // 2
+
+    def row(self, index: int) -> list[str]:
+        """[number, white san, black san] of the index'th move number, "..." / " " where a side has no ply"""
+        white_ply = index * 2 - self.offset
+        black_ply = white_ply + 1
+        return [
+            f"{self.first_move_number + index}.",
+            self.sans[white_ply] if 0 <= white_ply < len(self.sans) else "...",
+            self.sans[black_ply] if black_ply < len(self.sans) else " ",
+        ]
+
+    def tail(self, rows: int) -> list[list[str]]:
+        """the last rows move numbers, padded with blank rows up to rows"""
+        count = self.row_count()
+        tail = [self.row(index) for index in range(max(count - rows, 0), count)]
+        return tail + [[" ", " ", " "] for _ in range(rows - len(tail))]
+
+    def __len__(self) -> int:
+        return len(self.sans)
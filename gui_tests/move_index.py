@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from typing import Optional, Union
+
+from chess import Board, Move, WHITE, BLACK
+from utils import AmbiguousMoveError
+
+""" typed moves are looked up instead of parsed
+    the legal moves of a position are generated once into a dict from every accepted spelling of a move:
+    SAN ("Nxf3+"), UCI ("g1f3", "P@e4"), SAN without the capture/check/promotion marks ("Nf3", "ed5", "e8Q"),
+    castling as O-O / 0-0 / OO and a lowercase form of all of these as long as it names only one move
+    an index is kept per position (position_key), the last few positions (the live one and the premove ones) stay cached
+    """
+
+CASTLING_FORMS = {"O-O": ("0-0", "OO", "00"), "O-O-O": ("0-0-0", "OOO", "000")}
+
+
+def position_key(board: Board) -> tuple:
+    """hashable position of board, the bitboards, side, castling and en passant plus the pockets of a crazyhouse
+    board and the checks left of a three-check board, the same as a zobrist hash tells positions apart without
+    hashing every piece on every lookup"""
+    pockets = getattr(board, "pockets", None)
+    remaining_checks = getattr(board, "remaining_checks", None)
+    return (
+        board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+        board.occupied_co[WHITE], board.occupied_co[BLACK], board.promoted,
+        board.turn, board.castling_rights, board.ep_square,
+        tuple(str(pocket) for pocket in pockets) if pockets else None,
+        tuple(remaining_checks) if remaining_checks else None,
+    )
+
+
+def shorthand(san: str) -> str:
+    """san without the capture, check and promotion marks"""
+    return san.rstrip("+#").replace("x", "").replace("=", "")
+
+
+class PositionIndex:
+    def __init__(self, board: Board):
+        """spelling -> move, None for a lowercase spelling shared by several moves"""
+        self.moves: dict[str, Optional[Move]] = {}
+        """lowercase spelling shared by several moves -> their SANs"""
+        self.ambiguous: dict[str, list[str]] = {}
+        """SAN of every legal move, in move generation order"""
+        self.sans: list[str] = []
+        self.san_of: dict[Move, str] = {}
+        self._completions: Optional[dict[str, str]] = None
+
+        lowercase: dict[str, list[Move]] = {}
+        for move in board.legal_moves:
+            san = board.san(move)
+            self.sans.append(san)
+            self.san_of[move] = san
+            forms = {san, board.uci(move), shorthand(san), san.rstrip("+#")}
+            forms.update(CASTLING_FORMS.get(san.rstrip("+#"), ()))
+            for form in forms:
+                self.moves[form] = move
+                shared = lowercase.setdefault(form.lower(), [])
+                if move not in shared:
+                    shared.append(move)
+
+        # exact spellings win over the lowercase ones, "Bc4" and "bc4" (bxc4) are different moves
+        for form, moves in lowercase.items():
+            if form in self.moves:
+                continue
+            if len(moves) == 1:
+                self.moves[form] = moves[0]
+            else:
+                self.moves[form] = None
+                self.ambiguous[form] = [self.san_of[move] for move in moves]
+
+    def completions(self) -> dict[str, Union[str, bool]]:
+        """spelling -> SAN, for completing input on the lua side, False for an ambiguous spelling, it is sent on
+        to lookup() which names the moves it matches"""
+        if self._completions is None:
+            self._completions = {
+                form: self.san_of[move] if move is not None else False for form, move in self.moves.items()
+            }
+        return self._completions
+
+    def lookup(self, text: str) -> Move:
+        """raises ValueError for an illegal move, AmbiguousMoveError when a lowercase form names several moves"""
+        try:
+            move = self.moves[text]
+        except KeyError:
+            raise ValueError(f"illegal move: {text}") from None
+        if move is None:
+            raise AmbiguousMoveError(text, self.ambiguous[text])
+        return move
+
+
+class MoveIndex:
+    def __init__(self, maxsize: int = 4):
+        self.maxsize = maxsize
+        self.positions: OrderedDict[tuple, PositionIndex] = OrderedDict()
+
+    def position(self, board: Board) -> PositionIndex:
+        """the index of board, built on the first lookup after the position changed"""
+        key = position_key(board)
+        index = self.positions.get(key)
+        if index is None:
+            index = self.positions[key] = PositionIndex(board)
+            if len(self.positions) > self.maxsize:
+                self.positions.popitem(last=False)
+        else:
+            self.positions.move_to_end(key)
+        return index
+
+    def lookup(self, board: Board, text: str) -> Move:
+        return self.position(board).lookup(text)
+
+    def sans(self, board: Board) -> list[str]:
+        return self.position(board).sans
@@ -0,0 +1,374 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from random import uniform
+from time import monotonic
+from typing import Callable, NamedTuple, Optional
+
+import chess
+from chess import Board, Move
+from chess.polyglot import zobrist_hash
+
+""" the built-in opponent of offline games, an alpha-beta search in a process pool so the ui loop never waits on it
+    iterative deepening with a transposition table keyed by chess.polyglot.zobrist_hash, the table move, captures
+    by most valuable victim / least valuable attacker and killer moves are searched first, the leaves run a
+    quiescence search over captures and promotions
+    the table lives in the worker process and is reused from move to move, it is capped at tt_mb megabytes
+    levels 1-8 mirror the lichess stockfish levels of the challenge ai page, a deeper and longer search per level
+    and random noise on the root scores of the low ones
+    """
+
+MATE = 100_000
+# scores beyond this are mates, the table keeps them as plies to mate from the entry's position
+MATE_BOUND = MATE - 1000
+# every table entry costs about this much, a dict slot, the key and the entry tuple
+TT_ENTRY_BYTES = 160
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class Level(NamedTuple):
+    depth: int
+    nodes: int
+    """seconds per move, lichess gives stockfish 50ms at level 1 up to 1s at level 8"""
+    movetime: float
+    """centipawns of noise on the root moves' scores, the low levels miss things"""
+    noise: int
+
+
+LEVELS = {
+    1: Level(depth=1, nodes=300, movetime=0.05, noise=300),
+    2: Level(depth=2, nodes=1_500, movetime=0.1, noise=200),
+    3: Level(depth=2, nodes=5_000, movetime=0.15, noise=120),
+    4: Level(depth=3, nodes=15_000, movetime=0.2, noise=60),
+    5: Level(depth=4, nodes=40_000, movetime=0.3, noise=30),
+    6: Level(depth=5, nodes=100_000, movetime=0.4, noise=10),
+    7: Level(depth=6, nodes=250_000, movetime=0.5, noise=0),
+    8: Level(depth=8, nodes=1_000_000, movetime=1.0, noise=0),
+}
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+# piece-square tables from white's side, a8 first so they read like a board
+PST = {
+    chess.PAWN: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    chess.KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    chess.BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    chess.ROOK: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    chess.QUEEN: (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    chess.KING: (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ),
+}
+
+# square -> value of every piece type for each color, material included
+SQUARE_VALUES = {
+    (piece_type, color): tuple(
+        PIECE_VALUES[piece_type] + PST[piece_type][chess.square_mirror(square) if color == chess.WHITE else square]
+        for square in chess.SQUARES
+    )
+    for piece_type in PST
+    for color in chess.COLORS
+}
+
+
+class SearchResult(NamedTuple):
+    move: Optional[str]
+    """centipawns from the side to move, +-MATE minus the plies to mate"""
+    score: int
+    depth: int
+    nodes: int
+    seconds: float
+
+
+class _Stop(Exception):
+    pass
+
+
+def evaluate(board: Board) -> int:
+    """material and piece squares, from the side to move"""
+    score = 0
+    for square, piece in board.piece_map().items():
+        value = SQUARE_VALUES[piece.piece_type, piece.color][square]
+        score += value if piece.color == chess.WHITE else -value
+    return score if board.turn == chess.WHITE else -score
+
+
+class Search:
+    def __init__(self, board: Board, level: Level, tt: dict, tt_entries: int):
+        self.board = board
+        self.level = level
+        self.tt = tt
+        self.tt_entries = tt_entries
+        self.nodes = 0
+        self.deadline = monotonic() + level.movetime
+        """depth 1 always finishes, the node and time limits only stop the deeper iterations"""
+        self.limited = False
+        self.killers: list[list[Optional[Move]]] = [[None, None] for _ in range(64)]
+
+    def run(self) -> SearchResult:
+        started = monotonic()
+        moves = list(self.board.legal_moves)
+        if not moves:
+            return SearchResult(None, -MATE if self.board.is_check() else 0, 0, 0, 0)
+
+        best, best_score, depth_done = moves[0], 0, 0
+        for depth in range(1, self.level.depth + 1):
+            self.limited = depth > 1
+            try:
+                scores = self._root(moves, depth)
+            except _Stop:
+                break
+            depth_done = depth
+            # the best move of this iteration is searched first in the next one
+            moves.sort(key=lambda move: scores[move], reverse=True)
+            best, best_score = moves[0], scores[moves[0]]
+            if abs(best_score) > MATE - 100:
+                break
+
+        if self.level.noise:
+            best = max(moves, key=lambda move: scores.get(move, -MATE) + uniform(0, self.level.noise))
+        return SearchResult(best.uci(), best_score, depth_done, self.nodes, monotonic() - started)
+
+    def _root(self, moves: list[Move], depth: int) -> dict[Move, int]:
+        scores = {}
+        alpha = -MATE - 1
+        for move in moves:
+            self.board.push(move)
+            score = -self._alphabeta(depth - 1, -MATE - 1, -alpha, 1)
+            self.board.pop()
+            scores[move] = score
+            # the noise of the low levels needs a score for every move, not just a bound
+            if not self.level.noise:
+                alpha = max(alpha, score)
+        return scores
+
+    def _alphabeta(self, depth: int, alpha: int, beta: int, ply: int) -> int:
+        self._count()
+        board = self.board
+        if board.is_repetition(2) or board.halfmove_clock >= 100:
+            return 0
+        if depth <= 0:
+            return self._quiescence(alpha, beta)
+
+        key = zobrist_hash(board)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, entry_score, flag, tt_move = entry
+            entry_score = _from_tt(entry_score, ply)
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if flag == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        original_alpha = alpha
+        best_score, best_move = -MATE - 1, None
+        any_move = False
+        for move in self._ordered(board, tt_move, ply):
+            any_move = True
+            board.push(move)
+            score = -self._alphabeta(depth - 1, -beta, -alpha, ply + 1)
+            board.pop()
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not board.is_capture(move) and ply < len(self.killers):
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1], killers[0] = killers[0], move
+                break
+
+        if not any_move:
+            return -(MATE - ply) if board.is_check() else 0
+
+        flag = EXACT
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        self._store(key, (depth, _to_tt(best_score, ply), flag, best_move))
+        return best_score
+
+    def _quiescence(self, alpha: int, beta: int) -> int:
+        self._count()
+        board = self.board
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in sorted(
+            (move for move in board.generate_legal_moves() if move.promotion or board.is_capture(move)),
+            key=lambda move: self._capture_order(board, move),
+            reverse=True,
+        ):
+            board.push(move)
+            score = -self._quiescence(-beta, -alpha)
+            board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def _ordered(self, board: Board, tt_move: Optional[Move], ply: int) -> list[Move]:
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+
+        def order(move: Move) -> int:
+            if move == tt_move:
+                return 1_000_000
+            if board.is_capture(move) or move.promotion:
+                return 100_000 + self._capture_order(board, move)
+            if move in killers:
+                return 50_000
+            return 0
+
+        return sorted(board.legal_moves, key=order, reverse=True)
+
+    def _capture_order(self, board: Board, move: Move) -> int:
+        """most valuable victim first, then least valuable attacker"""
+        victim = board.piece_type_at(move.to_square) or (chess.PAWN if board.is_en_passant(move) else None)
+        attacker = board.piece_type_at(move.from_square)
+        value = PIECE_VALUES[victim] * 10 if victim else 0
+        if move.promotion:
+            value += PIECE_VALUES[move.promotion]
+        return value - PIECE_VALUES[attacker] // 10
+
+    def _store(self, key: int, entry: tuple):
+        if key not in self.tt and len(self.tt) >= self.tt_entries:
+            # the oldest entry goes first, dicts keep insertion order
+            del self.tt[next(iter(self.tt))]
+        self.tt[key] = entry
+
+    def _count(self):
+        self.nodes += 1
+        if not self.limited:
+            return
+        if self.nodes >= self.level.nodes or (self.nodes & 255 == 0 and monotonic() > self.deadline):
+            raise _Stop()
+
+
+def _to_tt(score: int, ply: int) -> int:
+    """a mate score counts plies from the root, the table entry counts them from its own position"""
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _from_tt(score: int, ply: int) -> int:
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+"""the transposition table of a worker process, kept between searches"""
+_tt: dict = {}
+
+
+def search(fen: str, moves: list[str], level: int, tt_mb: int = 32) -> SearchResult:
+    """runs in a worker process, moves are played from fen so repetitions are seen"""
+    board = Board(fen)
+    for uci in moves:
+        board.push(Move.from_uci(uci))
+    tt_entries = tt_mb * 1024 * 1024 // TT_ENTRY_BYTES
+    while len(_tt) > tt_entries:
+        del _tt[next(iter(_tt))]
+    return Search(board, LEVELS[level], _tt, tt_entries).run()
+
+
+class OfflineEngine:
+    def __init__(self, deliver: Callable[..., None], workers: int = 1, tt_mb: int = 32):
+        """deliver(fn, *args) must schedule fn(*args) on the ui loop, the worker processes start with the first search"""
+        self.deliver = deliver
+        self.workers = workers
+        self.tt_mb = tt_mb
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def think(
+        self,
+        board: Board,
+        level: int,
+        on_done: Callable[[SearchResult], None],
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ) -> Future:
+        if self.pool is None:
+            # spawn, forking the app would copy the runtime's threads and sockets into the workers
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        root = board.root()
+        future = self.pool.submit(
+            search, root.fen(), [move.uci() for move in board.move_stack], level, self.tt_mb
+        )
+        future.add_done_callback(lambda f: self._done(f, on_done, on_error))
+        return future
+
+    def _done(self, future: Future, on_done, on_error):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.deliver(on_done, future.result())
+        elif on_error:
+            self.deliver(on_error, error)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
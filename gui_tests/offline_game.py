@@ -0,0 +1,183 @@
+from random import choice
+from time import monotonic_ns
+from typing import Callable, Literal, Optional
+
+from berserk.utils import datetime_from_millis
+from chess import Board, Move
+
+from game_clock import NS_PER_MS
+from offline_engine import OfflineEngine, SearchResult
+
+""" a game against the built-in engine (offline_engine) without lichess
+    OfflineGame plays the server's part, it keeps the clocks and the result and sends the same gameFull / gameState
+    events as a lichess game stream, so GameSessions and the game window handle it like any other game
+    """
+
+
+class OfflineGame:
+    def __init__(
+        self,
+        engine: OfflineEngine,
+        level: int,
+        clock_limit: int,
+        clock_increment: int,
+        color: Literal["black", "white", "random"] = "random",
+        call_later: Optional[Callable[[float, Callable[[], None]], None]] = None,
+    ):
+        """clock_limit and clock_increment are seconds, color is the player's side
+        call_later(delay, fn) must run fn on the ui loop after delay seconds, it flags a side that does not move"""
+        self.engine = engine
+        self.level = level
+        self.limit_ms = clock_limit * 1000
+        self.inc_ms = clock_increment * 1000
+        self.color = color if color in ("black", "white") else choice(["black", "white"])
+        self.gameId = f"offline{monotonic_ns() % 10**8}"
+        self.board = Board()
+        self.times = {"white": self.limit_ms, "black": self.limit_ms}
+        """monotonic_ns the side to move started thinking at, None until the first move"""
+        self.turn_started: Optional[int] = None
+        self.status = "started"
+        self.winner: Optional[str] = None
+        self.emit: Optional[Callable[[dict], None]] = None
+        self.call_later = call_later
+        """on_error(exception) when the engine failed, the game is aborted"""
+        self.on_error: Optional[Callable[[Exception], None]] = None
+        """bumped when the game ends, a search started before does not play its move"""
+        self.generation = 0
+
+    @property
+    def game(self) -> dict:
+        """the entry of this game in the shape of client.games.get_ongoing()"""
+        return {
+            "gameId": self.gameId,
+            "color": self.color,
+            "variant": {"key": "standard"},
+            "opponent": {"username": f"Engine Level {self.level}", "ai": self.level},
+        }
+
+    def start(self, emit: Callable[[dict], None]):
+        """emit(event) receives the game's events, the engine moves first when the player is black"""
+        self.emit = emit
+        player = {"name": "You", "title": None, "rating": "-"}
+        engine = {"aiLevel": self.level}
+        emit({
+            "type": "gameFull",
+            "id": self.gameId,
+            "variant": {"key": "standard"},
+            "initialFen": "startpos",
+            "white": player if self.color == "white" else engine,
+            "black": player if self.color == "black" else engine,
+            "state": self._state(millis=int),
+        })
+        if self.color == "black":
+            self._think()
+
+    def play(self, move: Move):
+        """the player's move, a move out of turn or an illegal one is ignored like lichess refuses it"""
+        if self.status != "started" or self._side() != self.color or not self.board.is_legal(move):
+            return
+        self._push(move)
+        if self.status == "started":
+            self._think()
+
+    def resign(self):
+        if self.status == "started":
+            self._end("resign", self._other(self.color))
+
+    def close(self):
+        self.generation += 1
+        self.status = "aborted" if self.status == "started" else self.status
+
+    def _think(self):
+        generation = self.generation
+        self.engine.think(
+            self.board, self.level,
+            lambda result: self._engine_moved(result, generation),
+            lambda error: self._engine_failed(error, generation),
+        )
+
+    def _engine_moved(self, result: SearchResult, generation: int):
+        if generation != self.generation or self.status != "started" or result.move is None:
+            return
+        self._push(Move.from_uci(result.move))
+
+    def _engine_failed(self, error: Exception, generation: int):
+        if generation != self.generation or self.status != "started":
+            return
+        # nobody would ever move for the engine
+        self._end("aborted", None)
+        if self.on_error:
+            self.on_error(error)
+
+    def _watch_flag(self):
+        """flags the side to move when its time is up, a side that never moves loses on time as well"""
+        if self.call_later is None or self.turn_started is None:
+            return
+        generation, ply = self.generation, len(self.board.move_stack)
+        self.call_later(self.times[self._side()] / 1000, lambda: self._flag(generation, ply))
+
+    def _flag(self, generation: int, ply: int):
+        if generation != self.generation or ply != len(self.board.move_stack) or self.status != "started":
+            return
+        side = self._side()
+        left = self.times[side] - (monotonic_ns() - self.turn_started) // NS_PER_MS
+        if left > 0:
+            self.call_later(left / 1000, lambda: self._flag(generation, ply))
+            return
+        self.times[side] = 0
+        self._end("outoftime", self._other(side))
+
+    def _push(self, move: Move):
+        side = self._side()
+        now = monotonic_ns()
+        if self.turn_started is not None:
+            self.times[side] -= (now - self.turn_started) // NS_PER_MS
+            if self.times[side] <= 0:
+                self.times[side] = 0
+                self._end("outoftime", self._other(side))
+                return
+            self.times[side] += self.inc_ms
+        # like on lichess the clocks start with black's first move
+        if len(self.board.move_stack) >= 1:
+            self.turn_started = now
+
+        self.board.push(move)
+        outcome = self.board.outcome(claim_draw=True)
+        if outcome is None:
+            self._send()
+            self._watch_flag()
+        elif outcome.winner is not None:
+            self._end("mate", "white" if outcome.winner else "black")
+        else:
+            self._end("stalemate" if self.board.is_stalemate() else "draw", None)
+
+    def _end(self, status: str, winner: Optional[str]):
+        self.generation += 1
+        self.status = status
+        self.winner = winner
+        self._send()
+
+    def _send(self):
+        if self.emit:
+            self.emit(self._state())
+
+    def _state(self, millis: Callable[[int], object] = datetime_from_millis) -> dict:
+        """a gameState, the times are datetimes like berserk hands them out, gameFull's state has plain ms"""
+        state = {
+            "type": "gameState",
+            "moves": " ".join(move.uci() for move in self.board.move_stack),
+            "wtime": millis(self.times["white"]),
+            "btime": millis(self.times["black"]),
+            "winc": millis(self.inc_ms),
+            "binc": millis(self.inc_ms),
+            "status": self.status,
+        }
+        if self.winner:
+            state["winner"] = self.winner
+        return state
+
+    def _side(self) -> str:
+        return "white" if self.board.turn else "black"
+
+    def _other(self, side: str) -> str:
+        return "black" if side == "white" else "white"
@@ -0,0 +1,107 @@
+from time import monotonic
+from typing import Callable, Optional
+from berserk import Client
+from lichess_runtime import LichessRuntime
+
+""" one cache of client.games.get_ongoing() per account, read by the menu and by Main when joining a game
+    entries live for ttl seconds and are refreshed in the background before they expire, gameStart and
+    gameFinish from the incoming events stream invalidate the entry instead of every action re-fetching it
+    everything here runs on the ui loop, the fetch itself goes through the LichessRuntime
+    """
+
+
+class _Entry:
+    def __init__(self):
+        self.games: Optional[list] = None
+        self.fetched_at = 0.0
+        self.fetching = False
+        """bumped by invalidate(), a fetch started before it is not trusted"""
+        self.generation = 0
+        self.waiters: list[tuple[Callable[[list], None], Optional[Callable[[Exception], None]]]] = []
+
+
+class OngoingGamesCache:
+    def __init__(self, runtime: LichessRuntime, ttl: float = 60, max_games: int = 50):
+        self.runtime = runtime
+        self.ttl = ttl
+        self.max_games = max_games
+        self.entries: dict[str, _Entry] = {}
+        self.client: Optional[Client] = None
+        self.account_id: Optional[str] = None
+
+    def set_account(self, client: Optional[Client], account_id: Optional[str]):
+        """call after logging in, None logs out, entries of other accounts are kept until they expire"""
+        self.client = client
+        self.account_id = account_id
+        if client is None:
+            self.runtime.stop("ongoing_games_refresh")
+            return
+        self.runtime.start_timer("ongoing_games_refresh", self.ttl * 0.9, self.refresh)
+        self.refresh()
+
+    def get(self, on_done: Callable[[list], None], on_error: Optional[Callable[[Exception], None]] = None):
+        """on_done(games) right away when the entry is fresh, otherwise once the fetch completes"""
+        if self.client is None:
+            if on_error:
+                on_error(ConnectionError("not logged in to lichess"))
+            return
+        entry = self._entry()
+        if entry.games is not None and monotonic() - entry.fetched_at < self.ttl:
+            on_done(entry.games)
+            return
+        entry.waiters.append((on_done, on_error))
+        self._fetch(entry)
+
+    def refresh(self):
+        """fetches in the background, readers keep getting the current games until it completes"""
+        if self.client is not None:
+            self._fetch(self._entry())
+
+    def invalidate(self):
+        entry = self._entry()
+        entry.games = None
+        entry.generation += 1
+        self.refresh()
+
+    def handle_incoming_event(self, event: dict):
+        if event.get("type") in ("gameStart", "gameFinish"):
+            self.invalidate()
+
+    def _entry(self) -> _Entry:
+        return self.entries.setdefault(self.account_id, _Entry())
+
+    def _fetch(self, entry: _Entry):
+        if entry.fetching:
+            return
+        entry.fetching = True
+        generation = entry.generation
+        # the entry is the account's of this client, whatever the user logs into while the request is in flight
+        client = self.client
+        self.runtime.submit(
+            client.games.get_ongoing, self.max_games,
+            on_done=lambda games: self._fetched(entry, client, generation, games),
+            on_error=lambda e: self._failed(entry, e),
+        )
+
+    def _fetched(self, entry: _Entry, client: Client, generation: int, games: list):
+        if client is not self.client:
+            # logged out or into another account meanwhile, the entry is fetched again when it is read
+            self._failed(entry, ConnectionError("the lichess account changed"))
+            return
+        entry.fetching = False
+        if generation != entry.generation:
+            # invalidated while the request was in flight, the result may predate the change
+            self._fetch(entry)
+            return
+        entry.games = games
+        entry.fetched_at = monotonic()
+        waiters, entry.waiters = entry.waiters, []
+        for on_done, _ in waiters:
+            on_done(games)
+
+    def _failed(self, entry: _Entry, e: Exception):
+        entry.fetching = False
+        waiters, entry.waiters = entry.waiters, []
+        for _, on_error in waiters:
+            if on_error:
+                on_error(e)
@@ -2,9 +2,13 @@ from pynvim.api import Nvim
 from utils import *
 from berserk.utils import to_millis
 from typing import Literal, TypedDict, Optional, Union
-from chess import Board
-from stats_utils import timems_to_incstring, timems_to_timestring, white_pieces_taken, black_pieces_taken
-from game_clock import GameClock
+from stats_utils import timems_to_incstring, timems_to_timestring, material_string
+from chess import WHITE, BLACK
+from game_clock import GameClock, NS_PER_MS
+from frame_scheduler import FrameScheduler
+from move_history import MoveHistory
+from engine_analysis import EngineInfo
+from time import monotonic_ns
 class StatsDict(TypedDict, total=False):
     wname: str
     wflair: str
@@ -36,16 +40,28 @@ empty_stats = [
 ]
 
 
+# clock, name and material lines of each player at the top and bottom of the window
+PLAYER_LINES = 3
+# rows between the players, the last moves and the engine's eval while analysing
+MIDDLE_LINES = 3
+# the window is 30 wide with a border
+LINE_WIDTH = 28
+
+
 class StatsWin:
     """time and increment must be in ms"""
 
     def __init__(
         self,
         session: Nvim,
+        frames: FrameScheduler,
+        history: MoveHistory,
         window_config: Optional[dict] = None,
         myside: Literal['white', 'black'] = "white"
     ):
         self.neovim_session = session
+        self.frames = frames
+        self.history = history
 
         
         self.buffer = find_buf(session, "stats_buffer") or create_buf(
@@ -60,84 +76,96 @@ class StatsWin:
             "StatsWindow",
         )
         self.namespace = namespace(self.neovim_session, "StatusWinExtmarkNS")
+        load_lua_file(self.neovim_session, "./gui_tests/lua/statsWin.lua")
         win_set_local_winhighlight(self.neovim_session, self.window, "Normal:StatsWinBackground,FloatBorder:StatsWinFloatBorder")
         
-        self.augroup = self.neovim_session.api.create_augroup(
-            "StatsWinAuGroup", {"clear": True}
+        self.augroup = create_augroup(
+            self.neovim_session, "StatsWinAuGroup", {"clear": True}
         )
 
         self.flip = myside != "white"
 
 
-        self.gameclock = None
+        """the game's clock, owned and resynced by GameWinManager"""
+        self.clock: Optional[GameClock] = None
+        """eval and pv of the analysis, they take the place of move rows"""
+        self.eval_lines: list = []
 
         
-    def handle_gameFull_event(self, event, board):
-        self.gameclock = self._create_gameclock(event)
-        if " " in event['state']['moves']:
-            self.gameclock.start()
-        self.virt_lines = self._create_stats_extmark_virt_lines(event, board)
+    def set_game(self, history: MoveHistory, myside: Literal['white', 'black']):
+        """shows another game, the stats wait for its gameFull"""
+        self.history = history
+        self.flip = myside != "white"
+        self.clock = None
+        self.virt_lines = [[[line, ""]] for line in empty_stats]
         self.redraw()
-    
-    def _create_gameclock(self, event):
-        state = event
-        if event['type'] == "gameFull":
-            state = event['state']
-            
-        current_playing_side = "white"
-        if state['moves'] != "":
-            current_playing_side = "white" if len(state['moves'].split(" ")) % 2 == 0 else "black"
-        return GameClock(state['wtime'], state['winc'], state['btime'], state['binc'], current_playing_side)
 
-    def update_times(self):
-        self.virt_lines[0][0][0] = timems_to_timestring(self.gameclock.black_time)
-        self.virt_lines[0][2][0] = timems_to_incstring(self.gameclock.black_inc)
-        
-        self.virt_lines[-1][0][0] = timems_to_timestring(self.gameclock.white_time)
-        self.virt_lines[-1][2][0] = timems_to_incstring(self.gameclock.white_inc)
+    def handle_gameFull_event(self, event, clock: GameClock):
+        self.clock = clock
+        self.virt_lines = self._create_stats_extmark_virt_lines(event)
         self.redraw()
     
+    def set_eval(self, info: Optional[EngineInfo]):
+        """None hides the eval section"""
+        self.eval_lines = self._eval_lines(info) if info else []
+        # before the gameFull the placeholder is shown, the section comes with the stats
+        if self.clock is not None:
+            self.virt_lines = self.virt_lines[:PLAYER_LINES] + self._middle_lines() + self.virt_lines[-PLAYER_LINES - 1:]
+            self.redraw()
+
     def flip_stats(self):
         self.flip = not self.flip
         self.redraw()
     
     def redraw(self):
-        """ Redraws from self.virt_lines If self.virt_lines is unchanged so is the buffer"""
+        """ Redraws from self.virt_lines with the next frame"""
+        self.frames.mark_dirty(self)
+
+    def render(self):
+        """the clock lines are counted down by lua (lua/statsWin.lua), no rpc is needed until the next game event"""
+        if self.clock is None:
+            exec_lua(self.neovim_session, "StatsWinStop(...)", self.buffer)
+            buf_set_extmark(
+                self.neovim_session, self.buffer, self.namespace, 0, 0, ExtmarksOptions(id=1, virt_lines=self.virt_lines)
+            )
+            return
         _virt_lines = self.virt_lines
         if self.flip:
-            _virt_lines = self.virt_lines[::-1][:2:] + self.virt_lines[2:-2] + self.virt_lines[:2:][::-1]
-        buf_set_extmark(self.neovim_session, self.buffer, self.namespace, 0, 0, ExtmarksOptions(
-                id=1,
-                virt_lines=_virt_lines
-        ))
-        force_redraw(self.neovim_session)
+            _virt_lines = (
+                self.virt_lines[::-1][:PLAYER_LINES]
+                + self.virt_lines[PLAYER_LINES:-PLAYER_LINES]
+                + self.virt_lines[:PLAYER_LINES][::-1]
+            )
+        exec_lua(
+            self.neovim_session, "StatsWinRender(...)", self.buffer, self.namespace, _virt_lines, self._clock_state()
+        )
+
+    def _clock_state(self) -> dict:
+        now = monotonic_ns()
+        last_row = len(self.virt_lines)
+        clock = {
+            "rows": {"white": 1 if self.flip else last_row, "black": last_row if self.flip else 1},
+            "white": self.clock.remaining_ms("white", now),
+            "black": self.clock.remaining_ms("black", now),
+        }
+        next_change_at = self.clock.next_change_at(now)
+        if next_change_at:
+            clock["running"] = self.clock.side
+            clock["next_change"] = (next_change_at - now) // NS_PER_MS
+        return clock
     
-    def handle_gameState_event(self, gameState, board):
-        if not self.gameclock.started:
-            self.gameclock.start()
-        
+    def handle_gameState_event(self, gameState):
+        """the clock must already be synced to gameState"""
         status = gameState["status"]
         spacer = [" ", ""]
         
-        self.gameclock = self._create_gameclock(gameState)
-        if " " in gameState['moves']:
-            self.gameclock.start()
-        
         #lines
         
         self.virt_lines[0] =  [[timems_to_timestring(to_millis(gameState['btime'])), ""], spacer, [timems_to_incstring(to_millis(gameState['binc'])), ""]]
 
-        moves = split_list(self.last_6_moves_in_san(board), 3)
-        new_move_lines = []
-        for ln in moves:            
-            line = []
-            for move in ln:
-                line.append([move, ""])
-                line.append(spacer)
-            new_move_lines.append(line)
+        new_move_lines = self._middle_lines()
         
         if status != "started":
-            self.gameclock.stop()
             score = ""
             if "winner" in gameState:
                 score = self.get_score(gameState['winner'])
@@ -145,10 +173,12 @@ class StatsWin:
                 score = self.get_score("draw")
                 
             new_status_line =  [spacer, [score, ""], spacer, [status, ""]]
-            self.virt_lines[-3] = new_status_line
+            self.virt_lines[-PLAYER_LINES - 1] = new_status_line
         
         
-        self.virt_lines = self.virt_lines[:2] + new_move_lines + self.virt_lines[-3:]
+        self.virt_lines = self.virt_lines[:PLAYER_LINES] + new_move_lines + self.virt_lines[-PLAYER_LINES - 1:]
+        self.virt_lines[PLAYER_LINES - 1] = self._material_line(BLACK)
+        self.virt_lines[-PLAYER_LINES] = self._material_line(WHITE)
         
         self.virt_lines[-1] = [[timems_to_timestring(to_millis(gameState['wtime'])), ""], spacer, [timems_to_incstring(to_millis(gameState['winc'])), ""]]
             
@@ -156,20 +186,24 @@ class StatsWin:
 
             
     def kill_window(self):
-        self.neovim_session.api.win_close(self.window, True)
-        self.neovim_session.api.buf_delete(self.buffer, {"force": True})
+        self.frames.discard(self)
+        exec_lua(self.neovim_session, "StatsWinStop(...)", self.buffer)
+        win_del_force(self.neovim_session, self.window)
+        buf_del_force(self.neovim_session, self.buffer)
 
     def resize(self):
-        self.neovim_session.api.win_set_config(
+        width, height = workspace_size(self.neovim_session)
+        win_set_config(
+            self.neovim_session,
             self.window,
             {
                 "relative": "editor",
-                "row": (workspace_height(self.neovim_session) - 11) // 2,
-                "col": (workspace_width(self.neovim_session) - 30 - 32) // 2, 
+                "row": (height - 11) // 2,
+                "col": (width - 30 - 32) // 2, 
             }
         )
 
-    def _create_stats_extmark_virt_lines(self, gameFull, board):        
+    def _create_stats_extmark_virt_lines(self, gameFull):        
         self.gameFull = gameFull
         self.gameState = gameFull['state']
         white = self.gameFull['white']
@@ -189,24 +223,14 @@ class StatsWin:
             virt_lines.append(
                 [[black['name'], ""], spacer, [black['title'] or "", ""], spacer, [str(black['rating']), ""]]
             )
+        virt_lines.append(self._material_line(BLACK))
         
-        # # wpt = white_pieces_taken(board)
-        # # bpt = black_pieces_taken(board)        
-        
-        
-        moves = split_list(self.last_6_moves_in_san(board), 3)
-        line = []
-        for ln in moves:            
-            line = []
-            for move in ln:
-                line.append([move, ""])
-                line.append(spacer)
-            virt_lines.append(line)
+        virt_lines += self._middle_lines()
             
         virt_lines.append(
             [spacer, ["", ""]]
         )
-        
+        virt_lines.append(self._material_line(WHITE))
         
         if "aiLevel" in white:
             virt_lines.append(
@@ -232,7 +256,8 @@ class StatsWin:
             return "1/2-1/2"
 
     def set_autocmd(self, handle: int):
-        self.neovim_session.api.create_autocmd(
+        create_autocmd(
+            self.neovim_session,
             "BufEnter",
             {
                 "group": self.augroup,
@@ -244,19 +269,30 @@ class StatsWin:
     def _set_current(self):
         self.neovim_session.current.buffer = self.buffer
 
-    def last_6_moves_in_san(self, board: Board):
-        """Returns the last 6 moves in SAN notation with their corresponding numbers in the list e.g `["1.", "e4", "e5", "2.", "Nf3" ...]`"""
-        # change formatted_moves list, change index list
-        last_movestack = board.move_stack[-6:]
-        _board = board.copy()
-        for i in range(len(last_movestack)):
-            _board.pop()
-        _move_list = _board.variation_san(last_movestack).split(" ")
-        if "..." in _move_list[0]:
-            _move_list.pop(0)
-        
-        moves_len = len(_move_list)
-        if  moves_len < 9:
-            _move_list+=[" " for i in range(9-moves_len)]
-            
-        return _move_list
\ No newline at end of file
+    def _material_line(self, color):
+        return [[material_string(self.history.material, color), ""]]
+
+    def _middle_lines(self):
+        return self._move_lines(MIDDLE_LINES - len(self.eval_lines)) + self.eval_lines
+
+    def _eval_lines(self, info: EngineInfo):
+        """score and depth, then as much of the pv as fits, a pv carried over from the last position is marked ~"""
+        depth = f"d{'~' if info.carried else ''}{info.depth}" if info.depth else ""
+        pv = ""
+        for san in info.pv:
+            if len(pv) + len(san) + 1 > LINE_WIDTH:
+                break
+            pv += " " + san
+        return [[["eval ", ""], [info.score, ""], [" ", ""], [depth, ""]], [[pv, ""]]]
+
+    def _move_lines(self, rows: int = MIDDLE_LINES):
+        """the last rows move numbers (up to 2 * rows plies) from the game's MoveHistory"""
+        spacer = [" ", ""]
+        lines = []
+        for row in self.history.tail(rows):
+            line = []
+            for move in row:
+                line.append([move, ""])
+                line.append(spacer)
+            lines.append(line)
+        return lines
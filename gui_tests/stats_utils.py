@@ -1,4 +1,9 @@
-from chess import Board
+from chess import (
+    Board, Move, Color, COLORS, WHITE, PIECE_TYPES, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+    BB_SQUARES, BB_RANK_1, BB_RANK_8, BB_KING_ATTACKS, SquareSet, popcount,
+)
+from chess.variant import AtomicBoard
+from typing import Callable, Optional
 
 def timems_to_incstring(timems: int):
     assert timems <= 180 * 1000, "Increment cannot exceed 180s"
@@ -14,67 +19,101 @@ def timems_to_timestring(timems: int):
     ms = timems % 3600000  # todo
     return f"{ str(h)+':' if h != 0 else '' }{ m if m > 9 else '0'+str(m) }:{ s if s > 9 else '0'+str(s) }"
 
-def white_pieces_taken(board: Board):
-    """ white pieces are refered as uppercase letters"""
-    pieces_taken = {
-        "king": 1,
-        "queen": 1,
-        "pawn" : 8,
-        "knight": 2,
-        "bishop": 2,
-        "rook": 2,
-    }
-    for c in board.board_fen():
-        if c == "K":
-            pieces_taken['king']-=1
-        elif c == "Q":
-            pieces_taken["queen"]-=1
-        elif c == "N":
-            pieces_taken["knight"]-=1
-        elif c == "B":
-            pieces_taken["bishop"]-=1
-        elif c == "P":
-            pieces_taken["pawn"]-=1
-        elif c == "R":
-            pieces_taken["rook"]-=1
-        
-    total = pieces_taken["queen"]*9
-    + pieces_taken['bishop']*3
-    + pieces_taken['knight']*3 
-    + pieces_taken['rook']*5
-    + pieces_taken['pawn']
-
-    return [pieces_taken, total]
-
-def black_pieces_taken(board: Board):
-    """ black pieces are refered as lowercase letters"""
-    pieces_taken = {
-        "king": 1,
-        "queen": 1,
-        "pawn" : 8,
-        "knight": 2,
-        "bishop": 2,
-        "rook": 2,
-    }
-    for c in board.board_fen():
-        if c == "k":
-            pieces_taken['king']-=1
-        elif c == "q":
-            pieces_taken["queen"]-=1
-        elif c == "n":
-            pieces_taken["knight"]-=1
-        elif c == "b":
-            pieces_taken["bishop"]-=1
-        elif c == "p":
-            pieces_taken["pawn"]-=1
-        elif c == "r":
-            pieces_taken["rook"]-=1
-        
-    total = pieces_taken["queen"]*9
-    + pieces_taken['bishop']*3
-    + pieces_taken['knight']*3 
-    + pieces_taken['rook']*5
-    + pieces_taken['pawn']
-
-    return [pieces_taken, total]
+PIECE_VALUES = {PAWN: 1, KNIGHT: 3, BISHOP: 3, ROOK: 5, QUEEN: 9, KING: 0}
+MATERIAL_GLYPHS = {QUEEN: "\u265b", ROOK: "\u265c", BISHOP: "\u265d", KNIGHT: "\u265e", PAWN: "\u265f", KING: "\u265a"}
 
+
+class MaterialTracker:
+    """piece counts of both sides, crazyhouse pockets included
+    counted once from the board's bitboards, then every push only re-reads the squares the move touched
+    (captures, en passant, castling and atomic explosions) so it works for every lichess variant"""
+
+    def __init__(self, board: Board):
+        self.reset(board)
+
+    def reset(self, board: Board):
+        self.counts = {color: [0] * 7 for color in COLORS}
+        for color in COLORS:
+            for piece_type in PIECE_TYPES:
+                self.counts[color][piece_type] = popcount(board.pieces_mask(piece_type, color))
+        for (color, piece_type), count in self._pocket_counts(board).items():
+            self.counts[color][piece_type] += count
+        self.deltas: list[list[tuple[Color, int, int]]] = []
+
+    def push(self, board: Board, move: Move, push: Optional[Callable[[Move], object]] = None):
+        """pushes move with push (board.push by default) and returns what push returned"""
+        touched = self._touched_squares(board, move)
+        before = self._read(board, touched)
+        result = (push or board.push)(move)
+        after = self._read(board, touched)
+
+        delta = []
+        for key in before.keys() | after.keys():
+            change = after.get(key, 0) - before.get(key, 0)
+            if change:
+                delta.append((key[0], key[1], change))
+                self.counts[key[0]][key[1]] += change
+        self.deltas.append(delta)
+        return result
+
+    def pop(self):
+        """call alongside board.pop()"""
+        for color, piece_type, change in self.deltas.pop():
+            self.counts[color][piece_type] -= change
+
+    def value(self, color: Color) -> int:
+        return sum(self.counts[color][piece_type] * value for piece_type, value in PIECE_VALUES.items())
+
+    def balance(self) -> int:
+        """material of white minus material of black"""
+        return self.value(WHITE) - self.value(not WHITE)
+
+    def surplus(self, color: Color) -> dict[int, int]:
+        """piece types color has more of than the other side, like the captured pieces shown on lichess"""
+        surplus = {}
+        for piece_type in (QUEEN, ROOK, BISHOP, KNIGHT, PAWN, KING):
+            count = self.counts[color][piece_type] - self.counts[not color][piece_type]
+            if count > 0:
+                surplus[piece_type] = count
+        return surplus
+
+    def _touched_squares(self, board: Board, move: Move) -> int:
+        mask = BB_SQUARES[move.from_square] | BB_SQUARES[move.to_square]
+        if board.is_en_passant(move):
+            mask |= BB_SQUARES[board.ep_square ^ 8]
+        if board.is_castling(move):
+            mask |= BB_RANK_1 if board.turn == WHITE else BB_RANK_8
+        if isinstance(board, AtomicBoard) and board.is_capture(move):
+            mask |= BB_KING_ATTACKS[move.to_square]
+        return mask
+
+    def _read(self, board: Board, mask: int) -> dict[tuple[Color, int], int]:
+        pieces = self._pocket_counts(board)
+        for square in SquareSet(mask):
+            piece = board.piece_at(square)
+            if piece:
+                key = (piece.color, piece.piece_type)
+                pieces[key] = pieces.get(key, 0) + 1
+        return pieces
+
+    def _pocket_counts(self, board: Board) -> dict[tuple[Color, int], int]:
+        pockets = getattr(board, "pockets", None)
+        if not pockets:
+            return {}
+        return {
+            (color, piece_type): pockets[color].count(piece_type)
+            for color in COLORS
+            for piece_type in PIECE_TYPES
+        }
+
+
+def material_string(material: MaterialTracker, color: Color) -> str:
+    """captured piece glyphs and the material lead of color, e.g `♜♟♟ +3`"""
+    glyphs = ""
+    for piece_type, count in material.surplus(color).items():
+        glyph = MATERIAL_GLYPHS[piece_type]
+        glyphs += glyph * count if count <= 3 else f"{glyph}x{count}"
+    lead = material.balance() if color == WHITE else -material.balance()
+    if lead > 0:
+        glyphs += f" +{lead}"
+    return glyphs
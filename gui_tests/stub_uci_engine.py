@@ -0,0 +1,123 @@
+import sys
+import time
+from argparse import ArgumentParser
+from threading import Event, Thread
+
+from chess import Board
+
+""" a fake UCI engine for trying the analysis mode without a real engine
+    it answers the handshake, follows `position` and on `go` prints an info line with a made up score and a pv
+    of legal moves every 1/rate seconds (depth + 1 each time) until `stop`, the depth limit or the movetime
+    a high --rate floods the analysis with info lines like a real engine at low depths does
+
+    UCI_ENGINE="python3 gui_tests/stub_uci_engine.py --rate 2000"
+    """
+
+
+def pv(board: Board, length: int) -> list[str]:
+    """the first legal move of each position, at most length plies"""
+    board = board.copy(stack=False)
+    moves = []
+    for _ in range(length):
+        move = next(iter(board.legal_moves), None)
+        if move is None:
+            break
+        moves.append(move.uci())
+        board.push(move)
+    return moves
+
+
+class StubEngine:
+    def __init__(self, rate: float, max_depth: int):
+        self.interval = 1 / rate
+        self.max_depth = max_depth
+        self.board = Board()
+        self.stop = Event()
+        self.search: Thread = None
+
+    def send(self, line: str):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    def handle(self, line: str) -> bool:
+        """False on quit"""
+        words = line.split()
+        if not words:
+            return True
+        command = words[0]
+        if command == "uci":
+            self.send("id name StubEngine")
+            self.send("id author chess_on_neovim")
+            self.send("option name Hash type spin default 16 min 1 max 1024")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.board = Board()
+        elif command == "position":
+            self._position(words[1:])
+        elif command == "go":
+            self._stop_search()
+            self.stop.clear()
+            self.search = Thread(target=self._go, args=(words[1:],), daemon=True)
+            self.search.start()
+        elif command == "stop":
+            self._stop_search()
+        elif command == "quit":
+            self._stop_search()
+            return False
+        return True
+
+    def _position(self, words: list[str]):
+        if words[0] == "startpos":
+            self.board = Board()
+            rest = words[1:]
+        else:
+            end = words.index("moves") if "moves" in words else len(words)
+            self.board = Board(" ".join(words[1:end]))
+            rest = words[end:]
+        for move in rest[1:]:
+            self.board.push_uci(move)
+
+    def _go(self, words: list[str]):
+        max_depth = int(words[words.index("depth") + 1]) if "depth" in words else self.max_depth
+        deadline = time.monotonic() + int(words[words.index("movetime") + 1]) / 1000 if "movetime" in words else None
+        board = self.board.copy()
+        moves = pv(board, 8)
+        depth = 0
+        while moves and depth < max_depth and not self.stop.is_set():
+            if deadline and time.monotonic() >= deadline:
+                break
+            depth += 1
+            score = (depth * 7) % 120 - 40
+            self.send(
+                f"info depth {depth} seldepth {depth + 2} score cp {score} nodes {depth * 1000} "
+                f"nps 1000000 time {depth} pv {' '.join(moves[:depth])}"
+            )
+            self.stop.wait(self.interval)
+        # like a real engine it waits for stop while the search is infinite
+        if "infinite" in words:
+            self.stop.wait()
+        self.send(f"bestmove {moves[0] if moves else '(none)'}")
+
+    def _stop_search(self):
+        if self.search:
+            self.stop.set()
+            self.search.join()
+            self.search = None
+
+
+def main():
+    parser = ArgumentParser(description="fake UCI engine for the analysis mode")
+    parser.add_argument("--rate", type=float, default=20, help="info lines per second while searching")
+    parser.add_argument("--depth", type=int, default=30, help="depth the search stops at")
+    args = parser.parse_args()
+
+    engine = StubEngine(args.rate, args.depth)
+    for line in sys.stdin:
+        if not engine.handle(line.strip()):
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
-from time import sleep
-from threading import Thread, Lock
+from collections import deque
 
 from pynvim import attach
 import berserk
@@ -10,21 +9,17 @@ from utils import AppEvent
 from menuWin import MenuWinManager
 from gameWin import GameWinManager
 from errorwin import ErrorWin
+from lichess_runtime import LichessRuntime, StreamStatus
+from channels import EventChannel
+from frame_scheduler import FrameScheduler
+from ongoing_games import OngoingGamesCache
+from lichess_clients import LichessClients
+from incoming_events import IncomingEvents
+from game_sessions import GameSession, GameSessions
+from offline_engine import OfflineEngine
+from offline_game import OfflineGame
+from engine_analysis import EnginePool
 
-
-def read_incoming_events_stream(events: list, client: Client, lock: Lock, unique_stop_flag):
-    for e in client.board.stream_incoming_events():
-        with lock:
-            if unique_stop_flag["stop"]:
-                return      
-            events.append(e)
-            
-def read_game_events_stream(gameId:str, game_events: list, client: Client, lock: Lock, unique_stop_flag: any):
-    for ge in client.board.stream_game_state(game_id=gameId):
-        with lock:
-            if unique_stop_flag["stop"]:
-                return
-            game_events.append(ge)
             
 class Main:
     def __init__(self) -> None:        
@@ -35,159 +30,290 @@ class Main:
             self.neovim_session = attach("tcp", "127.0.0.1", 6789)
         except:
             raise Exception("Oops! Could not connect to a neovim instance. Please try to start it up using `nvim --listen 127.0.0.1:6789`")
+
+        """app_events_channel is the rpc channel the lua AppEventQueue notifies when gui related events are queued"""
+        utils.set_global_var(self.neovim_session, "app_events_channel", self.neovim_session.channel_id)
+        utils.load_lua_file(self.neovim_session, "./gui_tests/lua/eventQueue.lua")
+        # a queue left by a previous run may still be marked notified and would never wake us
+        utils.exec_lua(self.neovim_session, "AppEventQueue.reset()")
             
         self.theme_dir = utils.get_theme_dir()
         self.app_namespace = 0
         self.set_theme(self.theme_dir)        
         
-        self.lock = Lock()
-        self.incoming_events: list = []
-        self.read_incoming_events : Thread = None
-        
-        self.read_game_events: Thread = None
-        self.game_events: list = []
+        """stream events are put on these channels by the runtime thread and drained in batches here"""
+        self.incoming_channel = EventChannel(256, lambda: self.schedule(self.route_incoming_events))
+        self.incoming_dropped = 0
+        self.incoming_events = IncomingEvents(256)
+
+        self.pending_handlers: deque = deque()
+        self.dispatching = False
+        self.error: Exception = None
+        self.awaiting_seek = False
+        """incoming_events seq when the pending seek was created, only a gameStart after it is the seek's game"""
+        self.seek_since = 0
+
+        """lichess streams and requests run as tasks on the runtime's asyncio loop, their results come back through schedule"""
+        self.runtime = LichessRuntime(self.schedule, max_streams=8)
+        """windows mark themselves dirty while handling events and are rendered together once the handlers are done"""
+        self.frames = FrameScheduler(self.neovim_session, max_fps=30, call_later=self.runtime.call_later)
 
+        """the menu and joining games read the account's ongoing games from here instead of fetching them"""
+        self.ongoing_games = OngoingGamesCache(self.runtime)
+
+        """every ongoing game is followed here, the game window shows the focused one"""
+        self.game_sessions = GameSessions(self.runtime, self.schedule, max_streams=self.runtime.max_streams - 1)
+        self.game_sessions.on_event = self.show_game_event
+        self.game_sessions.on_status = self.show_game_stream_status
+        self.game_sessions.on_turn = self.notify_turn
+        self.game_sessions.on_premove = self.show_premove
+        self.game_sessions.on_move_error = self.show_move_error
+        self.game_sessions.on_engine_error = self.show_engine_error
+
+        """searches for offline games run in a worker process, the best move comes back through schedule"""
+        self.offline_engine = OfflineEngine(self.schedule)
+
+        """the local UCI engine for analysis runs on the runtime's loop, started the first time it is asked for"""
+        uci_engine = utils.get_uci_engine()
+        self.engine_pool = EnginePool(uci_engine, self.runtime.loop) if uci_engine else None
+
+        """every berserk client comes from here so they share pooled keep-alive sessions"""
+        self.clients = LichessClients(max_streams=self.runtime.max_streams)
         self.berserk_client: Client = None
+        self.stream_client: Client = None
         self.try_to_login()
         
         self.gameWinManager: GameWinManager = None
-        self.menuWinManager: MenuWinManager = MenuWinManager(self.neovim_session, self.berserk_client)
+        self.menuWinManager: MenuWinManager = MenuWinManager(self.neovim_session, self.runtime, self.ongoing_games, self.incoming_events, self.clients, self.berserk_client)
         
         
         utils.load_lua_file(self.neovim_session, "./gui_tests/lua/main.lua")
-        self.autocmd_group = self.neovim_session.api.create_augroup(
-            "chess_on_neovim_au_group", {"clear": True}
+        self.autocmd_group = utils.create_augroup(
+            self.neovim_session, "chess_on_neovim_au_group", {"clear": True}
         )
-        self.neovim_session.api.create_autocmd(
+        utils.create_autocmd(
+            self.neovim_session,
             "VimResized",
             {
                 "group": self.autocmd_group,
                 "command": "lua ResizeWindows()",
             }
         )
-
-        """app_events will the be the global variable that will have all the gui related events"""
-        utils.set_global_var(self.neovim_session, "app_events", [])
     
     def run(self):
-        try: 
-            self.route_events()
-        except Exception as e:
+        self.neovim_session.run_loop(None, self.handle_notification)
+        if self.engine_pool:
+            self.engine_pool.close()
+        self.runtime.close()
+        self.clients.close()
+        self.offline_engine.close()
+        if self.error:
             if self.gameWinManager:
                 self.gameWinManager.kill_window()
             if self.menuWinManager:
                 self.menuWinManager.kill_window()
-            raise e
+            raise self.error
+
+    def handle_notification(self, name: str, args: list):
+        if name == "app_events_ready":
+            self.dispatch(self.route_app_events)
+
+    def route_app_events(self):
+        for app_event in utils.drain_app_events(self.neovim_session):
+            self.route_app_event(app_event)
+
+    def schedule(self, handler, *args):
+        """thread-safe, runs the handler on the event loop"""
+        self.neovim_session.async_call(self.dispatch, handler, *args)
+
+    def dispatch(self, handler, *args):
+        """Runs the handlers one at a time. A handler waiting on a neovim response lets the
+        loop pick up the next message, so anything arriving meanwhile is queued behind it.
+        The frame flush waits on neovim as well, handlers queued during it run in the next round"""
+        self.pending_handlers.append((handler, args))
+        if self.dispatching:
+            return
+        self.dispatching = True
+        try:
+            while self.pending_handlers:
+                while self.pending_handlers:
+                    handler, args = self.pending_handlers.popleft()
+                    handler(*args)
+                self.frames.flush()
+        except Exception as e:
+            self.error = e
+            self.neovim_session.stop_loop()
+        finally:
+            self.dispatching = False
+
+    def show_game_event(self, session: GameSession, event: dict, received_at: int):
+        if self.gameWinManager and self.gameWinManager.game is session:
+            self.gameWinManager.handle_game_event(event, received_at)
+
+    def show_game_stream_status(self, session: GameSession, status: StreamStatus):
+        if self.gameWinManager and self.gameWinManager.game is session:
+            self.gameWinManager.show_stream_status(status)
+
+    def show_premove(self, session: GameSession, move):
+        if self.gameWinManager and self.gameWinManager.game is session:
+            self.gameWinManager.show_premove(move)
+
+    def show_move_error(self, session: GameSession, e: Exception):
+        if self.gameWinManager and self.gameWinManager.game is session:
+            self.gameWinManager.show_move_error(e)
+
+    def show_engine_error(self, session: GameSession, e: Exception):
+        if self.gameWinManager and self.gameWinManager.game is session:
+            self.gameWinManager.show_engine_error(e)
+
+    def notify_turn(self, session: GameSession):
+        if self.gameWinManager:
+            self.gameWinManager.inputWin.set_extmarks(f" your move vs {session.opponent}, 'next' to switch")
+
+    def report_stream_status(self, status: StreamStatus):
+        if status.key == "incoming" and status.state == "connected" and status.reconnects:
+            # gameStart/gameFinish may have been missed while it was down
+            self.ongoing_games.invalidate()
+        if status.key.startswith("game:"):
+            self.game_sessions.report_status(status)
+
+    def route_incoming_events(self):
+        events = self.incoming_channel.drain()
+        if self.incoming_channel.dropped != self.incoming_dropped:
+            print(f"incoming events: {self.incoming_channel.dropped - self.incoming_dropped} dropped, resyncing the ongoing games")
+            self.incoming_dropped = self.incoming_channel.dropped
+            # a gameStart or gameFinish may be among them
+            self.ongoing_games.invalidate()
+            self.ongoing_games.get(on_done=self.game_sessions.sync)
+        for event in events:
+            self.incoming_events.append(event)
+            self.ongoing_games.handle_incoming_event(event)
+            self.game_sessions.handle_incoming_event(event)
+        if self.awaiting_seek:
+            self.join_started_games()
+
+    def join_started_games(self):
+        """joins the game the pending seek started, once its gameStart arrives"""
+        found = self.incoming_events.latest("gameStart", after=self.seek_since)
+        self.awaiting_seek = found is None
+        if found is None:
+            return
+        _, event = found
+        utils.add_app_events(
+            self.neovim_session,
+            {
+                "page": "Menu",
+                "event": "join_game",
+                "opts": {
+                    "gameId": event['game']['gameId'],
+                    "color": event['game']['color']
+                }
+            }
+        )
+
+    def open_game(self, gameId: str, side: str, ongoing_games: list):
+        """called with the account's ongoing games, opens the game window if the game is still ongoing"""
+        if not self.menuWinManager or self.gameWinManager:
+            return
+        game = next((g for g in ongoing_games if g['gameId'] == gameId), None)
+        if not game:
+            ErrorWin(self.neovim_session, f" Game not found \n Game id: {gameId} \n The game might have ended or \n you entered on nothing :|")    
+            return
+
+        self.menuWinManager.kill_window()
+        self.menuWinManager = None
+
+        # every ongoing game gets a session, switching to one of them does not fetch anything
+        self.game_sessions.sync(ongoing_games)
+        session = self.game_sessions.focus(gameId)
+        self.gameWinManager = GameWinManager(self.neovim_session, session, self.game_sessions, self.berserk_client, self.runtime, self.frames, self.engine_pool)
+
+    def open_offline_game(self, level: int, clock_limit: int, clock_inc: int, color: str):
+        if not self.menuWinManager or self.gameWinManager:
+            return
+        self.menuWinManager.kill_window()
+        self.menuWinManager = None
+
+        game = OfflineGame(self.offline_engine, level, clock_limit, clock_inc, color, call_later=self.runtime.call_later)
+        session = self.game_sessions.add_offline(game)
+        self.game_sessions.focus(session.gameId)
+        self.gameWinManager = GameWinManager(self.neovim_session, session, self.game_sessions, self.berserk_client, self.runtime, self.frames, self.engine_pool)
+
+    def switch_game(self, session: GameSession):
+        if not self.gameWinManager or session is None or session is self.gameWinManager.game:
+            return
+        self.game_sessions.focus(session.gameId)
+        self.gameWinManager.show_game(
+            session, f" game {list(self.game_sessions.sessions).index(session.gameId) + 1}/{len(self.game_sessions)} vs {session.opponent}"
+        )
+
+    def request_open_game(self, gameId: str, side: str):
+        self.ongoing_games.get(
+            on_done=lambda games: self.open_game(gameId, side, games),
+            on_error=lambda e: ErrorWin(self.neovim_session, f" Could not fetch ongoing games \n {e}"),
+        )
             
-    def route_events(self):
-        while True:
-            app_events = utils.get_global_var(self.neovim_session, "app_events")
-            utils.set_global_var(self.neovim_session, "app_events", [])
-            with self.lock:
-                if self.gameWinManager:
-                    self.gameWinManager.decrement_game_clock()
-                
-                for game_event in self.game_events:
-                    
-                    self.gameWinManager.handle_game_event(game_event)
-                    self.game_events.remove(game_event)
+    def route_app_event(self, app_event: AppEvent):
+        print(app_event)
+        
+        #Events from main menu
+        if app_event["page"] == "Menu":
+            if not self.menuWinManager:
+                return
+            if app_event["event"] == "enter":
+                self.menuWinManager.handle_enter_event(app_event["opts"]['line'])
+            
+            elif app_event['event'] == "create_seek":
+                self.seek_since = app_event['opts'].get('since', self.seek_since)
+                self.join_started_games()
 
+            elif app_event['event'] == "start_game_ai":
+                game = app_event['opts']['response']
+                side = app_event['opts']['side']
+                self.request_open_game(game['id'], side)
 
-                for app_event in app_events:
-                    print(app_event)
-                    app_event: AppEvent = app_event
+            elif app_event['event'] == "start_game_offline":
+                options = app_event['opts']
+                self.open_offline_game(options['level'], options['clock_limit'], options['clock_inc'], options['color'])
+                
+            elif app_event['event'] == "join_game":
+                gameId = app_event['opts']['gameId']
+                side = app_event['opts']['color']
+                self.request_open_game(gameId, side)
+
+            elif app_event['event'] == "refresh":
+                self.menuWinManager.refresh()
+        #Events from game window
+        
+        elif app_event['page'] == "Game":
+            if not self.gameWinManager:
+                return
+            if app_event['event'] == "internal":
+                self.gameWinManager.handle_game_event(app_event)
+            elif app_event['event'] == "pass_control":
+                action = app_event['opts']['action']
+                if action == "kill_game_window":
+                    # an offline game only lives while it is shown, there is no lichess to rejoin it from
+                    if self.gameWinManager.game.offline:
+                        self.game_sessions.close(self.gameWinManager.gameId)
+                    self.game_sessions.focus(None)
+                    
+                    self.gameWinManager.kill_window()
+                    self.gameWinManager = None
                     
-                    #Events from main menu
-                    if app_event["page"] == "Menu":
-                        if not self.menuWinManager:
-                            continue
-                        if app_event["event"] == "enter":
-                            self.menuWinManager.handle_enter_event(app_event["opts"]['line'])
-                        
-                        elif app_event['event'] == "create_seek":
-                            gamefound = False
-                            for event in self.incoming_events[::-1]:
-                                if event['type'] != "gameStart":
-                                    continue
-                                
-                                gameId = event['game']['gameId']
-                                side = event['game']['color']
-                                
-                                utils.add_app_events(
-                                    self.neovim_session,
-                                    {
-                                        "page": "Menu",
-                                        "event": "join_game",
-                                        "opts": {
-                                            "gameId": gameId,
-                                            "color": side
-                                        }
-                                    }
-                                )
-                                gamefound = True
-                            if not gamefound:
-                                utils.add_app_events(self.neovim_session, {"page": "Menu", "event": "create_seek", "opts": {}})
-
-                        elif app_event['event'] == "start_game_ai":
-
-                            self.menuWinManager.kill_window()
-                            self.menuWinManager = None
-                            
-                            game = app_event['opts']['response']
-                            side = app_event['opts']['side']
-                            self.gameWinManager = GameWinManager(self.neovim_session, game['id'], self.berserk_client, side)
-                            
-                            self.game_events = []
-                            self.stop_flag = {'stop': False} 
-                            self.read_game_events = Thread(target=read_game_events_stream, args=[game['id'], self.game_events, self.berserk_client, self.lock, self.stop_flag], daemon=True)
-                            self.read_game_events.start()
-                            
-                            
-                        elif app_event['event'] == "join_game":
-                            
-                            gameId = app_event['opts']['gameId']
-                            side = app_event['opts']['color']
-                            self.gameWinManager = GameWinManager(self.neovim_session, gameId, self.berserk_client, side)
-                            if not self.gameWinManager.game:
-                                ErrorWin(self.neovim_session, f" Game not found \n Game id: {app_event['opts']['gameId']} \n The game might have ended or \n you entered on nothing :|")    
-                                continue
-                                                        
-                            self.menuWinManager.kill_window()
-                            self.menuWinManager = None
-                            
-                            self.game_events = []
-                            self.stop_flag = {'stop': False}
-                            self.read_game_events = Thread(target=read_game_events_stream, args=[gameId, self.game_events, self.berserk_client, self.lock, self.stop_flag], daemon=True)
-                            self.read_game_events.start()
-                        elif app_event['event'] == "refresh":
-                            self.menuWinManager.refresh()
-                    #Events from game window
                     
-                    elif app_event['page'] == "Game":
-                        if not self.gameWinManager:
-                            continue
-                        if app_event['event'] == "internal":
-                            self.gameWinManager.handle_game_event(app_event)
-                        elif app_event['event'] == "pass_control":
-                            action = app_event['opts']['action']
-                            if action == "kill_game_window":
-                                if self.read_game_events and self.read_game_events.is_alive():
-                                    self.stop_flag['stop'] = True
-                                    #move reference to avoid garbage collection
-                                    self.temp_thread = self.read_game_events
-                                    self.temps_stop_flag = self.stop_flag
-                                
-                                self.gameWinManager.kill_window()
-                                self.gameWinManager = None
-                                
-                                
-                                self.menuWinManager = MenuWinManager(self.neovim_session, self.berserk_client)
-                            
-                        
-                    # Global Events. Does not matter which window it comes from
-                    elif app_event["page"] == "Global":
-                        self.handle_global_event(app_event['event'], app_event["opts"])
-            sleep(0.1)
+                    self.menuWinManager = MenuWinManager(self.neovim_session, self.runtime, self.ongoing_games, self.incoming_events, self.clients, self.berserk_client)
+                elif action == "switch_game":
+                    options = app_event['opts']
+                    if "gameId" in options:
+                        self.switch_game(self.game_sessions.sessions.get(options['gameId']))
+                    else:
+                        self.switch_game(self.game_sessions.cycle(options['step']))
+                
+            
+        # Global Events. Does not matter which window it comes from
+        elif app_event["page"] == "Global":
+            self.handle_global_event(app_event['event'], app_event["opts"])
                                     
     def handle_global_event(self, event: str, options: dict):
         if event == "exit":
@@ -196,17 +322,18 @@ class Main:
             if self.gameWinManager:
                 self.gameWinManager.kill_window()
             
-            exit()
+            self.neovim_session.stop_loop()
         elif event == "set_api_key":
             self.try_to_login(options['token'])
         elif event == "change_theme":
             self.set_theme(options['theme'])
             utils.set_theme_dir(options['theme'])            
         elif event == "resize":
-            if self.menuWinManager:
-                self.menuWinManager.resize()
-            if self.gameWinManager:
-                self.gameWinManager.resize()
+            with utils.batch(self.neovim_session):
+                if self.menuWinManager:
+                    self.menuWinManager.resize()
+                if self.gameWinManager:
+                    self.gameWinManager.resize()
         
     def set_theme(self, theme_dir_name: str):
         utils.set_highlights_from_file(self.neovim_session, self.app_namespace, theme_dir_name)
@@ -216,22 +343,26 @@ class Main:
     def try_to_login(self, token:str = None):
         _token = token or utils.get_api_key(self.config_file_path)
         try:
-            _session = berserk.TokenSession(_token)
-            _client = Client(_session)
+            _client = self.clients.client(_token)
             _account = _client.account.get()
             self.berserk_client = _client
+            self.stream_client = self.clients.stream_client(_token)
+            self.clients.close_others(_token)
+            self.ongoing_games.set_account(_client, _account['id'])
+            self.game_sessions.set_client(_client, self.stream_client)
+            self.ongoing_games.get(on_done=self.game_sessions.sync)
             
-            if self.read_incoming_events and self.read_incoming_events.is_alive():
-                self.read_incoming_events_stop_flag['stop'] = True
-
-            self.read_incoming_events_stop_flag = { "stop" : False }
-            self.read_incoming_events = Thread(
-                target=read_incoming_events_stream, 
-                args=[self.incoming_events, self.berserk_client, self.lock, self.read_incoming_events_stop_flag],
-                daemon=True)
-            self.read_incoming_events.start()
+            self.runtime.start_stream(
+                "incoming",
+                self.stream_client.board.stream_incoming_events,
+                self.incoming_channel.put,
+                self.report_stream_status,
+            )
         except:
             self.berserk_client = None
+            self.stream_client = None
+            self.ongoing_games.set_account(None, None)
+            self.game_sessions.set_client(None)
         
         
     
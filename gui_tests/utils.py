@@ -1,7 +1,8 @@
 import json
+from contextlib import contextmanager
 from pynvim import Nvim, attach
 from pynvim.api import Buffer, Window
-from typing import Literal, Tuple, Optional, Union, TypedDict, NamedTuple
+from typing import Literal, Tuple, Optional, Union, TypedDict, NamedTuple, Iterator, Sequence
 import os
 
 class ExtmarksOptions(TypedDict, total=False):
@@ -36,21 +37,104 @@ class ExtmarksOptions(TypedDict, total=False):
     url: str
 
 
+
+class NvimBatchError(Exception):
+    def __init__(self, call: list, error_type: int, error_message: str):
+        self.message = f"Batched call {call[0]}{tuple(call[1])} failed: {error_message}"
+        super().__init__(self.message)
+
+
+class Batch:
+    """api calls queued while a `batch(nvim)` block is active, sent as one nvim_call_atomic request"""
+
+    def __init__(self, nvim: Nvim):
+        self.nvim = nvim
+        self.calls: list = []
+        self.results: list = []
+
+    def call(self, method: str, *args):
+        self.calls.append([method, list(args)])
+
+    def flush(self) -> list:
+        """sends the queued calls, returns their results in order and appends them to self.results"""
+        if not self.calls:
+            return []
+        calls, self.calls = self.calls, []
+        results, error = self.nvim.api.call_atomic(calls)
+        self.results += results
+        if error:
+            index, error_type, error_message = error
+            raise NvimBatchError(calls[index], error_type, error_message)
+        return results
+
+
+_active_batches: dict[int, Batch] = {}
+
+
+@contextmanager
+def batch(nvim: Nvim) -> Iterator[Batch]:
+    """
+    the helpers in this module queue their api calls while the block is active
+    and the queue is flushed with one nvim_call_atomic on exit, batch.results has the results in call order
+    helpers that need a result (like create_window) flush what was queued before them first
+    nested blocks join the outermost one
+    """
+    if id(nvim) in _active_batches:
+        yield _active_batches[id(nvim)]
+        return
+
+    _batch = Batch(nvim)
+    _active_batches[id(nvim)] = _batch
+    try:
+        yield _batch
+    except BaseException:
+        _batch.calls = []
+        raise
+    finally:
+        del _active_batches[id(nvim)]
+    _batch.flush()
+
+
+def _call(nvim: Nvim, method: str, *args):
+    """queued while a batch is active, returns None in that case"""
+    _batch = _active_batches.get(id(nvim))
+    if _batch:
+        _batch.call(method, *args)
+        return None
+    return nvim.request(method, *args)
+
+
+def _request(nvim: Nvim, method: str, *args):
+    """always returns the result, flushes the active batch first to keep the call order"""
+    _batch = _active_batches.get(id(nvim))
+    if _batch:
+        _batch.flush()
+    return nvim.request(method, *args)
+
+
 def buf_del_extmark(nvim: Nvim, buffer: Buffer, ns_id: int, id: int):
-    "returns true if extmark was found, false otherwise"
-    return nvim.api.buf_del_extmark(buffer, ns_id, id)
+    "returns true if extmark was found, false otherwise (None when batched)"
+    return _call(nvim, "nvim_buf_del_extmark", buffer, ns_id, id)
 
 
 def win_del_force(nvim: Nvim, win: Window):
-    nvim.api.win_close(win, True)
+    _call(nvim, "nvim_win_close", win, True)
 
 
 def win_is_valid(nvim: Nvim, win: Window):
-    return nvim.api.win_is_valid(win)
+    return _request(nvim, "nvim_win_is_valid", win)
 
 def win_set_local_winhighlight(nvim: Nvim, win: Window, winhighlight: str):
     """ example usage `win_set_local_winhighlight(nvim, nvim.current.window, "Normal:MyBackground,CursorLine:MyCursorLine")`"""
-    nvim.command(f"call win_execute({win.handle}, 'setlocal winhighlight={winhighlight}')")
+    win_set_option(nvim, win, "winhighlight", winhighlight)
+
+
+def win_set_option(nvim: Nvim, win: Window, name: str, value: any):
+    _call(nvim, "nvim_win_set_option", win, name, value)
+
+
+def win_set_config(nvim: Nvim, win: Window, config: dict):
+    _call(nvim, "nvim_win_set_config", win, config)
 
 def buf_set_extmark(
     nvim: Nvim, buffer: Buffer, ns_id: int, line: int, col: int, opts: ExtmarksOptions
@@ -61,9 +145,9 @@ def buf_set_extmark(
     end_row, 0-based inclusive,
     end_col, 0-baed exclusive
 
-    returns the extmark id
+    returns the extmark id (None when batched)
     """
-    return nvim.api.buf_set_extmark(buffer, ns_id, line, col, opts)
+    return _call(nvim, "nvim_buf_set_extmark", buffer, ns_id, line, col, opts)
 
 
 def split_list(lst, n):
@@ -78,7 +162,7 @@ class Highlight(TypedDict):
 
 
 def buf_add_hl(nvim: Nvim, buffer: Buffer, ns_id: int, hl: list):
-    nvim.api.buf_add_highlight(buffer, ns_id, hl[0], hl[1], hl[2], hl[3])
+    _call(nvim, "nvim_buf_add_highlight", buffer, ns_id, hl[0], hl[1], hl[2], hl[3])
 
 
 def buf_set_hls(nvim: Nvim, buffer: Buffer, ns_id: int, hls: list):
@@ -89,7 +173,7 @@ def buf_set_hls(nvim: Nvim, buffer: Buffer, ns_id: int, hls: list):
 def buf_clear_namespace(
     nvim: Nvim, buffer: Buffer, ns_id: int, start_line: int = 0, end_line: int = -1
 ):
-    nvim.api.buf_clear_namespace(buffer, ns_id, start_line, end_line)
+    _call(nvim, "nvim_buf_clear_namespace", buffer, ns_id, start_line, end_line)
 
 
 def buf_del_all_extmarks(
@@ -101,21 +185,33 @@ def buf_del_all_extmarks(
 
 
 def workspace_width(nvim: Nvim) -> int:
-    return int(nvim.command_output("echo &columns"))
+    return _request(nvim, "nvim_get_option_value", "columns", {})
 
 
 def workspace_height(nvim: Nvim) -> int:
-    return int(nvim.command_output("echo &lines"))
+    return _request(nvim, "nvim_get_option_value", "lines", {})
+
+
+def workspace_size(nvim: Nvim) -> Tuple[int, int]:
+    """(width, height) in one round trip"""
+    _batch = _active_batches.get(id(nvim))
+    if _batch:
+        _batch.flush()
+    results, error = nvim.api.call_atomic([
+        ["nvim_get_option_value", ["columns", {}]],
+        ["nvim_get_option_value", ["lines", {}]],
+    ])
+    return results[0], results[1]
 
 
 def buf_set_var(nvim: Nvim, key: str, value: any, buffer: Optional[Buffer] = 0):
     """will be applied to current buffer if buffer not specified"""
-    nvim.api.buf_set_var(buffer, key, value)
+    _call(nvim, "nvim_buf_set_var", buffer, key, value)
 
 
 def buf_get_var(nvim: Nvim, key: str, buffer: Optional[Buffer] = 0):
     """will be applied to current buffer if buffer not specified"""
-    return nvim.api.buf_get_var(buffer, key)
+    return _request(nvim, "nvim_buf_get_var", buffer, key)
 
 
 def message_neovim(nvim: Nvim, message: str):
@@ -126,8 +222,8 @@ def create_buf(
     nvim: Nvim, bufname: str, listed: bool = True, scratch: bool = True
 ) -> Buffer:
     """Listed by default, scratch buffer by default"""
-    buf = nvim.api.create_buf(listed, scratch)
-    buf.name = bufname
+    buf = _request(nvim, "nvim_create_buf", listed, scratch)
+    _call(nvim, "nvim_buf_set_name", buf, bufname)
     return buf
 
 
@@ -136,9 +232,19 @@ def list_buf_names(nvim: Nvim) -> any:
 
 
 def find_buf(nvim: Nvim, bufname) -> Optional[Buffer]:
-    b = nvim.buffers._fetch_buffers()
-    for buf in b:
-        if buf.name.endswith(bufname):
+    """lists the buffers and their names in one round trip"""
+    _batch = _active_batches.get(id(nvim))
+    if _batch:
+        _batch.flush()
+    (buffers, names), error = nvim.api.call_atomic([
+        ["nvim_list_bufs", []],
+        ["nvim_exec_lua", [
+            "local names = {} for i, b in ipairs(vim.api.nvim_list_bufs()) do names[i] = vim.api.nvim_buf_get_name(b) end return names",
+            [],
+        ]],
+    ])
+    for buf, name in zip(buffers, names):
+        if name.endswith(bufname):
             return buf
     return None
 
@@ -156,7 +262,7 @@ def buf_set_text(
     {start_col} Starting column (byte offset) on first line
     {end_row} Last line index, inclusive
     {end_col} Ending column (byte offset) on last line, exclusive"""
-    nvim.api.buf_set_text(buf, start_row, start_col, end_row, end_col, text)
+    _call(nvim, "nvim_buf_set_text", buf, start_row, start_col, end_row, end_col, text)
 
 
 def buf_set_lines(
@@ -169,7 +275,7 @@ def buf_set_lines(
 ):
     """clears everything if startline and endline not set
     Strict_indexing is on by default. To change set strict_indexing=False"""
-    nvim.api.buf_set_lines(buf, start_line, end_line, strict_indexing, text)
+    _call(nvim, "nvim_buf_set_lines", buf, start_line, end_line, strict_indexing, text)
 
 
 # nvim_buf_set_text({buffer}, {start_row}, {start_col}, {end_row}, {end_col}, {replacement})
@@ -178,7 +284,7 @@ def buf_set_lines(
 def create_window(
     nvim: Nvim, buf: Buffer, enter: bool, config: dict, title: str
 ) -> Window:
-    _w = nvim.api.open_win(buf, enter, config)
+    _w = _request(nvim, "nvim_open_win", buf, enter, config)
     if title:
         window_set_title(nvim, _w, title)
 
@@ -187,13 +293,21 @@ def create_window(
 
 def hide_window(nvim: Nvim, window: Window):
     """Closes window, Hides buffer"""
-    nvim.api.win_hide(window)
+    _call(nvim, "nvim_win_hide", window)
 
 
 class BadFenError(Exception):
     pass
 
 
+class AmbiguousMoveError(ValueError):
+    def __init__(self, text: str, sans: Sequence[str] = ()):
+        """sans are the moves text matches"""
+        self.sans = list(sans)
+        self.message = f"{text} Matches {' Or '.join(sans)}" if sans else f"{text} Matches More Than One Move"
+        super().__init__(self.message)
+
+
 def config_gen(
     nvim: Nvim,
     win: Optional[Window] = None,
@@ -203,7 +317,7 @@ def config_gen(
     row: Optional[int] = None,
     col: Optional[int] = None,
     z_index: int = 50,
-    config: Union[Literal["center", "menu", "board", "info", "error"], dict] = False,
+    config: Union[Literal["center", "menu", "board", "info", "error", "movelist"], dict] = False,
     minimal: bool = False,
     border: Literal["none", "single", "double", "rounded", "solid", "shadow"] = "none",
 ):
@@ -211,6 +325,9 @@ def config_gen(
         "border": border,
     }
 
+    if config in ("menu", "board", "stats", "error", "input", "movelist"):
+        editor_width, editor_height = workspace_size(nvim)
+
     if minimal:
         _config["style"] = "minimal"
 
@@ -228,8 +345,8 @@ def config_gen(
 
         _config.update(
             {
-                "row": (workspace_height(nvim) - _config["height"]) // 2,
-                "col": (workspace_width(nvim) - _config["width"]) // 2,
+                "row": (editor_height - _config["height"]) // 2,
+                "col": (editor_width - _config["width"]) // 2,
             }
         )
     elif config == "board":
@@ -240,14 +357,15 @@ def config_gen(
                 "height": 8 + 1 + 1,
                 "focusable": True,
                 "zindex": z_index,
+                "style": "minimal",
                 "border": "rounded"                
             }
         )
 
         _config.update(
             {
-                "row": (workspace_height(nvim) - _config["height"]) // 2,
-                "col": (workspace_width(nvim) - _config["width"] + 32) // 2,
+                "row": (editor_height - _config["height"]) // 2,
+                "col": (editor_width - _config["width"] + 32) // 2,
             }
         )
     elif config == "stats":
@@ -267,8 +385,29 @@ def config_gen(
 
         _config.update(
             {
-                "row": (workspace_height(nvim) - _config["height"]) // 2,
-                "col": (workspace_width(nvim) - _config["width"] - 32) // 2,
+                "row": (editor_height - _config["height"]) // 2,
+                "col": (editor_width - _config["width"] - 32) // 2,
+            }
+        )
+    elif config == "movelist":
+        _config.update(
+            {
+                "relative": "editor",
+                "width": 22,
+                "height": 10,
+                "focusable": True,
+                "external": False,
+                "zindex": z_index,
+                "style": "minimal",
+                "border": "rounded"
+            }
+        )
+
+        # right of the board window
+        _config.update(
+            {
+                "row": (editor_height - _config["height"]) // 2,
+                "col": (editor_width - 28 + 32) // 2 + 31,
             }
         )
     elif config == "info":
@@ -304,8 +443,8 @@ def config_gen(
 
         _config.update(
             {
-                "row": (workspace_height(nvim) - _config["height"]) // 2,
-                "col": (workspace_width(nvim) - _config["width"]) // 2,
+                "row": (editor_height - _config["height"]) // 2,
+                "col": (editor_width - _config["width"]) // 2,
             }
         )
     elif config == "input":
@@ -324,43 +463,57 @@ def config_gen(
         )
         _config.update(
             {
-                "row": (workspace_height(nvim) - _config["height"] - 20) // 2,
-                "col": (workspace_width(nvim) - _config["width"]) // 2,
+                "row": (editor_height - _config["height"] - 20) // 2,
+                "col": (editor_width - _config["width"]) // 2,
             }
         )
 
     return _config
 
 
+def set_current_win(nvim: Nvim, win: Window):
+    _call(nvim, "nvim_set_current_win", win)
+
+
 def set_cursor(nvim: Nvim, win: Window, pos: Tuple[int, int] = (0, 0)):
-    nvim.api.win_set_cursor(win, pos)
+    _call(nvim, "nvim_win_set_cursor", win, pos)
 
 
 def window_set_title(nvim: Nvim, win: Window, title: str):
-    nvim.api.win_set_var(win, "window_title", title)
+    _call(nvim, "nvim_win_set_var", win, "window_title", title)
 
 
 def window_get_title(nvim: Nvim, win: Window) -> Optional[str]:
     try:
-        return nvim.api.win_get_var(win, "window_title")
+        return _request(nvim, "nvim_win_get_var", win, "window_title")
     except:
         return None
 
 
 def window_set_var(nvim: Nvim, win: Window, key: str, value: str):
-    nvim.api.win_set_var(win, key, value)
+    _call(nvim, "nvim_win_set_var", win, key, value)
 
 
 def window_get_var(nvim: Nvim, win: Window, key: str) -> Optional[str]:
     try:
-        return nvim.api.win_get_var(win, key)
+        return _request(nvim, "nvim_win_get_var", win, key)
     except:
         return None
 
 
 def find_window_from_title(nvim: Nvim, title: str) -> Optional[Window]:
-    for w in nvim.windows:
-        wt: str = window_get_title(nvim, w)
+    """lists the windows and their titles in one round trip"""
+    _batch = _active_batches.get(id(nvim))
+    if _batch:
+        _batch.flush()
+    (windows, titles), error = nvim.api.call_atomic([
+        ["nvim_list_wins", []],
+        ["nvim_exec_lua", [
+            "local titles = {} for i, w in ipairs(vim.api.nvim_list_wins()) do titles[i] = vim.w[w].window_title or vim.NIL end return titles",
+            [],
+        ]],
+    ])
+    for w, wt in zip(windows, titles):
         if wt == title:
             return w
     return None
@@ -369,7 +522,7 @@ def find_window_from_title(nvim: Nvim, title: str) -> Optional[Window]:
 def load_lua_file(nvim: Nvim, lua_file_path: str):
     with open(lua_file_path, "r") as luafile:
         lua = luafile.read()
-        nvim.exec_lua(lua) 
+        exec_lua(nvim, lua)
 
 def buf_set_keymap(nvim: Nvim, lhs: str, rhs: str, silent: bool = True, insertmodeaswell: bool = False):
     mapcommand = "noremap <buffer>"
@@ -377,11 +530,11 @@ def buf_set_keymap(nvim: Nvim, lhs: str, rhs: str, silent: bool = True, insertmo
     mapcommand += " "
     mapcommand += rhs
     
-    nvim.api.command(mapcommand)
+    command(nvim, mapcommand)
 
     if insertmodeaswell:
         mapcommand = "i" + mapcommand
-        nvim.api.command(mapcommand)
+        command(nvim, mapcommand)
 
 
 def noremap_lua_callback(
@@ -395,7 +548,7 @@ def noremap_lua_callback(
 ):
     with open(lua_file_path, "r") as luafile:
         lua = luafile.read()
-        nvim.exec_lua(lua)
+        exec_lua(nvim, lua)
 
         mapcommand = "noremap "
 
@@ -406,48 +559,71 @@ def noremap_lua_callback(
         mapcommand += " "
         mapcommand += rhs
 
-        nvim.api.command(mapcommand)
+        command(nvim, mapcommand)
 
         if insertmodeaswell:
             mapcommand = "i" + mapcommand
-            nvim.api.command(mapcommand)
+            command(nvim, mapcommand)
+
+
+def command(nvim: Nvim, cmd: str):
+    _call(nvim, "nvim_command", cmd)
+
+
+def exec_lua(nvim: Nvim, code: str, *args):
+    """returns the lua return value (None when batched)"""
+    return _call(nvim, "nvim_exec_lua", code, list(args))
+
+
+def create_augroup(nvim: Nvim, name: str, opts: dict) -> int:
+    return _request(nvim, "nvim_create_augroup", name, opts)
+
+
+def create_autocmd(nvim: Nvim, event: Union[str, list[str]], opts: dict):
+    _call(nvim, "nvim_create_autocmd", event, opts)
 
 
 def force_redraw(nvim: Nvim):
-    nvim.command("redraw!")
+    command(nvim, "redraw!")
+
+
+def redraw(nvim: Nvim):
+    """only redraws what changed, prefer going through a FrameScheduler over calling this directly"""
+    command(nvim, "redraw")
 
 
 def get_global_var(nvim: Nvim, key: str) -> Optional[any]:
     """do NOT include the g: at the begining of the variable key"""
     try:
-        return nvim.api.get_var(key)
+        return _request(nvim, "nvim_get_var", key)
     except:
         return None
 
 
 def set_global_var(nvim: Nvim, key: str, value: any):
     """do NOT include the g: at the begining of the variable key"""
-    nvim.api.set_var(key, value)
+    _call(nvim, "nvim_set_var", key, value)
 
 
 def add_app_events(nvim: Nvim, events: Union[list[dict], dict]):
-    app_events: list = get_global_var(nvim, "app_events")
-    if isinstance(events, list):
-        for e in events:
-            app_events.append(e)
-        
-        set_global_var(nvim, "app_events", app_events)
-    else:
-        app_events.append(events)
-        set_global_var(nvim, "app_events", app_events)
-        
+    """appends to the lua AppEventQueue (lua/eventQueue.lua) in a single call,
+    so python side events are dispatched in order with the keypress events"""
+    if not isinstance(events, list):
+        events = [events]
+    exec_lua(nvim, "for _, e in ipairs(...) do AppEventQueue.append(e) end", events)
+
+
+def drain_app_events(nvim: Nvim) -> list:
+    """returns and clears every queued app event in one round trip"""
+    return _request(nvim, "nvim_exec_lua", "return AppEventQueue.drain()", [])
+
 def buf_del_force(nvim: Nvim, buffer: Buffer):
-    nvim.api.buf_delete(buffer.handle, {"force": True})
+    _call(nvim, "nvim_buf_delete", buffer, {"force": True})
 
 
 def namespace(nvim: Nvim, ns_name: str):
     """creates or finds a namepsace"""
-    return nvim.api.create_namespace(ns_name)
+    return _request(nvim, "nvim_create_namespace", ns_name)
 
 def get_theme_dir(config_file_path = ".config"):
     with open(config_file_path, "r") as file:
@@ -458,6 +634,20 @@ def get_theme_dir(config_file_path = ".config"):
                 return pairs[1].removesuffix("\n").replace("\"", "").replace("\'", "")
 
 
+def get_uci_engine(config_file_path = ".config"):
+    """command of the local UCI engine for analysis (UCI_ENGINE="stockfish"), None when there is none"""
+    try:
+        with open(config_file_path, "r") as file:
+            lines = file.readlines()
+    except OSError:
+        return None
+    for line in lines:
+        pairs = line.strip().split("=", 1)
+        if pairs[0] == "UCI_ENGINE" and len(pairs) == 2:
+            return pairs[1].strip().strip("\"\'") or None
+    return None
+
+
 def write_api_key(token: str, config_file_path: str = ".config"):
         lines = None
         with open(config_file_path, "r") as file:
@@ -538,6 +728,10 @@ class ThemeFileNotFound(Exception):
         self.message = f"{theme_file_path} Does Not Exist"
         super().__init__(self.message)
 
+def set_hl(nvim: Nvim, hl_ns: int, hl_group_name: str, opts: dict):
+    _call(nvim, "nvim_set_hl", hl_ns, hl_group_name, opts)
+
+
 def set_highlights_from_file(nvim: Nvim, hl_ns: int, theme_dir: str, file_name: Optional[str] = ".theme"):
     """Use 0 as highlight namespace for setting to global namespace"""
     theme_file_path = f"./themes/{theme_dir}/{file_name}"
@@ -545,7 +739,8 @@ def set_highlights_from_file(nvim: Nvim, hl_ns: int, theme_dir: str, file_name:
     if not os.path.exists(theme_file_path):
         raise ThemeFileNotFound(theme_file_path)
     
-    with open(theme_file_path, "r") as file:
+    # all the highlights are sent in one request, a broken theme file leaves the current theme untouched
+    with open(theme_file_path, "r") as file, batch(nvim):
         lines = file.readlines()
 
         hl_group_name: str = None
@@ -562,9 +757,7 @@ def set_highlights_from_file(nvim: Nvim, hl_ns: int, theme_dir: str, file_name:
 
             if line.startswith("[") or line == "{endfile}":
                 if hl_group_name:
-                    nvim.api.set_hl(
-                        hl_ns, hl_group_name, opts
-                    )
+                    set_hl(nvim, hl_ns, hl_group_name, opts)
 
                 hl_group_name = line.replace("[", "").replace("]", "")
                 opts = {}
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# the app's modules import each other by name from gui_tests, the way threadingmain.py is run
+GUI_TESTS = Path(__file__).resolve().parent.parent / "gui_tests"
+sys.path.insert(0, str(GUI_TESTS))
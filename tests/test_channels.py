@@ -0,0 +1,71 @@
+from threading import Thread
+
+from channels import EventChannel
+
+
+def test_consumer_is_woken_once_per_batch():
+    wakeups = []
+    channel = EventChannel(8, lambda: wakeups.append(1))
+    channel.put(1)
+    channel.put(2)
+    assert len(wakeups) == 1
+    assert channel.drain() == [1, 2]
+    channel.put(3)
+    assert len(wakeups) == 2 and channel.drain() == [3]
+
+
+def test_full_channel_drops_and_counts_the_oldest():
+    channel = EventChannel(3, lambda: None)
+    for event in range(5):
+        channel.put(event)
+    assert channel.drain() == [2, 3, 4]
+    assert channel.dropped == 2
+
+
+def snapshot_key(event: tuple):
+    game, kind, _ = event
+    return game if kind == "state" else None
+
+
+def test_full_snapshot_channel_keeps_every_other_event_and_the_latest_snapshots():
+    channel = EventChannel(4, lambda: None, coalesce=snapshot_key)
+    events = [
+        ("a", "full", 0), ("a", "state", 1), ("b", "state", 1), ("a", "chat", 2),
+        ("a", "state", 3), ("b", "full", 4), ("b", "state", 5), ("a", "state", 6),
+    ]
+    for event in events:
+        channel.put(event)
+    drained = channel.drain()
+    assert len(drained) < len(events) and channel.dropped == 0
+    # nothing but superseded snapshots is missing and the order is kept
+    assert [event for event in events if event in drained] == drained
+    assert all(event in drained for event in events if event[1] != "state")
+    assert drained[-2:] == [("b", "state", 5), ("a", "state", 6)]
+
+
+def test_snapshot_channel_grows_rather_than_dropping():
+    channel = EventChannel(4, lambda: None, coalesce=snapshot_key)
+    for n in range(100):
+        channel.put(("a", "chat", n))
+    assert [n for _, _, n in channel.drain()] == list(range(100))
+    assert channel.dropped == 0
+
+
+def test_put_from_several_threads():
+    channel = EventChannel(64, lambda: None, coalesce=snapshot_key)
+
+    def produce(game):
+        for n in range(2000):
+            channel.put((game, "state" if n % 2 else "chat", n))
+
+    threads = [Thread(target=produce, args=(game,)) for game in "abc"]
+    for thread in threads:
+        thread.start()
+    drained = []
+    while any(thread.is_alive() for thread in threads):
+        drained += channel.drain()
+    drained += channel.drain()
+    for game in "abc":
+        chats = [n for g, kind, n in drained if g == game and kind == "chat"]
+        assert chats == list(range(0, 2000, 2))
+        assert [n for g, kind, n in drained if g == game and kind == "state"][-1] == 1999
@@ -0,0 +1,152 @@
+import asyncio
+import queue
+import shlex
+import sys
+import time
+from threading import Thread
+
+import pytest
+from chess import Board
+
+from conftest import GUI_TESTS
+from engine_analysis import Analysis, EngineInfo, EnginePool
+
+STUB = shlex.join([sys.executable, str(GUI_TESTS / "stub_uci_engine.py")])
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    thread = Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(2)
+
+
+@pytest.fixture
+def pool(loop):
+    pool = EnginePool(STUB + " --rate 1000 --depth 100000", loop, size=1)
+    yield pool
+    pool.close()
+
+
+def on_loop(loop, fn):
+    """fn() evaluated on the loop, the pool is only touched there"""
+    async def call():
+        return fn()
+    return asyncio.run_coroutine_threadsafe(call(), loop).result(2)
+
+
+class Ui:
+    """stands in for Main.schedule, everything delivered lands in a queue"""
+
+    def __init__(self):
+        self.delivered = queue.Queue()
+
+    def deliver(self, fn, *args):
+        self.delivered.put((time.monotonic(), fn, args))
+
+    def infos(self, seconds: float) -> list[tuple[float, EngineInfo]]:
+        infos = []
+        deadline = time.monotonic() + seconds
+        while (left := deadline - time.monotonic()) > 0:
+            try:
+                at, fn, args = self.delivered.get(timeout=left)
+            except queue.Empty:
+                break
+            fn(*args)
+            infos.append((at, args[0]))
+        return infos
+
+    def first_info(self, seconds: float = 10) -> EngineInfo:
+        at, fn, args = self.delivered.get(timeout=seconds)
+        fn(*args)
+        return args[0]
+
+
+def test_flood_of_info_lines_is_throttled(pool):
+    ui = Ui()
+    analysis = Analysis(pool, ui.deliver, lambda info: None, max_rate=4)
+    analysis.set_position(Board(), "game")
+    ui.first_info()
+    infos = ui.infos(1.5)
+    # the stub prints 1000 lines per second, at most 4 per second get through
+    assert 2 <= len(infos) <= 8
+    gaps = [later[0] - earlier[0] for earlier, later in zip(infos, infos[1:])]
+    assert min(gaps) >= 0.2
+    assert all(info.pv and info.score for _, info in infos)
+    analysis.close()
+
+
+def test_pv_is_carried_to_the_next_position(pool):
+    ui = Ui()
+    analysis = Analysis(pool, ui.deliver, lambda info: None)
+    board = Board()
+    analysis.set_position(board, "game")
+    info = ui.first_info()
+    # the stub's pv is the first legal move of each position
+    assert info.pv[0] == "Nh3"
+    while len(info.pv) < 3:
+        info = ui.first_info()
+
+    board.push_san("Nh3")
+    analysis.set_position(board, "game")
+    # lines of the old position may still be queued ahead of it
+    carried = ui.first_info()
+    while not carried.carried:
+        assert carried.pv[0] == "Nh3"
+        carried = ui.first_info()
+    assert carried.pv[0] == "Nh6"
+    assert len(carried.pv) >= len(info.pv) - 1
+    assert carried.depth >= info.depth - 1
+    fresh = ui.first_info()
+    assert not fresh.carried and fresh.pv[0] == "Nh6"
+    analysis.close()
+
+
+def test_same_position_does_not_restart(pool):
+    ui = Ui()
+    analysis = Analysis(pool, ui.deliver, lambda info: None, max_rate=20)
+    analysis.set_position(Board(), "game")
+    ui.first_info()
+    ui.infos(0.3)
+    deepest = max(info.depth for _, info in ui.infos(0.3))
+    analysis.set_position(Board(), "game")
+    # a restart would report from depth 1 again
+    assert min(info.depth for _, info in ui.infos(0.3)) >= deepest
+    analysis.close()
+
+
+def test_close_gives_the_engine_back_to_the_pool(loop, pool):
+    ui = Ui()
+    analysis = Analysis(pool, ui.deliver, lambda info: None)
+    analysis.set_position(Board(), "game")
+    ui.first_info()
+    engine = on_loop(loop, lambda: next(iter(pool.engines)))
+    analysis.close()
+    deadline = time.monotonic() + 5
+    while not on_loop(loop, lambda: pool.idle) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert on_loop(loop, lambda: list(pool.idle)) == [engine]
+    # nothing is delivered after close
+    assert ui.infos(0.5) == []
+
+    again = Analysis(pool, ui.deliver, lambda info: None)
+    again.set_position(Board(), "other game")
+    ui.first_info()
+    assert on_loop(loop, lambda: list(pool.engines)) == [engine]
+    again.close()
+
+    pool.close()
+    assert on_loop(loop, lambda: len(pool.engines)) == 0
+    assert engine.returncode.done()
+
+
+def test_game_over_position_skips_the_engine(pool):
+    ui = Ui()
+    analysis = Analysis(pool, ui.deliver, lambda info: None)
+    analysis.set_position(Board("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1"))
+    info = ui.first_info()
+    assert info.score == "1-0" and info.pv == []
+    analysis.close()
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from game_clock import GameClock, NS_PER_MS
+
+# a monotonic_ns reading, 0 would mean "now" to the clock
+T = 10**12
+
+
+def state(moves: str, wtime: int, btime: int, status: str = "started") -> dict:
+    epoch = datetime(1970, 1, 1)
+    return {
+        "moves": moves,
+        "wtime": epoch + timedelta(milliseconds=wtime),
+        "btime": epoch + timedelta(milliseconds=btime),
+        "winc": epoch,
+        "binc": epoch,
+        "status": status,
+    }
+
+
+def test_clock_waits_for_both_first_moves():
+    clock = GameClock.from_state(state("e2e4", 60_000, 60_000), received_at=T)
+    assert not clock.started
+    assert clock.remaining_ms("black", now=T + 10_000 * NS_PER_MS) == 60_000
+
+
+def test_running_side_counts_down_from_the_sync():
+    clock = GameClock.from_state(state("e2e4 e7e5", 60_000, 55_000), received_at=T)
+    assert clock.started and clock.side == "white"
+    assert clock.remaining_ms("white", now=T + 1_500 * NS_PER_MS) == 58_500
+    assert clock.remaining_ms("black", now=T + 1_500 * NS_PER_MS) == 55_000
+    assert clock.remaining_ms("white", now=T + 100_000 * NS_PER_MS) == 0
+
+
+def test_latency_sample_from_our_move():
+    clock = GameClock.from_state(state("e2e4 e7e5", 60_000, 60_000), received_at=T)
+    clock.move_sent = (2, T)
+    clock.sync(state("e2e4 e7e5 g1f3", 59_000, 60_000), received_at=T + 200 * NS_PER_MS)
+    # half the round trip, smoothed
+    assert clock.latency_ns == round(100 * NS_PER_MS * GameClock.LATENCY_SMOOTHING)
+    assert clock.move_sent is None
+
+
+def test_finished_game_stops_the_clock():
+    clock = GameClock.from_state(state("e2e4 e7e5", 60_000, 60_000), received_at=T)
+    clock.sync(state("e2e4 e7e5", 60_000, 60_000, status="resign"), received_at=T)
+    assert not clock.started
+    assert clock.next_change_at(now=T + NS_PER_MS) is None
+
+
+def test_next_change_at_the_next_displayed_second():
+    clock = GameClock.from_state(state("e2e4 e7e5", 10_250, 60_000), received_at=T)
+    assert clock.next_change_at(now=T) == T + 251 * NS_PER_MS
+
+
+def test_black_runs_first_in_a_game_from_a_position_with_black_to_move():
+    clock = GameClock.from_state(state("e7e5 d2d4", 60_000, 55_000), received_at=T, first_side="black")
+    assert clock.started and clock.side == "black"
+    assert clock.remaining_ms("black", now=T + 1_000 * NS_PER_MS) == 54_000
+    clock.sync(state("e7e5 d2d4 e5d4", 60_000, 54_000), received_at=T + 2_000 * NS_PER_MS)
+    assert clock.side == "white"
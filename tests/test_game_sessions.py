@@ -0,0 +1,181 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from chess import Move
+
+from game_sessions import GameSessions
+
+T = 10**12
+
+
+def state(moves: str, status: str = "started") -> dict:
+    epoch = datetime(1970, 1, 1, 0, 1)
+    return {
+        "type": "gameState", "moves": moves, "wtime": epoch, "btime": epoch,
+        "winc": datetime(1970, 1, 1), "binc": datetime(1970, 1, 1), "status": status,
+    }
+
+
+def game_full(moves: str) -> dict:
+    return {"type": "gameFull", "variant": {"key": "standard"}, "initialFen": "startpos", "state": state(moves)}
+
+
+class FakeRuntime:
+    """records the requests instead of running them, no stream is started without a stream client"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        self.submitted.append((fn, args, on_error))
+
+    def stop(self, key: str):
+        pass
+
+
+def open_game(color: str, moves: str = ""):
+    runtime = FakeRuntime()
+    sessions = GameSessions(runtime, lambda fn: None)
+    sessions.client = SimpleNamespace(board=SimpleNamespace(make_move=lambda game_id, move: None))
+    sessions.premoves_sent = []
+    sessions.on_premove = lambda session, move: sessions.premoves_sent.append(move)
+    session = sessions.open({"gameId": "g1", "color": color, "variant": {"key": "standard"}})
+    stream(sessions, game_full(moves))
+    return runtime, sessions, session
+
+
+def stream(sessions: GameSessions, event: dict):
+    sessions.events.put(("g1", T, event))
+    sessions.route_events()
+
+
+def sent_moves(runtime: FakeRuntime) -> list[str]:
+    return [args[1] for _, args, _ in runtime.submitted]
+
+
+def played(session) -> str:
+    return " ".join(move.uci() for move in session.history.moves)
+
+
+def test_premove_is_sent_after_the_opponents_move():
+    runtime, sessions, session = open_game("black")
+    session.add_premove("e5")
+    assert sent_moves(runtime) == []
+    stream(sessions, state("e2e4"))
+    assert sent_moves(runtime) == ["e7e5"]
+    assert sessions.premoves_sent == [Move.from_uci("e7e5")]
+    assert not session.premoves
+    # drawn right away, the opponent's move is not waited on again
+    assert played(session) == "e2e4 e7e5"
+
+
+def test_premoves_are_sent_one_per_opponent_move():
+    runtime, sessions, session = open_game("black")
+    session.add_premove("e5")
+    session.add_premove("Nc6")
+    stream(sessions, state("e2e4"))
+    stream(sessions, state("e2e4 e7e5"))
+    assert sent_moves(runtime) == ["e7e5"]
+    stream(sessions, state("e2e4 e7e5 g1f3"))
+    assert sent_moves(runtime) == ["e7e5", "b8c6"]
+
+
+def test_premove_illegal_after_the_opponents_move_drops_the_queue():
+    runtime, sessions, session = open_game("black", "e2e4 f7f6")
+    session.add_premove("g5")
+    session.add_premove("Nc6")
+    # Qh5+, g5 does not answer the check
+    stream(sessions, state("e2e4 f7f6 d1h5"))
+    assert sent_moves(runtime) == []
+    assert sessions.premoves_sent == [None]
+    assert not session.premoves
+
+
+def test_premoves_are_dropped_when_our_move_is_played_elsewhere():
+    runtime, sessions, session = open_game("black", "e2e4")
+    session.add_premove("Nc6")
+    # we answered e5 and white Nf3 from the website, Nc6 was queued for black's first move
+    stream(sessions, game_full("e2e4 e7e5 g1f3"))
+    assert not session.premoves
+    assert sent_moves(runtime) == []
+    session.add_premove("Nf6")
+    assert session.input_moves() is not None
+
+
+def test_pending_move_is_confirmed_by_the_stream():
+    runtime, sessions, session = open_game("white")
+    sessions.submit_move(session, Move.from_uci("e2e4"))
+    assert sent_moves(runtime) == ["e2e4"] and played(session) == "e2e4"
+    # a draw offer before lichess processed our move, it stays on top
+    stream(sessions, state(""))
+    assert session.pending and played(session) == "e2e4"
+    stream(sessions, state("e2e4"))
+    assert session.pending is None and played(session) == "e2e4"
+    stream(sessions, state("e2e4 e7e5"))
+    assert played(session) == "e2e4 e7e5" and session.my_turn
+
+
+def test_pending_move_is_rolled_back_when_lichess_refuses_it():
+    runtime, sessions, session = open_game("white", "e2e4 e7e5")
+    errors = []
+    sessions.on_move_error = lambda session, e: errors.append(e)
+    sessions.submit_move(session, Move.from_uci("g1f3"))
+    assert played(session) == "e2e4 e7e5 g1f3" and not session.awaiting_move
+    _, _, on_error = runtime.submitted[-1]
+    on_error(ValueError("Not your turn"))
+    assert played(session) == "e2e4 e7e5" and session.awaiting_move
+    assert len(errors) == 1
+
+
+def test_pending_move_is_taken_back_when_the_game_ended_without_it():
+    runtime, sessions, session = open_game("white", "e2e4 e7e5")
+    sessions.submit_move(session, Move.from_uci("g1f3"))
+    # the opponent resigned before our move arrived
+    stream(sessions, state("e2e4 e7e5", status="resign"))
+    assert session.pending is None and played(session) == "e2e4 e7e5"
+
+
+def test_stream_diverging_from_the_pending_move_wins():
+    runtime, sessions, session = open_game("white", "e2e4 e7e5")
+    sessions.submit_move(session, Move.from_uci("g1f3"))
+    stream(sessions, state("e2e4 e7e5 f1c4"))
+    assert session.pending is None and played(session) == "e2e4 e7e5 f1c4"
+    assert session.board.fen() == "rnbqkbnr/pppp1ppp/8/4p3/2B1P3/8/PPPP1PPP/RNBQK1NR b KQkq - 1 2"
+
+
+def test_game_full_resyncs_a_reconnected_stream():
+    runtime, sessions, session = open_game("white", "e2e4")
+    kept = session.history.moves[0]
+    # moves played while the stream was down, plies already on the board are not pushed again
+    stream(sessions, game_full("e2e4 e7e5 g1f3 b8c6 f1b5"))
+    assert played(session) == "e2e4 e7e5 g1f3 b8c6 f1b5"
+    assert session.history.moves[0] is kept
+    session.add_premove("Ba4")
+    # a takeback while the stream was down, the premove was queued against a position that is gone
+    stream(sessions, game_full("e2e4 e7e5 g1f3 b8c6"))
+    assert played(session) == "e2e4 e7e5 g1f3 b8c6" and not session.premoves
+    assert session.board.fen() == "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3"
+    assert session.apply(game_full("e2e4 e7e5 g1f3 b8c6")) is False
+
+
+def test_clock_of_a_game_from_a_position_with_black_to_move():
+    sessions = GameSessions(FakeRuntime(), lambda fn: None)
+    session = sessions.open({"gameId": "g1", "color": "white", "variant": {"key": "fromPosition"}})
+    event = game_full("e7e5 d2d4")
+    event["variant"] = {"key": "fromPosition"}
+    event["initialFen"] = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+    stream(sessions, event)
+    assert session.clock.side == "black" and not session.my_turn
+
+
+def test_flood_of_game_states_is_coalesced_not_dropped():
+    sessions = GameSessions(FakeRuntime(), lambda fn: None, buffer=4)
+    session = sessions.open({"gameId": "g1", "color": "white", "variant": {"key": "standard"}})
+    moves = "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7".split()
+    sessions.events.put(("g1", T, game_full("")))
+    for ply in range(1, len(moves) + 1):
+        sessions.events.put(("g1", T, state(" ".join(moves[:ply]))))
+    sessions.events.put(("g1", T, {"type": "chatLine", "text": "gg"}))
+    assert len(sessions.events) <= 4 and sessions.events.dropped == 0
+    sessions.route_events()
+    assert played(session) == " ".join(moves)
@@ -0,0 +1,49 @@
+from incoming_events import IncomingEvents, event_id
+
+
+def game_start(game_id: str) -> dict:
+    return {"type": "gameStart", "game": {"gameId": game_id}}
+
+
+def challenge(challenge_id: str) -> dict:
+    return {"type": "challenge", "challenge": {"id": challenge_id}}
+
+
+def test_event_id():
+    assert event_id(game_start("g1")) == "g1"
+    assert event_id({"type": "gameFinish", "game": {"id": "g2"}}) == "g2"
+    assert event_id(challenge("c1")) == "c1"
+    assert event_id({"type": "other"}) is None
+
+
+def test_latest_and_since_after_a_seq():
+    events = IncomingEvents(8)
+    events.append(game_start("old"))
+    since = events.last_seq
+    events.append(challenge("c1"))
+    events.append(game_start("new"))
+    seq, event = events.latest("gameStart", after=since)
+    assert seq == 3 and event["game"]["gameId"] == "new"
+    assert events.latest("gameStart", after=seq) is None
+    assert [e["game"]["gameId"] for _, e in events.since("gameStart")] == ["old", "new"]
+
+
+def test_eviction_drops_the_indexes():
+    events = IncomingEvents(4)
+    events.append(game_start("g0"))
+    events.append(challenge("c0"))
+    for index in range(4):
+        events.append(challenge(f"c{index + 1}"))
+    assert len(events) == 4
+    assert events.get(1) is None and events.get(2) is None
+    assert events.get(6)["challenge"]["id"] == "c4"
+    assert "gameStart" not in events.by_type
+    assert events.for_id("g0") is None and events.for_id("c0") is None
+    assert [seq for seq, _ in events.since("challenge")] == [3, 4, 5, 6]
+
+
+def test_for_id_is_the_latest_event_of_the_game():
+    events = IncomingEvents(8)
+    events.append(game_start("g1"))
+    events.append({"type": "gameFinish", "game": {"gameId": "g1"}})
+    assert events.for_id("g1")["type"] == "gameFinish"
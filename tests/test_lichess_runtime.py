@@ -0,0 +1,216 @@
+import queue
+import time
+from threading import Event
+
+import pytest
+
+import lichess_runtime
+from lichess_runtime import LichessRuntime, current_stream
+
+_closed = object()
+
+
+class FakeStream:
+    """a blocking line iterator like a streamed http response, close() makes a blocked read fail"""
+
+    def __init__(self, lines=(), attach: bool = True, connect: bool = False):
+        self.lines: queue.Queue = queue.Queue()
+        for line in lines:
+            self.lines.put(line)
+        self.closed = Event()
+        handle = current_stream()
+        if attach:
+            handle.attach(self.close)
+        if connect:
+            handle.connected()
+
+    def close(self):
+        self.closed.set()
+        self.lines.put(_closed)
+
+    def end(self):
+        self.lines.put(StopIteration)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.lines.get()
+        if line is _closed:
+            raise ConnectionError("connection closed")
+        if line is StopIteration:
+            raise StopIteration
+        return line
+
+
+class Opener:
+    """open_stream for start_stream, every attempt takes the next scripted step"""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.streams: list[FakeStream] = []
+        self.attempts = 0
+
+    def __call__(self):
+        self.attempts += 1
+        step = self.steps.pop(0) if self.steps else ConnectionError("down")
+        if isinstance(step, Exception):
+            raise step
+        stream = step()
+        self.streams.append(stream)
+        return stream
+
+
+class Ui:
+    def __init__(self):
+        self.delivered: queue.Queue = queue.Queue()
+        self.events: queue.Queue = queue.Queue()
+
+    def deliver(self, fn, *args):
+        fn(*args)
+
+    def on_status(self, status):
+        self.delivered.put(status)
+
+    def status(self, timeout: float = 5):
+        return self.delivered.get(timeout=timeout)
+
+    def event(self, timeout: float = 5):
+        return self.events.get(timeout=timeout)
+
+
+@pytest.fixture
+def ui():
+    return Ui()
+
+
+@pytest.fixture
+def runtime(ui):
+    runtime = LichessRuntime(ui.deliver, max_streams=2, backoff=0.02, max_backoff=0.2)
+    yield runtime
+    runtime.close()
+
+
+def start(runtime, ui, opener, key="game:a"):
+    runtime.start_stream(key, opener, ui.events.put, ui.on_status)
+
+
+def test_backoff_is_exponential_capped_and_jittered(monkeypatch):
+    runtime = LichessRuntime(lambda fn, *a: fn(*a), backoff=1, max_backoff=30)
+    try:
+        monkeypatch.setattr(lichess_runtime, "uniform", lambda low, high: high)
+        assert [runtime._backoff_delay(failures) for failures in (1, 2, 3, 6, 10)] == [1, 2, 4, 30, 30]
+        monkeypatch.setattr(lichess_runtime, "uniform", lambda low, high: low)
+        assert [runtime._backoff_delay(failures) for failures in (1, 2, 6)] == [0.5, 1, 15]
+    finally:
+        runtime.close()
+
+
+def test_events_and_connected_on_the_first_line(runtime, ui):
+    opener = Opener(lambda: FakeStream(["gameFull", "gameState"]))
+    start(runtime, ui, opener)
+    assert ui.event() == "gameFull" and ui.event() == "gameState"
+    status = ui.status()
+    assert status.state == "connected" and status.reconnects == 0 and status.connect_ms is not None
+    # once per attempt, not per line
+    opener.streams[0].lines.put("gameState 2")
+    assert ui.event() == "gameState 2"
+    with pytest.raises(queue.Empty):
+        ui.status(timeout=0.1)
+
+
+def test_connected_when_the_response_arrives(runtime, ui):
+    # a quiet stream is connected as soon as its headers are in, not at its first line
+    start(runtime, ui, Opener(lambda: FakeStream(connect=True)))
+    status = ui.status()
+    assert status.state == "connected"
+    with pytest.raises(queue.Empty):
+        ui.status(timeout=0.1)
+
+
+def test_failures_back_off_until_the_stream_works_again(runtime, ui):
+    opener = Opener(ConnectionError("refused"), ConnectionError("refused"), lambda: FakeStream(["gameFull"]))
+    start(runtime, ui, opener)
+    first, second = ui.status(), ui.status()
+    assert (first.state, first.reconnects) == ("reconnecting", 1)
+    assert (second.state, second.reconnects) == ("reconnecting", 2)
+    assert 0.01 <= first.retry_in <= 0.02 and 0.02 <= second.retry_in <= 0.04
+    assert isinstance(first.error, ConnectionError)
+    assert ui.event() == "gameFull"
+    connected = ui.status()
+    assert (connected.state, connected.reconnects) == ("connected", 2)
+
+    # the stream worked, its drop starts again from the shortest backoff
+    opener.steps.append(lambda: FakeStream(["gameFull again"]))
+    opener.streams[0].end()
+    dropped = ui.status()
+    assert dropped.state == "reconnecting" and dropped.reconnects == 3 and dropped.retry_in <= 0.02
+    assert dropped.error is None
+    assert ui.event() == "gameFull again"
+    assert ui.status().state == "connected"
+
+
+def test_stop_closes_a_blocked_read(runtime, ui):
+    opener = Opener(lambda: FakeStream(["gameFull"]))
+    start(runtime, ui, opener)
+    assert ui.event() == "gameFull"
+    ui.status()
+    stream = opener.streams[0]
+    pending = runtime.streams["game:a"].pending
+    runtime.stop("game:a")
+    assert stream.closed.wait(1)
+    # the stream thread returns right away instead of waiting for the next line
+    pending.exception(timeout=1)
+    time.sleep(0.1)
+    assert opener.attempts == 1
+    assert "game:a" not in runtime.tasks and "game:a" not in runtime.streams
+    with pytest.raises(queue.Empty):
+        ui.status(timeout=0.1)
+
+
+def test_stop_while_connecting(runtime, ui):
+    opening, release = Event(), Event()
+
+    def slow_open():
+        opening.set()
+        release.wait(5)
+        return FakeStream(["gameFull"])
+
+    opener = Opener(slow_open)
+    start(runtime, ui, opener)
+    assert opening.wait(1)
+    runtime.stop("game:a")
+    time.sleep(0.05)
+    release.set()
+    # the stream opened after the stop is closed as soon as it attaches, it is never read or reported
+    deadline = time.monotonic() + 1
+    while not opener.streams and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert opener.streams[0].closed.wait(1)
+    with pytest.raises(queue.Empty):
+        ui.event(timeout=0.2)
+    assert ui.delivered.empty()
+    assert opener.attempts == 1
+
+
+def test_restarting_a_key_replaces_its_stream(runtime, ui):
+    first = Opener(lambda: FakeStream(["first"]))
+    start(runtime, ui, first)
+    assert ui.event() == "first"
+    second = Opener(lambda: FakeStream(["second"]))
+    start(runtime, ui, second)
+    assert ui.event() == "second"
+    assert first.streams[0].closed.wait(1)
+    assert len(runtime.streams) == 1
+
+
+def test_close_returns_with_streams_blocked(ui):
+    runtime = LichessRuntime(ui.deliver, max_streams=2, backoff=0.02)
+    openers = [Opener(lambda: FakeStream(["gameFull"])) for _ in range(2)]
+    for n, opener in enumerate(openers):
+        start(runtime, ui, opener, key=f"game:{n}")
+        assert ui.event() == "gameFull"
+    started = time.monotonic()
+    runtime.close()
+    assert time.monotonic() - started < 1
+    assert all(opener.streams[0].closed.is_set() for opener in openers)
@@ -0,0 +1,50 @@
+from chess import BLACK, KNIGHT, PAWN, QUEEN, WHITE, Board, Move
+from chess.variant import AtomicBoard, CrazyhouseBoard
+
+from move_history import MoveHistory
+from stats_utils import MaterialTracker, material_string
+
+
+def test_material_follows_captures_and_takebacks():
+    board = Board()
+    history = MoveHistory(board)
+    for uci in "e2e4 d7d5 e4d5 d8d5 b1c3 d5a5".split():
+        history.push(board, Move.from_uci(uci))
+    assert history.material.balance() == 0
+    board.set_fen("4k3/8/8/3n4/4P3/8/8/4K3 w - - 0 1")
+    history.reset(board)
+    history.push(board, Move.from_uci("e4d5"))
+    assert history.material.balance() == 1
+    assert history.material.surplus(WHITE) == {PAWN: 1}
+    assert material_string(history.material, WHITE) == "♟ +1"
+    history.pop(board)
+    assert history.material.balance() == -2
+    assert history.material.surplus(BLACK) == {KNIGHT: 1}
+
+
+def test_material_en_passant_and_castling():
+    board = Board("4k3/8/8/3Pp3/8/8/8/R3K3 w Q e6 0 1")
+    tracker = MaterialTracker(board)
+    tracker.push(board, Move.from_uci("d5e6"))
+    assert tracker.counts[BLACK][PAWN] == 0
+    tracker.push(board, Move.from_uci("e8d8"))
+    tracker.push(board, Move.from_uci("e1c1"))
+    assert tracker.balance() == 6
+
+
+def test_material_atomic_explosion_and_crazyhouse_pockets():
+    board = AtomicBoard("4k3/8/8/2npn3/3Q4/8/8/4K3 w - - 0 1")
+    tracker = MaterialTracker(board)
+    tracker.push(board, Move.from_uci("d4d5"))
+    # the queen, the captured pawn and the knights around d5 explode
+    assert tracker.counts[WHITE][QUEEN] == 0
+    assert tracker.counts[BLACK][PAWN] == 0 and tracker.counts[BLACK][KNIGHT] == 0
+
+    board = CrazyhouseBoard()
+    tracker = MaterialTracker(board)
+    for uci in "e2e4 d7d5 e4d5 g8f6".split():
+        tracker.push(board, Move.from_uci(uci))
+    # the captured pawn is in white's pocket, material stays even on the board and in hand
+    assert tracker.counts[WHITE][PAWN] == 9 and tracker.counts[BLACK][PAWN] == 7
+    tracker.push(board, Move.from_uci("P@e6"))
+    assert tracker.counts[WHITE][PAWN] == 9
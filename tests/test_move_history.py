@@ -0,0 +1,53 @@
+from chess import Board, Move
+
+from move_history import KEYFRAME_INTERVAL, MoveHistory
+
+GAME = (
+    "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6 c2c3 e8g8 "
+    "h2h3 c6b8 d2d4 b8d7 c3c4 c7c6 c4b5 a6b5 b1c3 c8b7 c1g5 b5b4 c3b1 h7h6"
+).split()
+
+
+def played(moves=GAME, board=None):
+    board = board or Board()
+    history = MoveHistory(board)
+    for uci in moves:
+        history.push(board, Move.from_uci(uci))
+    return board, history
+
+
+def test_push_and_pop_keep_the_sans():
+    board, history = played(["e2e4", "e7e5", "g1f3"])
+    assert history.sans == ["e4", "e5", "Nf3"]
+    assert history.row_count() == 2
+    assert history.pop(board) == Move.from_uci("g1f3")
+    assert history.sans == ["e4", "e5"] and len(board.move_stack) == 2
+    assert history.row(0) == ["1.", "e4", "e5"]
+
+
+def test_rows_start_with_black_from_a_position():
+    board = Board("4k3/8/8/8/8/8/4P3/4K3 b - - 0 7")
+    _, history = played(["e8d8", "e2e4"], board)
+    assert history.row(0) == ["7.", "...", "Kd8"]
+    assert history.row(1) == ["8.", "e4", " "]
+    assert history.tail(3)[-1] == [" ", " ", " "]
+
+
+def test_keyframes_rebuild_every_ply():
+    board, history = played()
+    assert len(history.keyframes) == len(GAME) // KEYFRAME_INTERVAL + 1
+    replay = Board()
+    for ply, uci in enumerate(GAME):
+        assert history.position(ply).fen() == replay.fen()
+        replay.push_uci(uci)
+    assert history.position(len(GAME)).fen() == board.fen()
+
+
+def test_pop_drops_keyframes_past_the_end():
+    board, history = played()
+    while len(history) > KEYFRAME_INTERVAL - 1:
+        history.pop(board)
+    assert len(history.keyframes) == 1
+    history.push(board, Move.from_uci(GAME[KEYFRAME_INTERVAL - 1]))
+    assert len(history.keyframes) == 2
+    assert history.position(KEYFRAME_INTERVAL).fen() == board.fen()
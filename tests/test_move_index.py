@@ -0,0 +1,78 @@
+import pytest
+from chess import Board, Move
+from chess.variant import ThreeCheckBoard
+
+import move_index
+from move_index import MoveIndex, PositionIndex, position_key
+from utils import AmbiguousMoveError
+
+
+def test_spellings_of_a_move():
+    index = PositionIndex(Board())
+    knight = Move.from_uci("g1f3")
+    for text in ("Nf3", "g1f3", "nf3"):
+        assert index.lookup(text) == knight
+
+
+def test_capture_check_and_castling_forms():
+    board = Board("r3k2r/8/8/3p4/4P3/8/8/R3K2R w KQkq - 0 1")
+    index = PositionIndex(board)
+    assert index.lookup("exd5") == index.lookup("ed5") == Move.from_uci("e4d5")
+    assert index.lookup("O-O") == index.lookup("0-0") == index.lookup("oo") == Move.from_uci("e1g1")
+    assert index.lookup("O-O-O") == Move.from_uci("e1c1")
+
+
+def test_exact_spelling_wins_over_a_lowercase_one():
+    # "bc4" is the b-pawn's capture, the bishop's "Bc4" only matches with the capital B
+    board = Board("4k3/8/8/8/2p5/1P6/8/4KB2 w - - 0 1")
+    index = PositionIndex(board)
+    assert index.lookup("Bc4") == index.lookup("Bxc4") == Move.from_uci("f1c4")
+    assert index.lookup("bc4") == index.lookup("bxc4") == Move.from_uci("b3c4")
+    assert index.lookup("f1c4") == Move.from_uci("f1c4")
+
+
+def test_illegal_move():
+    with pytest.raises(ValueError):
+        PositionIndex(Board()).lookup("Nf6")
+
+
+def test_completions_name_one_move():
+    completions = PositionIndex(Board()).completions()
+    assert completions["nf3"] == "Nf3"
+    assert None not in completions.values()
+
+
+def test_move_index_caches_positions():
+    cache = MoveIndex(maxsize=2)
+    board = Board()
+    first = cache.position(board)
+    assert cache.position(Board()) is first
+    for uci in ("e2e4", "e7e5", "g1f3"):
+        board.push_uci(uci)
+        cache.position(board)
+    assert len(cache.positions) == 2
+    assert position_key(Board()) not in cache.positions
+
+
+def test_ambiguous_lowercase_spelling_names_its_moves(monkeypatch):
+    # standard spellings always leave one exact form, two extra castling spellings stage the collision
+    monkeypatch.setattr(move_index, "CASTLING_FORMS", {"O-O": ("Oo",), "O-O-O": ("oO",)})
+    index = PositionIndex(Board("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"))
+    assert index.lookup("Oo") == Move.from_uci("e1g1")
+    with pytest.raises(AmbiguousMoveError) as error:
+        index.lookup("oo")
+    assert error.value.sans == ["O-O", "O-O-O"]
+    assert "O-O Or O-O-O" in error.value.message
+    # sent on by the lua side instead of being taken for a typo
+    assert index.completions()["oo"] is False
+    assert index.completions()["Oo"] == "O-O"
+
+
+def test_three_check_positions_differ_by_the_checks_left():
+    cache = MoveIndex()
+    board = ThreeCheckBoard("rnbqkbnr/ppp2ppp/8/3pp3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 3 +0+0")
+    last_check = ThreeCheckBoard("rnbqkbnr/ppp2ppp/8/3pp3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 3 +2+0")
+    assert position_key(board) != position_key(last_check)
+    assert cache.position(board).sans != cache.position(last_check).sans
+    # the third check ends the game, it is a mate in SAN
+    assert "Bb5#" in cache.position(last_check).sans and "Bb5+" in cache.position(board).sans
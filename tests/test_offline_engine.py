@@ -0,0 +1,34 @@
+import pytest
+from chess import Board
+
+from offline_engine import LEVELS, MATE, Search
+
+# busy middlegames, depth 1 with quiescence over every capture costs more than level 1's node budget
+POSITIONS = [
+    "r1b2rk1/2q1bppp/p2p1n2/np2p3/3PP3/5N1P/PPBN1PP1/R1BQR1K1 b - - 0 13",
+    "r1bq1rk1/pp3ppp/2nbpn2/3p4/2PP4/2NBPN2/PP3PPP/R1BQ1RK1 w - - 0 9",
+]
+
+
+def run(fen: str, level: int):
+    board = Board(fen)
+    return board, Search(board.copy(), LEVELS[level], {}, 100_000).run()
+
+
+@pytest.mark.parametrize("level", sorted(LEVELS))
+def test_every_level_finishes_depth_one(level):
+    for fen in POSITIONS:
+        board, result = run(fen, level)
+        assert result.depth >= 1
+        assert board.is_legal(board.parse_uci(result.move))
+
+
+def test_mate_in_one():
+    _, result = run("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", 8)
+    assert result.move == "d1d8"
+    assert result.score == MATE - 1
+
+
+def test_no_legal_moves():
+    _, result = run("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1", 1)
+    assert result.move is None and result.score == -MATE
@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ongoing_games
+from ongoing_games import OngoingGamesCache
+
+
+class FakeRuntime:
+    """keeps the requests for the test to complete, like the runtime delivering them on the ui loop"""
+
+    def __init__(self):
+        self.requests = []
+        self.timers = set()
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        self.requests.append(SimpleNamespace(fn=fn, on_done=on_done, on_error=on_error))
+
+    def start_timer(self, key, interval, on_tick):
+        self.timers.add(key)
+
+    def stop(self, key):
+        self.timers.discard(key)
+
+
+def account_client():
+    return SimpleNamespace(games=SimpleNamespace(get_ongoing=lambda max_games: []))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(ongoing_games, "monotonic", lambda: now.value)
+    return now
+
+
+def logged_in(ttl: float = 60):
+    runtime = FakeRuntime()
+    cache = OngoingGamesCache(runtime, ttl=ttl)
+    client = account_client()
+    cache.set_account(client, "alice")
+    return runtime, cache, client
+
+
+def test_readers_share_one_fetch_until_the_ttl(clock):
+    runtime, cache, client = logged_in()
+    results = []
+    cache.get(results.append)
+    cache.get(results.append)
+    # set_account's refresh is the only request, the readers wait on it
+    assert len(runtime.requests) == 1 and runtime.requests[0].fn is client.games.get_ongoing
+    runtime.requests[0].on_done(["game 1"])
+    assert results == [["game 1"], ["game 1"]]
+
+    clock.value += 59
+    cache.get(results.append)
+    assert len(runtime.requests) == 1 and results[-1] == ["game 1"]
+    clock.value += 2
+    cache.get(results.append)
+    assert len(runtime.requests) == 2 and len(results) == 3
+
+
+def test_refresh_keeps_serving_the_current_games(clock):
+    runtime, cache, _ = logged_in()
+    runtime.requests[0].on_done(["game 1"])
+    cache.refresh()
+    results = []
+    cache.get(results.append)
+    assert results == [["game 1"]]
+    runtime.requests[1].on_done(["game 1", "game 2"])
+    cache.get(results.append)
+    assert results[-1] == ["game 1", "game 2"]
+
+
+def test_invalidation_in_flight_fetches_again(clock):
+    runtime, cache, _ = logged_in()
+    runtime.requests[0].on_done(["game 1"])
+    results = []
+    cache.handle_incoming_event({"type": "gameStart"})
+    cache.get(results.append)
+    assert len(runtime.requests) == 2
+    # a second game started before the first fetch came back
+    cache.invalidate()
+    runtime.requests[1].on_done(["game 1", "game 2"])
+    assert results == [] and len(runtime.requests) == 3
+    runtime.requests[2].on_done(["game 1", "game 2", "game 3"])
+    assert results == [["game 1", "game 2", "game 3"]]
+
+
+def test_other_events_keep_the_entry(clock):
+    runtime, cache, _ = logged_in()
+    runtime.requests[0].on_done(["game 1"])
+    cache.handle_incoming_event({"type": "challenge"})
+    assert cache.entries["alice"].games == ["game 1"] and len(runtime.requests) == 1
+
+
+def test_failed_fetch_reaches_the_readers(clock):
+    runtime, cache, _ = logged_in()
+    errors = []
+    cache.get(lambda games: None, errors.append)
+    runtime.requests[0].on_error(TimeoutError())
+    assert len(errors) == 1 and not cache.entries["alice"].fetching
+
+
+def test_logout_in_flight_does_not_fetch_again(clock):
+    runtime, cache, _ = logged_in()
+    errors = []
+    cache.get(lambda games: None, errors.append)
+    cache.invalidate()
+    cache.set_account(None, None)
+    runtime.requests[0].on_done(["game 1"])
+    assert len(runtime.requests) == 1
+    assert len(errors) == 1 and cache.entries["alice"].games is None
+    assert not runtime.timers
+
+
+def test_switching_accounts_in_flight_keeps_the_entries_apart(clock):
+    runtime, cache, alice = logged_in()
+    cache.invalidate()
+    bob = account_client()
+    cache.set_account(bob, "bob")
+    assert runtime.requests[-1].fn is bob.games.get_ongoing
+    runtime.requests[0].on_done(["alice's game"])
+    # nothing is asked with bob's client for alice's entry, nor written into it
+    assert [request.fn for request in runtime.requests] == [alice.games.get_ongoing, bob.games.get_ongoing]
+    assert cache.entries["alice"].games is None
+    runtime.requests[1].on_done(["bob's game"])
+    results = []
+    cache.get(results.append)
+    assert results == [["bob's game"]]